@@ -0,0 +1,184 @@
+"""
+Table-valued analyses over the state arrays.
+
+Every function here answers a question for all bodies or pairs at once,
+from plain pos/vel/mass arrays, so the console can run it on the analysis
+worker on a commands.Snapshot while the simulation keeps stepping:
+
+    pos, vel, mass, bodies, n_bodies = commands.request(Snapshot(state))
+    table = commands.analyse(lagrange_table, pos, vel, mass, parent_rows(bodies, n_bodies)).result()
+
+Nearest neighbours use a uniform grid over all rows, so a scene with a
+million particles is answered in one pass instead of N² distances.
+"""
+import numpy as np
+from numba import njit, prange
+
+@njit(parallel=True, cache=True)
+def distance_matrix(pos):
+    """(K, K) distances between the rows of pos."""
+    K = pos.shape[0]
+    d = np.zeros((K, K))
+    for i in prange(K):
+        for j in range(i + 1, K):
+            dx = pos[j, 0] - pos[i, 0]
+            dy = pos[j, 1] - pos[i, 1]
+            dz = pos[j, 2] - pos[i, 2]
+            d[i, j] = np.sqrt(dx * dx + dy * dy + dz * dz)
+    for i in range(K):
+        for j in range(i):
+            d[i, j] = d[j, i]
+    return d
+
+def grid_shape(pos, per_cell=2.0):
+    """Origin, cell size and cell counts of a grid over pos with about `per_cell` rows per cell."""
+    lo = pos.min(axis=0)
+    extent = pos.max(axis=0) - lo
+    extent = np.maximum(extent, extent.max() * 1e-9 + 1e-300)
+    n = len(pos)
+    cell = (np.prod(extent) * per_cell / n) ** (1 / 3)
+    # Flat scenes (a disk) would get far more cells than rows; grow the cells until they don't
+    while np.prod(np.ceil(extent / cell)) > 2 * n + 8:
+        cell *= 1.26
+    return lo, cell, np.ceil(extent / cell).astype(np.int64) + 1
+
+@njit(cache=True)
+def build_grid(pos, lo, cell, shape):
+    """Rows sorted by cell and the start of every cell in that order (counting sort)."""
+    n = pos.shape[0]
+    cells = np.empty(n, dtype=np.int64)
+    starts = np.zeros(shape[0] * shape[1] * shape[2] + 1, dtype=np.int64)
+    for k in range(n):
+        ix = int((pos[k, 0] - lo[0]) / cell)
+        iy = int((pos[k, 1] - lo[1]) / cell)
+        iz = int((pos[k, 2] - lo[2]) / cell)
+        c = (ix * shape[1] + iy) * shape[2] + iz
+        cells[k] = c
+        starts[c + 1] += 1
+    for c in range(starts.shape[0] - 1):
+        starts[c + 1] += starts[c]
+    fill = starts[:-1].copy()
+    order = np.empty(n, dtype=np.int64)
+    for k in range(n):
+        order[fill[cells[k]]] = k
+        fill[cells[k]] += 1
+    return order, starts
+
+@njit(parallel=True, cache=True)
+def nearest_in_grid(pos, queries, lo, cell, shape, starts):
+    """Nearest other row and its distance for every query row of pos in cell order, searching shells of cells outwards."""
+    m = queries.shape[0]
+    index = np.full(m, -1, dtype=np.int64)
+    distance = np.full(m, np.inf)
+    widest = max(shape[0], max(shape[1], shape[2]))
+    for q in prange(m):
+        i = queries[q]
+        cx = int((pos[i, 0] - lo[0]) / cell)
+        cy = int((pos[i, 1] - lo[1]) / cell)
+        cz = int((pos[i, 2] - lo[2]) / cell)
+        best = np.inf
+        best_j = -1
+        for r in range(widest):
+            for ix in range(max(cx - r, 0), min(cx + r, shape[0] - 1) + 1):
+                for iy in range(max(cy - r, 0), min(cy + r, shape[1] - 1) + 1):
+                    edge = abs(ix - cx) == r or abs(iy - cy) == r
+                    # Only the cells on the surface of the cube of radius r are new
+                    step = 1 if edge else 2 * r
+                    iz = cz - r
+                    while iz <= cz + r:
+                        if 0 <= iz < shape[2]:
+                            c = (ix * shape[1] + iy) * shape[2] + iz
+                            for j in range(starts[c], starts[c + 1]):
+                                if j == i:
+                                    continue
+                                dx = pos[j, 0] - pos[i, 0]
+                                dy = pos[j, 1] - pos[i, 1]
+                                dz = pos[j, 2] - pos[i, 2]
+                                d2 = dx * dx + dy * dy + dz * dz
+                                if d2 < best:
+                                    best = d2
+                                    best_j = j
+                        iz += max(step, 1)
+            # Rows outside this shell are at least r cells away
+            if best_j >= 0 and best <= (r * cell) ** 2:
+                break
+        index[q] = best_j
+        distance[q] = np.sqrt(best)
+    return index, distance
+
+def nearest_neighbours(pos, queries=None):
+    """Index of and distance to the nearest other row for each row in `queries` (all rows by default)."""
+    pos = np.ascontiguousarray(pos, dtype=np.float64)
+    queries = np.arange(len(pos)) if queries is None else np.asarray(queries, dtype=np.int64)
+    if len(pos) < 2:
+        return np.full(len(queries), -1, dtype=np.int64), np.full(len(queries), np.inf)
+    lo, cell, shape = grid_shape(pos)
+    order, starts = build_grid(pos, lo, cell, shape)
+    # Rows cluster (belts, rings), so shrink the cells while the occupied ones are crowded
+    for _ in range(3):
+        counts = np.diff(starts)
+        crowding = counts.sum() / np.count_nonzero(counts) / 2.0
+        smaller = cell / min(crowding, 8.0) ** (1 / 3)
+        shape_smaller = np.ceil((pos.max(axis=0) - lo) / smaller).astype(np.int64) + 1
+        if crowding < 1.5 or np.prod(shape_smaller) > 16 * len(pos) + 8:
+            break
+        cell, shape = smaller, shape_smaller
+        order, starts = build_grid(pos, lo, cell, shape)
+    # Searching a copy in cell order, queries included, keeps neighbouring lookups in cache
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    ranks = rank[queries]
+    by_cell = np.argsort(ranks)
+    index = np.empty(len(queries), dtype=np.int64)
+    distance = np.empty(len(queries))
+    found, distance[by_cell] = nearest_in_grid(pos[order], ranks[by_cell], lo, cell, shape, starts)
+    index[by_cell] = order[found]
+    return index, distance
+
+
+def parent_rows(bodies, n_bodies):
+    """Row of each named body's parent, or -1 for bodies without one in the state."""
+    rows = {id(b): i for i, b in enumerate(bodies[:n_bodies])}
+    return np.array([rows.get(id(b.parent), -1) if b.parent is not None else -1 for b in bodies[:n_bodies]], dtype=np.int64)
+
+def lagrange_table(pos, vel, mass, parents):
+    """
+    L1-L5 of every body around its parent.
+
+    Returns (pairs, mu, separation, points): pairs is (P, 2) rows of
+    (secondary, primary), mu the mass ratio, separation the distance and
+    points (P, 5, 3) the positions of L1 to L5. L1 and L2 use the same
+    series in the Hill radius as the lagrange_points command, L3 is at 1 - 7μ/12
+    of the separation behind the primary, and L4 leads the secondary by
+    60° in its direction of motion.
+    """
+    secondary = np.flatnonzero((parents >= 0) & (mass[:len(parents)] > 0))
+    primary = parents[secondary]
+    secondary = secondary[mass[primary] > 0]
+    primary = parents[secondary]
+    m1, m2 = mass[primary], mass[secondary]
+    mu = m2 / (m1 + m2)
+    r = pos[secondary] - pos[primary]
+    separation = np.linalg.norm(r, axis=1)
+    unit = r / separation[:, None]
+    # In-plane direction of motion, from the relative angular momentum
+    h = np.cross(r, vel[secondary] - vel[primary])
+    fallback = np.cross(unit, [0.0, 0.0, 1.0])
+    h_norm = np.linalg.norm(h, axis=1)
+    normal = np.where(h_norm[:, None] > 0, h / np.maximum(h_norm, 1e-300)[:, None], fallback)
+    ahead = np.cross(normal, unit)
+    ahead /= np.maximum(np.linalg.norm(ahead, axis=1), 1e-300)[:, None]
+
+    alpha = (mu / (3 * (1 - mu))) ** (1 / 3)
+    beta = (mu / (3 * (1 + mu))) ** (1 / 3)
+    along = np.stack([
+        1 - alpha + alpha**2 / 3 - alpha**3 / 9,
+        1 + beta + beta**2 / 3 - beta**3 / 9,
+        -(1 - 7 * mu / 12),
+    ], axis=1) * separation[:, None]
+    points = np.empty((len(secondary), 5, 3))
+    points[:, :3] = pos[primary][:, None, :] + along[:, :, None] * unit[:, None, :]
+    sin60 = np.sqrt(3) / 2
+    points[:, 3] = pos[primary] + separation[:, None] * (0.5 * unit + sin60 * ahead)
+    points[:, 4] = pos[primary] + separation[:, None] * (0.5 * unit - sin60 * ahead)
+    return np.stack([secondary, primary], axis=1), mu, separation, points
@@ -0,0 +1,367 @@
+"""
+Benchmarks for the integrators, the force backends and the renderer.
+
+Every integration method is run with every force backend over a range of
+body counts and step counts on a synthetic disk (one star, N-1 light bodies
+on circular orbits). Rendering is timed through display.draw_objects on the
+dummy SDL driver and the orbital elements through
+simulation.calculate_orbital_parameters. Results are printed and can be
+written as JSON to compare two runs.
+
+The --precession mode integrates Mercury around the Sun with and without
+the 1PN term and compares the perihelion precession with general
+relativity's 43 arcseconds per century.
+
+Examples:
+    python benchmark.py --sizes 10 100 1000 --output bench.json
+    python benchmark.py --perturbations 1pn --backends numba --no-render --no-orbits
+    python benchmark.py --precession --no-render --no-orbits --sizes 10 --steps 1
+    python benchmark.py --methods rk4 --backends numba --steps 10 --no-render
+    python benchmark.py --compare before.json after.json
+"""
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+import numpy as np
+import integration
+import distributed
+from diagnostics import conserved_quantities
+from constants import G, AU, SOLAR_MASS, YEAR, DAY
+
+METHODS = ['euler', 'verlet', 'leapfrog', 'rk4']
+# Force evaluations per step, to turn steps into pair interactions
+FORCE_EVALUATIONS = {'euler': 1, 'verlet': 2, 'leapfrog': 2, 'rk4': 4}
+
+def make_system(N, seed=0):
+    """A solar-mass star and N-1 light bodies on circular orbits between 0.3 and 30 AU."""
+    rng = np.random.default_rng(seed)
+    pos = np.zeros((N, 3))
+    vel = np.zeros((N, 3))
+    mass = np.zeros(N)
+    mass[0] = SOLAR_MASS
+    r = AU * rng.uniform(0.3, 30, N - 1)
+    theta = rng.uniform(0, 2 * np.pi, N - 1)
+    speed = np.sqrt(G * SOLAR_MASS / r)
+    pos[1:, 0] = r * np.cos(theta)
+    pos[1:, 1] = r * np.sin(theta)
+    pos[1:, 2] = r * rng.normal(0, 0.01, N - 1)
+    vel[1:, 0] = -speed * np.sin(theta)
+    vel[1:, 1] = speed * np.cos(theta)
+    mass[1:] = rng.uniform(1e20, 1e25, N - 1)
+    return pos, vel, mass
+
+def total_energy(pos, vel, mass, G):
+    return conserved_quantities(pos, vel, mass, G)[0]
+
+def benchmark_integrator(method, backend, N, steps, dt, energy_limit):
+    integration.set_force_backend(backend)
+    step = getattr(integration, f'{method}_step')
+    # Compile outside the timed region
+    warm_pos, warm_vel, warm_mass = make_system(8)
+    step(warm_pos, warm_vel, warm_mass, dt, G)
+
+    pos, vel, mass = make_system(N)
+    energy_before = total_energy(pos, vel, mass, G) if N <= energy_limit else None
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        step(pos, vel, mass, dt, G)
+    elapsed = time.perf_counter() - start
+
+    drift = None
+    if energy_before is not None:
+        drift = abs((total_energy(pos, vel, mass, G) - energy_before) / energy_before)
+
+    # Peak memory of one more step, measured separately since tracing slows allocation down
+    tracemalloc.start()
+    step(pos, vel, mass, dt, G)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    interactions = FORCE_EVALUATIONS[method] * N * (N - 1) * steps
+    return {
+        'kind': 'integrator',
+        'method': method,
+        'backend': backend,
+        'N': N,
+        'steps': steps,
+        'seconds': elapsed,
+        'steps_per_s': steps / elapsed,
+        'interactions_per_s': interactions / elapsed,
+        'peak_memory_bytes': peak,
+        'energy_drift': drift,
+    }
+
+def benchmark_accuracy(backend, N):
+    from simulation import state
+    if N is None:
+        # The real solar system as loaded by planet.py
+        state.pull_bodies()
+        pos, mass, label = state.pos[:state.n_bodies], state.mass[:state.n_bodies], 'solar system'
+    else:
+        pos, _, mass = make_system(N)
+        label = f'N={N}'
+    max_error, median_error = integration.backend_error(backend, pos, mass, G)
+    return {
+        'kind': 'accuracy',
+        'backend': backend,
+        'system': label,
+        'max_error': max_error,
+        'median_error': median_error,
+    }
+
+def benchmark_rendering(particles, frames, width, height, SCALE_DIST):
+    import pygame
+    from display import draw_objects, clear_body_trails
+    from simulation import state
+    from planet import Sun
+
+    pygame.init()
+    screen = pygame.Surface((width, height))
+    results = []
+    for P in particles:
+        state.clear_particles()
+        if P:
+            pos, vel, _ = make_system(P + 1, seed=1)
+            state.add_particles(pos[1:], vel[1:])
+        clear_body_trails()
+        draw_objects(Sun, SCALE_DIST, False, True, screen, False, True)  # Warm up the kernels
+        tracemalloc.start()
+        start = time.perf_counter()
+        for _ in range(frames):
+            draw_objects(Sun, SCALE_DIST, False, True, screen, False, True)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append({
+            'kind': 'render',
+            'particles': P,
+            'frames': frames,
+            'seconds': elapsed,
+            'frames_per_s': frames / elapsed,
+            'ms_per_frame': 1000 * elapsed / frames,
+            'peak_memory_bytes': peak,
+        })
+    state.clear_particles()
+    return results
+
+def benchmark_orbits(repeat):
+    from simulation import calculate_orbital_parameters
+    from planet import bodies
+
+    calls = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        # Same loop as the simulation: bodies on escape trajectories lose their parent
+        for b in bodies:
+            if b.parent:
+                calculate_orbital_parameters(b)
+                calls += 1
+    elapsed = time.perf_counter() - start
+    return {
+        'kind': 'orbits',
+        'bodies': calls // repeat,
+        'calls': calls,
+        'seconds': elapsed,
+        'calls_per_s': calls / elapsed,
+    }
+
+MERCURY_A = 5.7909e10  # Semi-major axis, m
+MERCURY_E = 0.2056
+MERCURY_MASS = 3.301e23
+GR_PRECESSION = 42.98  # Arcseconds per century from general relativity
+
+def perihelion_longitude(pos, vel, mass):
+    r = pos[1] - pos[0]
+    v = vel[1] - vel[0]
+    e = np.cross(v, np.cross(r, v)) / (G * (mass[0] + mass[1])) - r / np.linalg.norm(r)
+    return np.arctan2(e[1], e[0])
+
+def benchmark_precession(years, dt):
+    """Perihelion precession of Mercury (arcsec per century) with and without the 1PN term."""
+    rates = {}
+    for enabled in (False, True):
+        integration.set_perturbation('1pn', enabled)
+        mass = np.array([SOLAR_MASS, MERCURY_MASS])
+        pos = np.zeros((2, 3))
+        vel = np.zeros((2, 3))
+        pos[1, 0] = MERCURY_A * (1 - MERCURY_E)
+        vel[1, 1] = np.sqrt(G * mass.sum() * (1 + MERCURY_E) / (MERCURY_A * (1 - MERCURY_E)))
+        vel[0] = -vel[1] * mass[1] / mass[0]  # Centre of mass at rest
+        sample_every = max(1, int(DAY / dt))
+        times, angles = [], []
+        start = time.perf_counter()
+        for step in range(int(years * YEAR / dt)):
+            if step % sample_every == 0:
+                times.append(step * dt)
+                angles.append(perihelion_longitude(pos, vel, mass))
+            integration.rk4_step(pos, vel, mass, dt, G)
+        elapsed = time.perf_counter() - start
+        # A fit over many orbits averages out the short-period wobble of the osculating perihelion
+        slope = np.polyfit(times, np.unwrap(angles), 1)[0]
+        rates[enabled] = np.degrees(slope) * 3600 * 100 * YEAR
+    integration.set_perturbation('1pn', False)
+    return {
+        'kind': 'precession',
+        'years': years,
+        'timestep': dt,
+        'seconds': elapsed,
+        'newtonian_arcsec_per_century': rates[False],
+        'arcsec_per_century': rates[True] - rates[False],
+        'expected_arcsec_per_century': GR_PRECESSION,
+    }
+
+def result_key(result):
+    if result['kind'] == 'integrator':
+        if result.get('perturbations'):
+            return f"{result['method']}/{result['backend']}+{'+'.join(result['perturbations'])}/N={result['N']}/steps={result['steps']}"
+        if 'ranks' in result:
+            return f"{result['method']}/{result['backend']}x{result['ranks']}-{result['exchange']}/N={result['N']}/steps={result['steps']}"
+        return f"{result['method']}/{result['backend']}/N={result['N']}/steps={result['steps']}"
+    if result['kind'] == 'render':
+        return f"render/particles={result['particles']}"
+    if result['kind'] == 'accuracy':
+        return f"accuracy/{result['backend']}/{result['system']}"
+    if result['kind'] == 'precession':
+        return 'precession/mercury'
+    return 'orbits'
+
+def result_rate(result):
+    return result.get('steps_per_s') or result.get('frames_per_s') or result.get('calls_per_s')
+
+def print_result(result):
+    key = result_key(result)
+    if result.get('skipped'):
+        print(f"{key:<44} skipped: {result['skipped']}")
+    elif result['kind'] == 'integrator':
+        drift = f"{result['energy_drift']:.2e}" if result['energy_drift'] is not None else "-"
+        print(f"{key:<44} {result['steps_per_s']:>12.4g} steps/s {result['interactions_per_s']:>12.4g} pairs/s "
+              f"{result['peak_memory_bytes'] / 2**20:>9.2f} MiB  drift {drift}")
+    elif result['kind'] == 'render':
+        print(f"{key:<44} {result['ms_per_frame']:>12.3f} ms/frame {result['peak_memory_bytes'] / 2**20:>9.2f} MiB")
+    elif result['kind'] == 'precession':
+        print(f"{key:<44} {result['arcsec_per_century']:.2f}\"/century from 1PN (general relativity: {result['expected_arcsec_per_century']}\"), "
+              f"{result['newtonian_arcsec_per_century']:.2e}\"/century without")
+    elif result['kind'] == 'accuracy':
+        print(f"{key:<44} max error {result['max_error']:.2e}, median {result['median_error']:.2e} vs float64")
+    else:
+        print(f"{key:<44} {result['calls_per_s']:>12.4g} calls/s")
+
+def compare(old_path, new_path):
+    """Print the speed ratio of every case present in both result files."""
+    with open(old_path) as f:
+        old = {result_key(r): r for r in json.load(f)['results'] if not r.get('skipped')}
+    with open(new_path) as f:
+        new = {result_key(r): r for r in json.load(f)['results'] if not r.get('skipped')}
+    for key in new:
+        if key in old and result_rate(new[key]) and result_rate(old[key]):
+            ratio = result_rate(new[key]) / result_rate(old[key])
+            print(f"{key:<44} {ratio:>8.2f}x")
+
+def run_integrators(args, backend, results, extra=None):
+    for method in args.methods:
+        rate = None  # Measured pairs/s, used to skip cases that would blow the time budget
+        for N in args.sizes:
+            for steps in args.steps:
+                interactions = FORCE_EVALUATIONS[method] * N * (N - 1) * steps
+                if rate is not None and interactions / rate > args.budget:
+                    result = {'kind': 'integrator', 'method': method, 'backend': backend, 'N': N, 'steps': steps,
+                              'skipped': f"estimated {interactions / rate:.0f} s exceeds the {args.budget} s budget"}
+                else:
+                    result = benchmark_integrator(method, backend, N, steps, args.timestep, args.energy_limit)
+                    rate = result['interactions_per_s']
+                result.update(extra or {})
+                print_result(result)
+                results.append(result)
+
+def run(args):
+    results = []
+    if args.validate:
+        for backend in args.backends:
+            if backend == 'numba':
+                continue  # The float64 reference itself
+            for N in [None] + [N for N in args.sizes if N <= args.energy_limit]:
+                result = benchmark_accuracy(backend, N)
+                print_result(result)
+                results.append(result)
+    for backend in args.backends:
+        run_integrators(args, backend, results)
+        if args.perturbations:
+            # The same cases with the perturbations on, for their overhead
+            for name in args.perturbations:
+                integration.set_perturbation(name)
+            run_integrators(args, backend, results, {'perturbations': args.perturbations})
+            integration.perturbations.clear()
+    if args.precession:
+        result = benchmark_precession(args.precession_years, args.precession_timestep)
+        print_result(result)
+        results.append(result)
+    for ranks in args.ranks:
+        # Scaling of the distributed backend over local worker processes
+        distributed_backend = distributed.setup('local', ranks, args.exchange)
+        run_integrators(args, 'distributed', results, {'ranks': ranks, 'exchange': args.exchange})
+        distributed_backend.close()
+    if not args.no_render:
+        for result in benchmark_rendering(args.particles, args.frames, args.width, args.height, args.scale):
+            print_result(result)
+            results.append(result)
+    if not args.no_orbits:
+        result = benchmark_orbits(args.orbit_repeat)
+        print_result(result)
+        results.append(result)
+    integration.set_force_backend('numba')
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the integrators, force backends and renderer.")
+    parser.add_argument('--methods', nargs='+', default=METHODS, choices=METHODS)
+    parser.add_argument('--backends', nargs='+', default=list(integration.FORCE_BACKENDS), choices=list(integration.FORCE_BACKENDS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000, 10000, 100000], help="Body counts N")
+    parser.add_argument('--steps', nargs='+', type=int, default=[1, 10, 100], help="Step counts per run")
+    parser.add_argument('--ranks', nargs='*', type=int, default=[], help="Process counts for the distributed backend scaling runs")
+    parser.add_argument('--exchange', default='allgather', choices=['allgather', 'ring', 'shared'], help="Position exchange of the distributed backend")
+    parser.add_argument('--timestep', type=float, default=3600.0, help="Step size in seconds")
+    parser.add_argument('--budget', type=float, default=30.0, help="Skip integrator runs estimated to take longer (seconds)")
+    parser.add_argument('--energy-limit', type=int, default=20000, help="Largest N to measure energy drift for")
+    parser.add_argument('--particles', nargs='+', type=int, default=[0, 10000, 1000000], help="Particle counts to render")
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--scale', type=float, default=5e-10, help="SCALE_DIST, pixels per meter")
+    parser.add_argument('--orbit-repeat', type=int, default=100)
+    parser.add_argument('--perturbations', nargs='*', default=[], choices=list(integration.PERTURBATIONS), help="Also run every case with these perturbations on")
+    parser.add_argument('--precession', action='store_true', help="Measure Mercury's perihelion precession with the 1PN term")
+    parser.add_argument('--precession-years', type=float, default=10.0)
+    parser.add_argument('--precession-timestep', type=float, default=3600.0, help="Step size in seconds")
+    parser.add_argument('--validate', action='store_true', help="Compare every backend's accelerations with the float64 kernel")
+    parser.add_argument('--no-render', action='store_true')
+    parser.add_argument('--no-orbits', action='store_true')
+    parser.add_argument('--output', help="Write the results as JSON")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'time': time.time(),
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'cpus': os.cpu_count(),
+                'args': vars(args),
+                'results': results,
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,128 @@
-from body import Star, Planet, Atmosphere
+"""
+Scenario files: a JSON header for the named bodies plus columnar arrays for bulk populations.
+
+The header lists the named bodies as before and, optionally, populations
+whose columns are .npy files next to it:
+
+    {
+      "bodies": [{"name": "Sun", "type": "star", ...}, ...],
+      "populations": [
+        {"name": "main belt", "color": [150, 150, 150],
+         "columns": {"pos": "belt.pos.npy", "vel": "belt.vel.npy", "mass": "belt.mass.npy"}}
+      ]
+    }
+
+pos and vel are (N, 3) float64 arrays in meters and m/s; mass and radius
+are optional (N,) arrays (zero by default, i.e. test particles) and color
+an optional (N, 3) uint8 array instead of the single "color". The
+columns are memory-mapped and appended to the state arrays with one copy,
+so no Python object is created per particle.
+"""
 import json
+import os
+import numpy as np
+from body import body, Star, Planet, Atmosphere
 
-def load_scenario(scenario_filename):
-    with open(scenario_filename, 'r') as file:
-        data = json.load(file)
-    return data
+POPULATION_COLUMNS = ('pos', 'vel', 'mass', 'radius')
 
 def process_body(body_data):
     # Here we'll determine the type of body (Star, Planet, etc.)
-    # and instantiate an appropriate object.
-    
+    # and instantiate an appropriate object. Parents are resolved by name afterwards.
+    common = dict(
+        name=body_data["name"],
+        mass=body_data["mass"],
+        radius=body_data["radius"],
+        type=body_data["type"],
+        color=body_data.get("color"),
+        pos=body_data["pos"],
+        velocity=body_data["velocity"],
+        id=body_data.get("id"),
+    )
     if body_data["type"] == "star":
         return Star(
-            name=body_data["name"],
-            mass=body_data["mass"],
-            radius=body_data["radius"],
-            color=body_data["color"],
-            pos=body_data["pos"],
-            velocity=body_data["velocity"],
-            id=body_data["id"],
             luminosity=body_data["luminosity"],
             spectral_type=body_data["spectral_type"],
-            age=body_data["age"]
-            # You can add more fields if needed
+            age=body_data.get("age", 0),
+            **common
         )
     elif body_data["type"] == "planet":
+        atmosphere = body_data.get("atmosphere")
         return Planet(
-            name=body_data["name"],
-            mass=body_data["mass"],
-            radius=body_data["radius"],
-            color=body_data["color"],
-            pos=body_data["pos"],
-            velocity=body_data["velocity"],
-            id=body_data["id"]
-            # Again, add more fields if they exist and are needed
+            Atmosphere=Atmosphere(**atmosphere) if atmosphere else None,
+            **common
         )
-    # Implement other body types similarly
-    else:
-        return None
+    # Moons, probes and anything else are plain bodies
+    return body(**common)
 
 def load_scenario(scenario_filename):
+    """Return the named bodies of a scenario and its populations as dicts of memory-mapped columns."""
     with open(scenario_filename, 'r') as file:
         data = json.load(file)
-    
+
     bodies = [process_body(body_data) for body_data in data["bodies"]]
-    
-    return bodies
\ No newline at end of file
+    by_name = {b.name: b for b in bodies}
+    for b, body_data in zip(bodies, data["bodies"]):
+        if body_data.get("parent"):
+            b.parent = by_name[body_data["parent"]]
+
+    directory = os.path.dirname(os.path.abspath(scenario_filename))
+    populations = []
+    for entry in data.get("populations", []):
+        population = {'name': entry.get("name"), 'color': entry.get("color", (200, 200, 200))}
+        for column, filename in entry["columns"].items():
+            population[column] = np.load(os.path.join(directory, filename), mmap_mode='r')
+        populations.append(population)
+    return bodies, populations
+
+def add_populations(state, populations):
+    """Append the populations to the state as particle rows; returns the row ranges by name."""
+    rows = {}
+    for population in populations:
+        rows[population['name']] = state.add_particles(
+            population['pos'], population['vel'], population.get('mass'), population.get('radius'), population['color'])
+    return rows
+
+def save_scenario(scenario_filename, bodies, populations=()):
+    """
+    Write a scenario header and the population columns next to it.
+
+    `populations` are dicts with 'name', 'pos', 'vel' and optionally
+    'mass', 'radius' and 'color', e.g. from populations.py.
+    """
+    directory = os.path.dirname(os.path.abspath(scenario_filename))
+    stem = os.path.splitext(os.path.basename(scenario_filename))[0]
+    data = {"bodies": [], "populations": []}
+    for b in bodies:
+        body_data = {
+            "name": b.name,
+            "mass": float(b.mass),
+            "radius": float(b.radius),
+            "color": list(b.color) if b.color is not None else None,
+            "type": b.type,
+            "pos": [float(x) for x in b.pos],
+            "velocity": [float(x) for x in b.vel],
+            "id": b.id,
+        }
+        if b.parent is not None:
+            body_data["parent"] = b.parent.name
+        if isinstance(b, Star):
+            body_data.update(luminosity=b.luminosity, spectral_type=b.spectral_type, age=b.age)
+        if isinstance(b, Planet) and b.atmosphere is not None:
+            body_data["atmosphere"] = vars(b.atmosphere)
+        data["bodies"].append(body_data)
+    for k, population in enumerate(populations):
+        entry = {"name": population.get('name', f"population {k}"), "columns": {}}
+        columns = {column: np.ascontiguousarray(population[column], dtype=np.float64)
+                   for column in POPULATION_COLUMNS if population.get(column) is not None}
+        color = population.get('color')
+        if color is not None and np.ndim(color) == 2:
+            columns['color'] = np.ascontiguousarray(color, dtype=np.uint8)  # One per particle
+        elif color is not None:
+            entry["color"] = [int(c) for c in color]
+        for column, values in columns.items():
+            filename = f"{stem}.{k}.{column}.npy"
+            np.save(os.path.join(directory, filename), values)
+            entry["columns"][column] = filename
+        data["populations"].append(entry)
+    with open(scenario_filename, 'w') as file:
+        json.dump(data, file, indent=2)
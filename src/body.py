@@ -1,6 +1,33 @@
 import numpy as np
 from constants import G
 
+STATE_ATTRIBUTES = frozenset(('pos', 'vel', 'mass', 'radius'))  # Mirrored in the SimulationState arrays
+
+class BodyList(list):
+    """A list of bodies that counts its changes, so the state can tell it was edited without comparing every entry."""
+    changes = 0
+
+    def _changed(method):
+        def changed(self, *args):
+            self.changes += 1
+            return method(self, *args)
+        changed.__name__ = method.__name__
+        return changed
+
+    __setitem__ = _changed(list.__setitem__)
+    __delitem__ = _changed(list.__delitem__)
+    __iadd__ = _changed(list.__iadd__)
+    __imul__ = _changed(list.__imul__)
+    append = _changed(list.append)
+    extend = _changed(list.extend)
+    insert = _changed(list.insert)
+    pop = _changed(list.pop)
+    remove = _changed(list.remove)
+    clear = _changed(list.clear)
+    sort = _changed(list.sort)
+    reverse = _changed(list.reverse)
+    del _changed
+
 class body:
     def __init__(
         self,
@@ -56,6 +83,14 @@ class body:
         else:
             self.vel = np.array(velocity)
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        # Tell the state this body belongs to that its rows need refreshing from the object
+        if name in STATE_ATTRIBUTES:
+            edited = self.__dict__.get('_edited')
+            if edited is not None:
+                edited.setdefault(self, set()).add(name)
+
     def surface_gravity(self):
         return G * self.mass / (self.radius ** 2)
 
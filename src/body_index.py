@@ -0,0 +1,117 @@
+"""
+Lookup tables over the named bodies of a simulation state.
+
+Console commands, the renderer and scripts find bodies by name, type,
+parent or NAIF id. The tables are rebuilt lazily on the first lookup after
+state.version changes (bodies added, merged or removed), so a lookup is
+a dict access, a binary search over the sorted names, or for substrings
+one pass of the regex engine over all names joined into a single string.
+Refreshes read the body list, so use the index on the thread that
+changes it (the main loop); the console sends its lookups there as
+commands.Call.
+
+Example:
+    index = BodyIndex(state)
+    index.find('jup')        # Jupiter, by unique prefix
+    index.search('oon')      # Every body with 'oon' in its name
+    index.of_type('moon')
+    index.children(Saturn)
+"""
+import bisect
+import re
+import numpy as np
+
+class BodyIndex:
+    def __init__(self, state):
+        self.state = state
+        self._version = None
+        self._count = None
+
+    def refresh(self):
+        """Rebuild the tables if rows were added or removed since the last lookup."""
+        bodies = self.state.bodies
+        if self.state.version == self._version and len(bodies) == self._count:
+            return
+        self._version = self.state.version
+        self._count = len(bodies)
+        self.bodies = list(bodies)
+        self.folded = [b.name.casefold() for b in self.bodies]
+        self.by_name = {}
+        self.by_folded = {}
+        self.by_type = {}
+        self.by_parent = {}
+        self.by_id = {}
+        for b, name in zip(self.bodies, self.folded):
+            self.by_name.setdefault(b.name, b)
+            self.by_folded.setdefault(name, []).append(b)
+            self.by_type.setdefault((b.type or '').casefold(), []).append(b)
+            if b.parent is not None:
+                self.by_parent.setdefault(id(b.parent), []).append(b)
+            if b.id is not None:
+                self.by_id.setdefault(str(b.id), b)
+        order = sorted(range(len(self.folded)), key=self.folded.__getitem__)
+        self.sorted_names = [self.folded[i] for i in order]
+        self.sorted_rows = order
+        # Names separated by a character no name contains, with the offset where each one starts
+        self.joined = '\0'.join(self.folded)
+        self.starts = np.cumsum([0] + [len(name) + 1 for name in self.folded[:-1]])
+
+    def prefix(self, text):
+        """Bodies whose name starts with `text`, ignoring case, in list order."""
+        self.refresh()
+        text = text.casefold()
+        start = bisect.bisect_left(self.sorted_names, text)
+        end = start
+        while end < len(self.sorted_names) and self.sorted_names[end].startswith(text):
+            end += 1
+        return [self.bodies[i] for i in sorted(self.sorted_rows[start:end])]
+
+    def search(self, text):
+        """Bodies with `text` anywhere in their name, ignoring case, in list order."""
+        self.refresh()
+        text = text.casefold()
+        if not text or '\0' in text:
+            return []
+        offsets = [m.start() for m in re.finditer(re.escape(text), self.joined)]
+        rows = np.unique(np.searchsorted(self.starts, offsets, side='right') - 1)
+        return [self.bodies[i] for i in rows]
+
+    def matches(self, name):
+        """
+        The bodies `name` refers to, best kind of match first.
+
+        An exact name, then a name differing only in case, then a NAIF id,
+        then a name prefix and finally a substring. A single body means the
+        name is unambiguous; an empty list means nothing matched.
+        """
+        self.refresh()
+        if name in self.by_name:
+            return [self.by_name[name]]
+        folded = self.by_folded.get(name.casefold())
+        if folded:
+            return folded
+        if name.strip() in self.by_id:
+            return [self.by_id[name.strip()]]
+        return self.prefix(name) or self.search(name)
+
+    def find(self, name):
+        """The body `name` unambiguously refers to, or None."""
+        found = self.matches(name)
+        return found[0] if len(found) == 1 else None
+
+    def of_type(self, body_type):
+        self.refresh()
+        return self.by_type.get(body_type.casefold(), [])
+
+    def types(self):
+        self.refresh()
+        return sorted(t for t in self.by_type if t)
+
+    def children(self, body):
+        """Bodies whose parent is `body`."""
+        self.refresh()
+        return self.by_parent.get(id(body), [])
+
+    def naif(self, body_id):
+        self.refresh()
+        return self.by_id.get(str(body_id))
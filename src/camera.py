@@ -0,0 +1,53 @@
+import numpy as np
+from numba import njit, prange
+
+# Projected coordinates are clipped to this range so far-away bodies still fit in an int32
+SCREEN_LIMIT = 2**30
+
+@njit(parallel=True)
+def project(pos, radius, focus_x, focus_y, SCALE_DIST, center_x, center_y, screen_pos, screen_radii):
+    # Single pass over the rows: no temporaries, truncates towards zero like astype(int)
+    for i in prange(pos.shape[0]):
+        x = (pos[i, 0] - focus_x) * SCALE_DIST + center_x
+        y = (pos[i, 1] - focus_y) * SCALE_DIST + center_y
+        screen_pos[i, 0] = np.int32(min(max(x, -SCREEN_LIMIT), SCREEN_LIMIT))
+        screen_pos[i, 1] = np.int32(min(max(y, -SCREEN_LIMIT), SCREEN_LIMIT))
+        r = radius[i] * SCALE_DIST
+        screen_radii[i] = np.int32(min(max(r, 1.0), SCREEN_LIMIT))
+
+class Camera:
+    """
+    Per-frame transform from simulation positions to integer screen pixels.
+
+    `update` projects the whole position array in one compiled pass into
+    reusable buffers; every draw and pick path reads `screen_pos` and
+    `screen_radii` instead of projecting bodies one at a time.
+    """
+    def __init__(self):
+        self.focus_pos = np.zeros(2)
+        self.SCALE_DIST = 1.0
+        self.center = np.zeros(2)
+        self.width = 0
+        self.height = 0
+        self.screen_pos = np.zeros((0, 2), dtype=np.int32)
+        self.screen_radii = np.zeros(0, dtype=np.int32)
+
+    def _resize(self, N):
+        if len(self.screen_pos) != N:
+            self.screen_pos = np.zeros((N, 2), dtype=np.int32)
+            self.screen_radii = np.zeros(N, dtype=np.int32)
+
+    def update(self, pos, radius, focus_pos, SCALE_DIST, width, height):
+        self.focus_pos = np.array(focus_pos[:2], dtype=float)
+        self.SCALE_DIST = SCALE_DIST
+        self.center = np.array([width // 2, height // 2], dtype=float)
+        self.width = width
+        self.height = height
+        self._resize(len(pos))
+
+        project(pos, radius, self.focus_pos[0], self.focus_pos[1], SCALE_DIST, self.center[0], self.center[1], self.screen_pos, self.screen_radii)
+
+    def to_screen(self, points):
+        """Project an (M, 2+) array of simulation positions with the current transform."""
+        points = np.asarray(points, dtype=float)
+        return np.clip((points[..., :2] - self.focus_pos) * self.SCALE_DIST + self.center, -SCREEN_LIMIT, SCREEN_LIMIT)
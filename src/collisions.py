@@ -0,0 +1,136 @@
+"""
+Collision detection and merging between steps.
+
+Every row with a radius sweeps a sphere from its position before the step
+to its position after it. A sort-and-sweep broad phase along the axis with
+the widest spread finds the pairs whose swept boxes overlap, and an exact
+swept-sphere test (linear motion over the step) gives the contact time.
+Touching pairs are merged in contact order, conserving mass and momentum:
+the heavier row survives at the centre of mass with the combined volume and
+the other row is removed from the state.
+"""
+import numpy as np
+from numba import njit
+
+enabled = False  # Set by main.py or the 'collisions' console command
+history = []  # (survivor name, absorbed name) of recent merges
+HISTORY_LENGTH = 100
+
+@njit
+def swept_pairs(start, end, radius, rows, axis):
+    """Pairs of `rows` whose spheres touch during the step, with the contact time as a fraction of it."""
+    M = rows.shape[0]
+    lo = np.empty((M, 3))
+    hi = np.empty((M, 3))
+    for a in range(M):
+        i = rows[a]
+        for k in range(3):
+            lo[a, k] = min(start[i, k], end[i, k]) - radius[i]
+            hi[a, k] = max(start[i, k], end[i, k]) + radius[i]
+    order = np.argsort(lo[:, axis])
+    found_i = []
+    found_j = []
+    found_t = []
+    for p in range(M):
+        a = order[p]
+        for q in range(p + 1, M):
+            b = order[q]
+            if lo[b, axis] > hi[a, axis]:
+                break  # Sorted by lower bound: nothing further along can overlap a
+            if lo[b, 0] > hi[a, 0] or lo[a, 0] > hi[b, 0] or lo[b, 1] > hi[a, 1] or lo[a, 1] > hi[b, 1] or lo[b, 2] > hi[a, 2] or lo[a, 2] > hi[b, 2]:
+                continue
+            i = rows[a]
+            j = rows[b]
+            # Relative position r0 + t * dr for t in [0, 1]
+            r0x = start[j, 0] - start[i, 0]
+            r0y = start[j, 1] - start[i, 1]
+            r0z = start[j, 2] - start[i, 2]
+            drx = (end[j, 0] - start[j, 0]) - (end[i, 0] - start[i, 0])
+            dry = (end[j, 1] - start[j, 1]) - (end[i, 1] - start[i, 1])
+            drz = (end[j, 2] - start[j, 2]) - (end[i, 2] - start[i, 2])
+            R = radius[i] + radius[j]
+            c = r0x * r0x + r0y * r0y + r0z * r0z - R * R
+            if c <= 0.0:
+                found_i.append(i)
+                found_j.append(j)
+                found_t.append(0.0)
+                continue
+            A = drx * drx + dry * dry + drz * drz
+            B = 2.0 * (r0x * drx + r0y * dry + r0z * drz)
+            discriminant = B * B - 4.0 * A * c
+            if A == 0.0 or B >= 0.0 or discriminant < 0.0:
+                continue  # Not approaching, or passing without touching
+            t = (-B - np.sqrt(discriminant)) / (2.0 * A)
+            if t <= 1.0:
+                found_i.append(i)
+                found_j.append(j)
+                found_t.append(t)
+    pairs = np.empty((len(found_i), 2), dtype=np.int64)
+    times = np.empty(len(found_i))
+    for k in range(len(found_i)):
+        pairs[k, 0] = found_i[k]
+        pairs[k, 1] = found_j[k]
+        times[k] = found_t[k]
+    return pairs, times
+
+def detect(state, start):
+    """Touching pairs between the positions `start` and the current positions, in contact order."""
+    rows = np.flatnonzero(state.radius > 0)
+    if len(rows) < 2:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros(0)
+    spread = state.pos[rows].max(axis=0) - state.pos[rows].min(axis=0)
+    pairs, times = swept_pairs(start, state.pos, state.radius, rows, int(np.argmax(spread)))
+    order = np.argsort(times, kind='stable')
+    return pairs[order], times[order]
+
+def merge(state, pairs):
+    """
+    Merge each pair into its heavier row and remove the other rows.
+
+    A row takes part in at most one merge per call; a chain of contacts
+    finishes on the following steps. Returns the number of merges.
+    """
+    pos, vel, mass, radius = state.pos, state.vel, state.mass, state.radius
+    absorbed = []
+    used = set()
+    for i, j in pairs:
+        if i in used or j in used:
+            continue
+        # Keep named bodies over particles, then the heavier row
+        survivor, other = (i, j) if (i < state.n_bodies, mass[i]) >= (j < state.n_bodies, mass[j]) else (j, i)
+        m = mass[survivor] + mass[other]
+        if m > 0:
+            w_survivor, w_other = mass[survivor] / m, mass[other] / m
+        else:
+            # Test particles: weigh by volume instead
+            volume = radius[survivor]**3 + radius[other]**3
+            w_survivor, w_other = radius[survivor]**3 / volume, radius[other]**3 / volume
+        pos[survivor] = w_survivor * pos[survivor] + w_other * pos[other]
+        vel[survivor] = w_survivor * vel[survivor] + w_other * vel[other]
+        mass[survivor] = m
+        radius[survivor] = (radius[survivor]**3 + radius[other]**3) ** (1 / 3)
+        if survivor < state.n_bodies:
+            # pull_bodies copies edited body attributes back into the arrays
+            state.bodies[survivor].mass = mass[survivor]
+            state.bodies[survivor].radius = radius[survivor]
+        if other < state.n_bodies:
+            # Moons of the absorbed body now orbit whatever absorbed it
+            new_parent = state.bodies[survivor] if survivor < state.n_bodies else None
+            for b in state.bodies:
+                if b.parent is state.bodies[other]:
+                    b.parent = new_parent
+        history.append((name_of(state, survivor), name_of(state, other)))
+        used.update((i, j))
+        absorbed.append(other)
+    del history[:-HISTORY_LENGTH]
+    if absorbed:
+        state.remove_rows(absorbed)  # A mass event, like every row change
+    return len(absorbed)
+
+def name_of(state, row):
+    return state.bodies[row].name if row < state.n_bodies else f"particle {row - state.n_bodies}"
+
+def resolve(state, start):
+    """Detect and merge the collisions of the step that moved the state from `start`."""
+    pairs, _ = detect(state, start)
+    return merge(state, pairs) if len(pairs) else 0
@@ -0,0 +1,191 @@
+"""
+Command queue between StarConsole and the main loop.
+
+The console runs on its own thread. Instead of both threads reading and
+writing one shared dict every frame, the console posts typed commands and
+the main loop applies them between steps, where nothing else touches the
+state. Each post returns a Future, so the console can wait for the result
+while the simulation keeps running. Long analyses run on a worker thread
+on copies of the arrays taken at a step boundary.
+
+Main loop:
+    commands.apply(settings)
+
+Console:
+    commands.request(SetSetting('paused', True))
+    pos, vel, mass, bodies, n_bodies = commands.request(Snapshot(state))
+    commands.analyse(analysis.nearest_neighbours, pos).result()
+"""
+import queue
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Main loop variables the console can read and change
+SETTINGS = [
+    'timestep_seconds', 'SCALE_DIST', 'focus_object', 'paused', 'running', 'gravity_enabled', 'integration_method',
+    'FULL_ORBITS', 'fade_trails', 'draw_trail_for_empty', 'display_names', 'gravity_field', 'particle_render',
+    'target_fps', 'adaptive_quality',
+]
+
+class Settings:
+    """The settings as the main loop's module variables, with the frame-rate ones living on the scheduler."""
+    def __init__(self, namespace, scheduler):
+        self.namespace = namespace
+        self.scheduler = scheduler
+
+    def get(self, name):
+        if name == 'target_fps':
+            return self.scheduler.target_fps
+        if name == 'adaptive_quality':
+            return self.scheduler.adaptive
+        return self.namespace[name]
+
+    def set(self, name, value):
+        if name not in SETTINGS:
+            raise KeyError(f"Unknown setting '{name}'")
+        if name == 'target_fps':
+            self.scheduler.target_fps = value
+        elif name == 'adaptive_quality':
+            self.scheduler.adaptive = value
+        else:
+            self.namespace[name] = value
+
+class SetSetting:
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def apply(self, settings):
+        settings.set(self.name, self.value)
+        return self.value
+
+class ToggleSetting:
+    def __init__(self, name):
+        self.name = name
+
+    def apply(self, settings):
+        value = not settings.get(self.name)
+        settings.set(self.name, value)
+        return value
+
+class GetSettings:
+    """Current values of the named settings (all by default) as a dict."""
+    def __init__(self, names=None):
+        self.names = names or SETTINGS
+
+    def apply(self, settings):
+        return {name: settings.get(name) for name in self.names}
+
+class Call:
+    """Run a function on the main thread between steps, e.g. anything that adds or removes rows."""
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def apply(self, settings):
+        return self.function(*self.args)
+
+class Snapshot:
+    """Copies of pos, vel and mass, the body list and the number of named rows, for analyses off the main thread."""
+    def __init__(self, state):
+        self.state = state
+
+    def apply(self, settings):
+        state = self.state
+        return state.pos.copy(), state.vel.copy(), state.mass.copy(), list(state.bodies), state.n_bodies
+
+class RunCode:
+    """
+    Evaluate or execute a line of Python in the console namespace.
+
+    The settings are copied into the namespace first and any the code
+    reassigned are applied afterwards, so `paused = True` still works.
+    Returns the value of an expression, or None for a statement. What the
+    code prints goes to `output` if given (the caller's captured_output),
+    so a remote caller sees it although the code runs on the main thread.
+    """
+    def __init__(self, source, namespace, output=None):
+        self.source = source
+        self.namespace = namespace
+        self.output = output
+
+    def apply(self, settings):
+        before = GetSettings().apply(settings)
+        self.namespace.update(before)
+        if self.output is not None:
+            stdout = thread_output()
+            previous, stdout.local.buffer = getattr(stdout.local, 'buffer', None), self.output
+        try:
+            try:
+                code = compile(self.source, '<console>', 'eval')
+            except SyntaxError:
+                exec(compile(self.source, '<console>', 'exec'), self.namespace)
+                return None
+            return eval(code, self.namespace)
+        finally:
+            if self.output is not None:
+                stdout.local.buffer = previous
+            for name, value in before.items():
+                if self.namespace.get(name) is not value:
+                    settings.set(name, self.namespace[name])
+
+class ThreadOutput:
+    """Replaces sys.stdout and sends what a thread prints to that thread's capture buffer, if it has one."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        # fileno and isatty too, so input() keeps using readline on the real terminal
+        return getattr(self.stream, name)
+
+def thread_output():
+    """Install ThreadOutput as sys.stdout if it isn't yet and return it."""
+    if not isinstance(sys.stdout, ThreadOutput):
+        sys.stdout = ThreadOutput(sys.stdout)
+    return sys.stdout
+
+def captured_output():
+    """The buffer the calling thread's prints are captured in (see ThreadOutput), or None."""
+    return getattr(sys.stdout.local, 'buffer', None) if isinstance(sys.stdout, ThreadOutput) else None
+
+class CommandQueue:
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='analysis')
+
+    def post(self, command):
+        """Queue a command for the next step boundary and return a Future for its result."""
+        future = Future()
+        self._queue.put((command, future))
+        return future
+
+    def request(self, command, timeout=10.0):
+        """Post a command and wait for its result; raises the command's exception."""
+        return self.post(command).result(timeout)
+
+    def apply(self, settings):
+        """Run every queued command; called by the main loop between steps."""
+        while True:
+            try:
+                command, future = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(command.apply(settings))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def analyse(self, function, *args):
+        """Run a function on the analysis worker and return its Future."""
+        return self._worker.submit(function, *args)
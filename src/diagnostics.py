@@ -0,0 +1,157 @@
+import numpy as np
+from numba import njit, prange
+
+@njit(parallel=True)
+def conserved_quantities(pos, vel, mass, G):
+    """Total energy, linear momentum and angular momentum (about the origin) of the whole system."""
+    N = pos.shape[0]
+    kinetic = 0.0
+    potential = 0.0
+    px = 0.0
+    py = 0.0
+    pz = 0.0
+    Lx = 0.0
+    Ly = 0.0
+    Lz = 0.0
+    p_scale = 0.0
+    L_scale = 0.0
+    for i in prange(N):
+        m = mass[i]
+        if m == 0.0:
+            continue  # Test particles carry no energy or momentum
+        vx = vel[i, 0]
+        vy = vel[i, 1]
+        vz = vel[i, 2]
+        kinetic += 0.5 * m * (vx * vx + vy * vy + vz * vz)
+        px += m * vx
+        py += m * vy
+        pz += m * vz
+        lx = m * (pos[i, 1] * vz - pos[i, 2] * vy)
+        ly = m * (pos[i, 2] * vx - pos[i, 0] * vz)
+        lz = m * (pos[i, 0] * vy - pos[i, 1] * vx)
+        Lx += lx
+        Ly += ly
+        Lz += lz
+        # Sums of magnitudes, so a system at rest still has a scale to compare drift against
+        p_scale += m * np.sqrt(vx * vx + vy * vy + vz * vz)
+        L_scale += np.sqrt(lx * lx + ly * ly + lz * lz)
+        pot_i = 0.0
+        for j in range(i + 1, N):
+            rx = pos[j, 0] - pos[i, 0]
+            ry = pos[j, 1] - pos[i, 1]
+            rz = pos[j, 2] - pos[i, 2]
+            r = np.sqrt(rx * rx + ry * ry + rz * rz)
+            if r > 0.0:
+                pot_i -= G * m * mass[j] / r
+        potential += pot_i
+    return kinetic + potential, np.array([px, py, pz]), np.array([Lx, Ly, Lz]), p_scale, L_scale
+
+@njit(parallel=True)
+def mass_rate_kernel(pos, vel, mass, mdot, rows, sources, G):
+    energy = 0.0
+    px = 0.0
+    py = 0.0
+    pz = 0.0
+    Lx = 0.0
+    Ly = 0.0
+    Lz = 0.0
+    for k in prange(rows.shape[0]):
+        i = rows[k]
+        md = mdot[i]
+        vx = vel[i, 0]
+        vy = vel[i, 1]
+        vz = vel[i, 2]
+        potential = 0.0
+        for s in range(sources.shape[0]):
+            j = sources[s]
+            rx = pos[j, 0] - pos[i, 0]
+            ry = pos[j, 1] - pos[i, 1]
+            rz = pos[j, 2] - pos[i, 2]
+            r = np.sqrt(rx * rx + ry * ry + rz * rz)
+            if r > 0.0:  # The row itself and anything on top of it, as in conserved_quantities
+                potential -= G * mass[j] / r
+        energy += md * (0.5 * (vx * vx + vy * vy + vz * vz) + potential)
+        px += md * vx
+        py += md * vy
+        pz += md * vz
+        Lx += md * (pos[i, 1] * vz - pos[i, 2] * vy)
+        Ly += md * (pos[i, 2] * vx - pos[i, 0] * vz)
+        Lz += md * (pos[i, 0] * vy - pos[i, 1] * vx)
+    return np.array([energy, px, py, pz, Lx, Ly, Lz])
+
+def mass_rate_effects(pos, vel, mass, mdot, G):
+    """
+    Rates at which mass changes add energy, momentum (3) and angular momentum (3) to the system.
+
+    Mass a row loses or gains moves with the row, so it carries its share
+    of the row's kinetic and potential energy, momentum and angular
+    momentum; a row already at zero mass loses nothing more. Costs one
+    pass over the massive rows per row changing mass.
+    """
+    rows = np.flatnonzero((mdot != 0) & ((mass > 0) | (mdot > 0)))
+    if len(rows) == 0:
+        return np.zeros(7)
+    return mass_rate_kernel(pos, vel, mass, mdot, rows, np.flatnonzero(mass > 0), G)
+
+class ConservationMonitor:
+    """
+    Tracks the relative drift of energy, momentum and angular momentum.
+
+    The diagnostics kernel is O(N^2), so it runs only every `cadence` steps.
+    Drift is measured against a baseline taken at `reset`, which happens
+    automatically when rows are added or removed, on mass events (merges,
+    edits, supernova remnants) or when gravity is toggled. What continuous
+    mass rates carried away since the baseline (`state.mass_rate_ledger`)
+    is added back first, so winds do not count as drift. With
+    `auto_reduce` on, `sample` returns True once the energy drift exceeds
+    `tolerance` so the caller can shrink the timestep.
+    """
+    def __init__(self, cadence=100, tolerance=1e-6, auto_reduce=False):
+        self.cadence = cadence
+        self.tolerance = tolerance
+        self.auto_reduce = auto_reduce
+        self.energy = 0.0
+        self.energy_drift = 0.0
+        self.momentum_drift = 0.0
+        self.angular_momentum_drift = 0.0
+        self.max_energy_drift = 0.0
+        self.samples = 0
+        self.sim_time = 0.0
+        self._baseline = None
+        self._version = None
+        self._mass_version = None
+        self._ledger = None
+        self._G = None
+        self._steps = 0
+
+    def reset(self):
+        self._baseline = None
+        self.max_energy_drift = 0.0
+
+    def sample(self, state, G, steps=1, sim_time=0.0, force=False):
+        """Count `steps` and sample if the cadence is due. Returns True if the timestep should be reduced."""
+        self._steps += steps
+        if not force and self._steps < self.cadence and self._baseline is not None:
+            return False
+        self._steps = 0
+        energy, momentum, angular_momentum, p_scale, L_scale = conserved_quantities(state.pos, state.vel, state.mass, G)
+        if self._baseline is None or state.version != self._version or state.mass_version != self._mass_version or G != self._G:
+            self._baseline = (energy, momentum, angular_momentum, p_scale, L_scale)
+            self._version = state.version
+            self._mass_version = state.mass_version
+            self._ledger = state.mass_rate_ledger.copy()
+            self._G = G
+            self.max_energy_drift = 0.0
+        energy0, momentum0, angular_momentum0, p_scale0, L_scale0 = self._baseline
+        carried = state.mass_rate_ledger - self._ledger
+        energy = energy - carried[0]
+        momentum = momentum - carried[1:4]
+        angular_momentum = angular_momentum - carried[4:7]
+        self.energy_drift = abs((energy - energy0) / energy0) if energy0 != 0 else 0.0
+        self.momentum_drift = np.linalg.norm(momentum - momentum0) / p_scale0 if p_scale0 > 0 else 0.0
+        self.angular_momentum_drift = np.linalg.norm(angular_momentum - angular_momentum0) / L_scale0 if L_scale0 > 0 else 0.0
+        self.max_energy_drift = max(self.max_energy_drift, self.energy_drift)
+        self.samples += 1
+        self.sim_time = sim_time
+        self.energy = energy
+        return self.auto_reduce and self.energy_drift > self.tolerance
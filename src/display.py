@@ -1,7 +1,33 @@
 import pygame
 import numpy as np
+from numba import njit, prange
 from planet import bodies
 from constants import half_rgb, YEAR, MONTH, DAY, HOUR, MINUTE, G
+from spatial import ScreenGrid
+from camera import Camera, SCREEN_LIMIT
+from simulation import state
+from perf import perf
+
+# Updated every frame by draw_objects; used for drawing, culling and mouse picking
+camera = Camera()
+screen_grid = None
+label_font = None
+label_cache = {}  # Rendered name labels by body name
+LABEL_CELL = (120, 24)  # At most one label per cell of this size in pixels
+time_font = None
+splat_counts = None
+splat_sums = None
+
+# Drawing quality, lowered by the frame scheduler when frames run over budget
+trail_length = None  # Maximum trail points per body, None keeps them all
+orbit_resolution = 1000  # Points per drawn orbit
+gravity_grid_size = 50  # Gravity field samples per side
+
+def set_quality(quality):
+    global trail_length, orbit_resolution, gravity_grid_size
+    trail_length = quality['trail_length']
+    orbit_resolution = quality['orbit_resolution']
+    gravity_grid_size = quality['gravity_grid_size']
 
 def clear_body_trails():
     global body_trails
@@ -13,11 +39,15 @@ def init_display(screen_width, screen_height):
     screen = pygame.display.set_mode((screen_width, screen_height), pygame.RESIZABLE)
     return screen
 
+def rect_on_screen(screen, x_min, y_min, x_max, y_max):
+    return x_max >= 0 and y_max >= 0 and x_min < screen.get_width() and y_min < screen.get_height()
+
 def get_body_screen_position(body, focus_object, SCALE_DIST, screen):
-    focus_pos_pygame = np.array([screen.get_width() // 2, screen.get_height() // 2])
-    body_pos_scaled = (body.pos[:2] - focus_object.pos[:2]) * SCALE_DIST
-    body_pos_pygame = focus_pos_pygame + body_pos_scaled
-    return body_pos_pygame
+    # Read the projection of the current frame; bodies outside the state are projected on demand
+    row = state.row_of(body)
+    if row is not None and row < len(camera.screen_pos):
+        return camera.screen_pos[row]
+    return camera.to_screen(body.pos)
 
 def convert_seconds_to_human_readable(seconds, paused):
     if paused:
@@ -59,10 +89,12 @@ def convert_seconds_to_human_readable(seconds, paused):
         return human_readable.strip()
         
 def display_time(timescale_seconds, screen, paused):
+    global time_font
     try:
         human_readable_time = convert_seconds_to_human_readable(timescale_seconds, paused)
-        font = pygame.font.Font(None, 36)
-        text = font.render("Timestep: " + human_readable_time, 1, (255, 255, 255))
+        if time_font is None:
+            time_font = pygame.font.Font(None, 36)
+        text = time_font.render("Timestep: " + human_readable_time, 1, (255, 255, 255))
 
         text_rect = text.get_rect()
         screen_rect = screen.get_rect()
@@ -75,37 +107,41 @@ def display_time(timescale_seconds, screen, paused):
             raise e
                 
 def draw_trail(screen, body, body_trails, focus_object, fade_trails, SCALE_DIST):
-    focus_pos_pygame = np.array([screen.get_width() // 2, screen.get_height() // 2])
+    with perf.timer('trail_update'):
+        # Store the scaled position in trail
+        body_trails[body.name].append((body.pos[:2] - focus_object.pos[:2]))
 
-    # Store the scaled position in trail
-    body_trails[body.name].append((body.pos[:2] - focus_object.pos[:2]))
+        # If not displaying full orbits, remove the oldest position if the trail is too long
+        if fade_trails:
+            if len(body_trails[body.name]) > 5:
+                body_trails[body.name].pop(0)
 
-    # If not displaying full orbits, remove the oldest position if the trail is too long
-    if fade_trails:
-        if len(body_trails[body.name]) > 5:
-            body_trails[body.name].pop(0)
+        trail = body_trails[body.name]
+        if trail_length is not None and len(trail) > trail_length:
+            del trail[:len(trail) - trail_length]
+    if len(trail) < 2:
+        return
 
     # Draw the trail with a fixed color
-    for i in range(1, len(body_trails[body.name])):
-        if fade_trails:
-            # Calculate a fade factor based on the position in the trail
-            fade_factor = i / len(body_trails[body.name])
-            trail_color = tuple([int(c * fade_factor) for c in body.color])
-        
-        trail_color = body.color
-        trail_start = (body_trails[body.name][i-1] * SCALE_DIST + focus_pos_pygame).astype(int)
-        trail_end = (body_trails[body.name][i] * SCALE_DIST + focus_pos_pygame).astype(int)
-
-        pygame.draw.line(screen, trail_color, tuple(trail_start), tuple(trail_end))
+    trail_color = body.color
+    points = np.clip(np.array(trail) * SCALE_DIST + camera.center, -SCREEN_LIMIT, SCREEN_LIMIT)
+    if not rect_on_screen(screen, *points.min(axis=0), *points.max(axis=0)):
+        return
+    pygame.draw.lines(screen, trail_color, False, points.astype(int).tolist())
 
 def draw_orbit(screen, body, focus_object, SCALE_DIST):
-    focus_pos_pygame = np.array([screen.get_width() // 2, screen.get_height() // 2])
-    theta = np.linspace(0, 2 * np.pi, 1000)
+    theta = np.linspace(0, 2 * np.pi, orbit_resolution)
     a = body.semi_major_axis
     e = body.eccentricity
     if a == 0:
         return  # Skip bodies without computed orbital parameters yet
 
+    # Skip orbits whose bounding box (apoapsis around the parent) is off-screen
+    parent_pos_pygame = get_body_screen_position(body.parent, focus_object, SCALE_DIST, screen)
+    apoapsis_pygame = abs(a) * (1 + e) * SCALE_DIST
+    if not rect_on_screen(screen, *(parent_pos_pygame - apoapsis_pygame), *(parent_pos_pygame + apoapsis_pygame)):
+        return
+
     r = a * (1 - e**2) / (1 + e * np.cos(theta))
 
     # Base ellipse (periapsis along +x direction)
@@ -142,26 +178,21 @@ def draw_orbit(screen, body, focus_object, SCALE_DIST):
     x_rot = x * cos_om - y * sin_om
     y_rot = x * sin_om + y * cos_om
  
-    parent_pos_scaled = (body.parent.pos[:2] - focus_object.pos[:2]) * SCALE_DIST
-    focus_pos_pygame = (focus_pos_pygame + parent_pos_scaled).astype(int)
-    x_pygame = (x_rot * SCALE_DIST + focus_pos_pygame[0]).astype(int)
-    y_pygame = (y_rot * SCALE_DIST + focus_pos_pygame[1]).astype(int)
+    x_pygame = np.clip(x_rot * SCALE_DIST + parent_pos_pygame[0], -SCREEN_LIMIT, SCREEN_LIMIT).astype(int)
+    y_pygame = np.clip(y_rot * SCALE_DIST + parent_pos_pygame[1], -SCREEN_LIMIT, SCREEN_LIMIT).astype(int)
  
-    for i in range(1, len(x_pygame)):
-        pygame.draw.line(screen, half_rgb(body.color), (x_pygame[i-1], y_pygame[i-1]), (x_pygame[i], y_pygame[i]))
+    pygame.draw.lines(screen, half_rgb(body.color), False, np.column_stack((x_pygame, y_pygame)).tolist())
  
     # Draw periapsis (closest point) and apoapsis (farthest point)
     pygame.draw.circle(screen, (255, 0, 0), (x_pygame[np.argmin(r)], y_pygame[np.argmin(r)]), 1)
     pygame.draw.circle(screen, (255, 0, 255), (x_pygame[np.argmax(r)], y_pygame[np.argmax(r)]), 1)
                                 
 def draw_gravity_field(screen, body, focus_object, SCALE_DIST, gravity_multiplier=10, smooth=False):
-    focus_pos_pygame = np.array([screen.get_width() // 2, screen.get_height() // 2])
-    body_pos_scaled = (body.pos[:2] - focus_object.pos[:2]) * SCALE_DIST
-    body_pos_pygame = focus_pos_pygame + body_pos_scaled
+    body_pos_pygame = get_body_screen_position(body, focus_object, SCALE_DIST, screen).astype(float)
 
     # Define the area around the body to visualize the gravity field
     field_radius = int(body.radius * SCALE_DIST * 30)  # Increase the multiplier for a larger field
-    grid_size = 50  # Fewer points for faster calculation, interpolate to smooth
+    grid_size = gravity_grid_size  # Fewer points for faster calculation, interpolate to smooth
 
     # Create grid coordinates relative to the body's position
     x = np.linspace(-field_radius, field_radius, grid_size)
@@ -209,33 +240,133 @@ def draw_gravity_field(screen, body, focus_object, SCALE_DIST, gravity_multiplie
                 field_pos_pygame = body_pos_pygame + np.array([xv[i, j], yv[i, j]])
                 screen.set_at(tuple(field_pos_pygame.astype(int)), color)
                 
-def draw_objects(focus_object, SCALE_DIST, FULL_ORBITS, draw_trail_for_empty, screen, fade_trails, display_names, gravity_field=False):
-    focus_pos_pygame = np.array([screen.get_width() // 2, screen.get_height() // 2])
+@njit
+def accumulate_particles(screen_pos, screen_radii, colors, width, height, counts, sums, large):
+    # Bin sub-pixel particles per pixel; returns how many larger visible ones were put in `large`
+    n_large = 0
+    for i in range(screen_pos.shape[0]):
+        x = screen_pos[i, 0]
+        y = screen_pos[i, 1]
+        r = screen_radii[i]
+        if r > 1:
+            if x + r >= 0 and x - r < width and y + r >= 0 and y - r < height:
+                large[n_large] = i
+                n_large += 1
+        elif 0 <= x < width and 0 <= y < height:
+            counts[x, y] += 1
+            for c in range(3):
+                sums[x, y, c] += colors[i, c]
+    return n_large
+
+@njit(parallel=True)
+def shade_particles(pixels, counts, sums):
+    # Mean colour per lit pixel, brightened with the log of the count, added to what is drawn
+    for x in prange(counts.shape[0]):
+        for y in range(counts.shape[1]):
+            count = counts[x, y]
+            if count == 0:
+                continue
+            gain = min(1.0, 0.4 + 0.15 * np.log2(count)) / count
+            for c in range(3):
+                pixels[x, y, c] = min(255, pixels[x, y, c] + sums[x, y, c] * gain)
+                sums[x, y, c] = 0
+            counts[x, y] = 0
+
+def draw_particles(screen, screen_pos, screen_radii, colors):
+    """
+    Draw bulk particles: sub-pixel ones are splatted into the screen's pixel
+    buffer in one compiled pass, the few that cover more than a pixel get circles.
+    """
+    global splat_counts, splat_sums
+    width, height = screen.get_size()
+    if splat_counts is None or splat_counts.shape != (width, height):
+        splat_counts = np.zeros((width, height), dtype=np.int32)
+        splat_sums = np.zeros((width, height, 3), dtype=np.float32)
+
+    large = np.empty(len(screen_pos), dtype=np.int64)
+    n_large = accumulate_particles(screen_pos, screen_radii, colors, width, height, splat_counts, splat_sums, large)
+    pixels = pygame.surfarray.pixels3d(screen)
+    shade_particles(pixels, splat_counts, splat_sums)
+    del pixels  # Unlocks the surface
+
+    for i in large[:n_large]:
+        pygame.draw.circle(screen, colors[i].tolist(), (int(screen_pos[i, 0]), int(screen_pos[i, 1])), int(screen_radii[i]))
+
+@njit
+def largest_per_cell(screen_pos, screen_radii, visible, width, height, cell_width, cell_height):
+    # The visible row with the largest disc in each label cell; off-screen label positions go to the border cells
+    cols = width // cell_width + 2
+    rows = height // cell_height + 2
+    winner = np.full(cols * rows, -1, dtype=np.int64)
+    for i in visible:
+        cx = min(max(int((screen_pos[i, 0] + cell_width) // cell_width), 0), cols - 1)
+        cy = min(max(int((screen_pos[i, 1] - screen_radii[i] - 10 + cell_height) // cell_height), 0), rows - 1)
+        c = cy * cols + cx
+        if winner[c] < 0 or screen_radii[i] > screen_radii[winner[c]]:
+            winner[c] = i
+    return winner[winner >= 0]
+
+def select_labels(screen_pos, screen_radii, visible, width, height):
+    """Rows to label: the largest visible body in each label cell, so labels don't pile up in crowded scenes."""
+    return largest_per_cell(screen_pos, screen_radii, visible, width, height, LABEL_CELL[0], LABEL_CELL[1])
+
+def label_surface(name):
+    text = label_cache.get(name)
+    if text is None:
+        if len(label_cache) > 4096:
+            label_cache.clear()
+        text = label_cache[name] = label_font.render(name, True, (255, 255, 255))
+    return text
+
+def draw_objects(focus_object, SCALE_DIST, FULL_ORBITS, draw_trail_for_empty, screen, fade_trails, display_names, gravity_field=False, particle_render=True):
+    global screen_grid, label_font
     screen.fill((0, 0, 0))
 
-    for body in bodies:
-        relative_pos = body.pos[:2] - focus_object.pos[:2]
-        body_pos_scaled = relative_pos * SCALE_DIST
-        body_pos_pygame = focus_pos_pygame + body_pos_scaled
+    # Project every row once; named bodies are bucketed for culling and picking
+    state.pull_bodies()
+    camera.update(state.pos, state.radius, focus_object.pos, SCALE_DIST, screen.get_width(), screen.get_height())
+    screen_pos, screen_radii = camera.screen_pos, camera.screen_radii
+    bodies = state.bodies
+    K = state.n_bodies
+    screen_grid = ScreenGrid(screen_pos[:K], screen_radii[:K], screen.get_width(), screen.get_height())
+
+    # Bulk particles go into the pixel buffer, or one circle each when particle rendering is off
+    if state.n_particles:
+        if particle_render:
+            draw_particles(screen, screen_pos[K:], screen_radii[K:], state.color[K:])
+        else:
+            particle_grid = ScreenGrid(screen_pos[K:], screen_radii[K:], screen.get_width(), screen.get_height())
+            for i in particle_grid.visible:
+                pygame.draw.circle(screen, state.color[K + i].tolist(), tuple(screen_pos[K + i].tolist()), int(screen_radii[K + i]))
 
-        # Draw the gravity field around each body
+    for i, body in enumerate(bodies):
+        # Draw the gravity field around each body that is close enough to the screen
         if gravity_field:
-            draw_gravity_field(screen, body, focus_object, SCALE_DIST, gravity_multiplier=10)
+            field_radius = body.radius * SCALE_DIST * 30
+            x, y = screen_pos[i]
+            if rect_on_screen(screen, x - field_radius, y - field_radius, x + field_radius, y + field_radius):
+                draw_gravity_field(screen, body, focus_object, SCALE_DIST, gravity_multiplier=10)
 
+        # Trails are recorded for every body, but only drawn when they reach the screen
         if FULL_ORBITS and body.parent:
             draw_orbit(screen, body, focus_object, SCALE_DIST)
         elif draw_trail_for_empty:
             draw_trail(screen, body, body_trails, focus_object, fade_trails, SCALE_DIST)
 
-        # Calculate the body's radius in pixels
-        body_radius = max(1, int(body.radius * SCALE_DIST))
+    if display_names and label_font is None:
+        label_font = pygame.font.Font(None, 24)
+
+    for i in screen_grid.visible:
+        body = bodies[i]
+        body_pos_pygame = screen_pos[i]
+        body_radius = int(screen_radii[i])
 
         # Draw the planet
-        pygame.draw.circle(screen, body.color, tuple(body_pos_pygame.astype(int)), body_radius)
-        
-        # Draw the planet's name if display_names is True
-        if display_names:
-            font = pygame.font.Font(None, 24)
-            text = font.render(body.name, True, (255, 255, 255))
-            text_rect = text.get_rect(center=(body_pos_pygame[0], body_pos_pygame[1] - body_radius - 10))
-            screen.blit(text, text_rect)
\ No newline at end of file
+        pygame.draw.circle(screen, body.color, (int(body_pos_pygame[0]), int(body_pos_pygame[1])), body_radius)
+
+    # Draw the names if display_names is True, after the discs so no disc covers a label
+    if display_names:
+        for i in select_labels(screen_pos, screen_radii, screen_grid.visible, screen.get_width(), screen.get_height()):
+            text = label_surface(bodies[i].name)
+            text_rect = text.get_rect(center=(screen_pos[i, 0], screen_pos[i, 1] - int(screen_radii[i]) - 10))
+            screen.blit(text, text_rect)
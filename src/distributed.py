@@ -0,0 +1,323 @@
+"""
+Distributed force evaluation over several processes or MPI ranks.
+
+The rows of the state are split into contiguous blocks, one per rank. For
+each force evaluation rank 0 (the simulation) broadcasts a command, every
+rank computes the accelerations of its own block, and the blocks are
+gathered back. Positions reach the ranks in one of two ways:
+
+    allgather  every rank receives all positions (least latency)
+    ring       every rank receives only its block; blocks are passed around
+               the ring so no rank ever holds more than two blocks
+    shared     positions, masses and accelerations live in one shared memory
+               block that every rank maps; only its name is sent (one machine)
+
+Two transports implement the same small communicator interface: MPIComm
+(mpi4py, run under mpirun) and LocalComm, which launches worker processes
+on this machine connected by sockets so the backend can be developed and
+tested without MPI.
+
+Examples:
+    distributed.setup('local', ranks=4)                  # then force_backend = 'distributed'
+    mpirun -n 8 python main.py                           # with distributed_transport = 'mpi'
+"""
+import atexit
+import itertools
+import os
+import secrets
+import subprocess
+import sys
+import threading
+from multiprocessing.connection import Listener, Client
+import numpy as np
+from numba import njit, prange
+
+@njit(parallel=True, cache=True)
+def block_accelerations(target_pos, source_pos, source_mass, G, acc):
+    # Adds the pull of the source rows on the target rows; same formula as integration.accelerations,
+    # where a row's own term is zero because r is zero
+    for i in prange(target_pos.shape[0]):
+        ax = 0.0
+        ay = 0.0
+        az = 0.0
+        for j in range(source_pos.shape[0]):
+            rx = source_pos[j, 0] - target_pos[i, 0]
+            ry = source_pos[j, 1] - target_pos[i, 1]
+            rz = source_pos[j, 2] - target_pos[i, 2]
+            r_mag = np.sqrt(rx * rx + ry * ry + rz * rz) + 1e-12
+            f = G * source_mass[j] / r_mag**3
+            ax += f * rx
+            ay += f * ry
+            az += f * rz
+        acc[i, 0] += ax
+        acc[i, 1] += ay
+        acc[i, 2] += az
+
+def massive(pos, mass):
+    """The rows of pos and mass that pull on anything; test particles (mass 0) are targets only."""
+    keep = mass > 0
+    return pos[keep], mass[keep]
+
+def partition(N, size):
+    """Row bounds of the block owned by every rank: rank k owns rows bounds[k]:bounds[k + 1]."""
+    return np.linspace(0, N, size + 1).astype(np.int64)
+
+class LocalComm:
+    """
+    Ranks as processes on this machine, linked by multiprocessing connections.
+
+    Rank 0 is the calling process; `launch` starts the others running
+    `worker_loop`. Every rank is linked to rank 0 and to its ring neighbours.
+    """
+    def __init__(self, rank, size, links, processes=()):
+        self.rank = rank
+        self.size = size
+        self.links = links
+        self.processes = list(processes)
+
+    @classmethod
+    def launch(cls, size):
+        authkey = secrets.token_bytes(16)
+        # The platform's local family (Unix sockets, named pipes on Windows): no TCP round-trip delays
+        listener = Listener(authkey=authkey)
+        env = dict(os.environ, DISTRIBUTED_AUTHKEY=authkey.hex())
+        # Share the cores between the ranks instead of every rank starting one numba thread per core
+        env['NUMBA_NUM_THREADS'] = str(max(1, (os.cpu_count() or 1) // size))
+        processes = [
+            subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', str(rank), str(size), listener.address], env=env)
+            for rank in range(1, size)
+        ]
+        links = {}
+        addresses = {}
+        for _ in range(size - 1):
+            conn = listener.accept()
+            rank, address = conn.recv()
+            links[rank] = conn
+            addresses[rank] = address
+        for conn in links.values():
+            conn.send(addresses)
+        listener.close()
+        return cls(0, size, links, processes)
+
+    @classmethod
+    def connect(cls, rank, size, root_address, authkey):
+        listener = Listener(authkey=authkey)
+        root = Client(root_address, authkey=authkey)
+        root.send((rank, listener.address))
+        addresses = root.recv()
+        links = {0: root}
+        # Connect forward and accept from behind; the chain ends at the rank whose next is 0
+        following = (rank + 1) % size
+        if following not in links:
+            links[following] = Client(addresses[following], authkey=authkey)
+            links[following].send(rank)
+        previous = (rank - 1) % size
+        if previous not in links:
+            conn = listener.accept()
+            links[conn.recv()] = conn
+        listener.close()
+        return cls(rank, size, links)
+
+    def send(self, dest, obj):
+        self.links[dest].send(obj)
+
+    def recv(self, source):
+        return self.links[source].recv()
+
+    def sendrecv(self, obj, dest, source):
+        # Send from a thread so a full ring of blocking sends cannot deadlock
+        sender = threading.Thread(target=self.links[dest].send, args=(obj,))
+        sender.start()
+        received = self.links[source].recv()
+        sender.join()
+        return received
+
+    def bcast(self, obj):
+        if self.rank != 0:
+            return self.recv(0)
+        for rank in range(1, self.size):
+            self.send(rank, obj)
+        return obj
+
+    def scatter(self, items):
+        if self.rank != 0:
+            return self.recv(0)
+        for rank in range(1, self.size):
+            self.send(rank, items[rank])
+        return items[0]
+
+    def gather(self, obj):
+        if self.rank != 0:
+            self.send(0, obj)
+            return None
+        return [obj] + [self.recv(rank) for rank in range(1, self.size)]
+
+    def close(self):
+        for conn in self.links.values():
+            conn.close()
+        for process in self.processes:
+            process.wait()
+
+class MPIComm:
+    """The same interface over mpi4py's COMM_WORLD."""
+    def __init__(self):
+        from mpi4py import MPI
+        self.comm = MPI.COMM_WORLD
+        self.rank = self.comm.Get_rank()
+        self.size = self.comm.Get_size()
+
+    def send(self, dest, obj):
+        self.comm.send(obj, dest=dest)
+
+    def recv(self, source):
+        return self.comm.recv(source=source)
+
+    def sendrecv(self, obj, dest, source):
+        return self.comm.sendrecv(obj, dest=dest, source=source)
+
+    def bcast(self, obj):
+        return self.comm.bcast(obj, root=0)
+
+    def scatter(self, items):
+        return self.comm.scatter(items, root=0)
+
+    def gather(self, obj):
+        return self.comm.gather(obj, root=0)
+
+    def close(self):
+        pass
+
+def ring_accelerations(comm, pos, mass, G):
+    """Accelerations of this rank's block, passing the blocks once around the ring."""
+    acc = np.zeros((len(pos), 3))
+    visiting = massive(pos, mass)
+    for step in range(comm.size):
+        block_accelerations(pos, visiting[0], visiting[1], G, acc)
+        if step < comm.size - 1:
+            visiting = comm.sendrecv(visiting, (comm.rank + 1) % comm.size, (comm.rank - 1) % comm.size)
+    return acc
+
+def rank_forces(comm, exchange, G, pos=None, mass=None, shared=None):
+    """One force evaluation, run by every rank; pos, mass and the shared block are only given on rank 0."""
+    bounds = comm.bcast(partition(len(pos), comm.size) if comm.rank == 0 else None)
+    lo, hi = bounds[comm.rank], bounds[comm.rank + 1]
+    if exchange == 'shared':
+        name, N = comm.bcast(shared if comm.rank == 0 else None)
+        pos, mass, acc = shared_arrays(name, N)
+        acc[lo:hi] = 0.0
+        block_accelerations(pos[lo:hi], *massive(pos, mass), G, acc[lo:hi])
+        comm.gather(None)  # Every block is written once this returns on rank 0
+        return [acc]
+    if exchange == 'ring':
+        block = comm.scatter([(pos[bounds[k]:bounds[k + 1]], mass[bounds[k]:bounds[k + 1]]) for k in range(comm.size)] if comm.rank == 0 else None)
+        acc = ring_accelerations(comm, block[0], block[1], G)
+    else:
+        pos, mass = comm.bcast((pos, mass))
+        acc = np.zeros((hi - lo, 3))
+        block_accelerations(pos[lo:hi], *massive(pos, mass), G, acc)
+    return comm.gather(acc)
+
+def map_force_block(buffer, N):
+    # pos, mass and acc of a shared force block
+    return (np.ndarray((N, 3), buffer=buffer),
+            np.ndarray(N, buffer=buffer, offset=N * 24),
+            np.ndarray((N, 3), buffer=buffer, offset=N * 32))
+
+_attached = {}  # Shared force block mapped by this rank, by name; rank 0 keeps the block it created
+_block_ids = itertools.count(1)
+
+def shared_arrays(name, N):
+    if name not in _attached:
+        from shared_state import attach_block, release_block
+        for block, _ in _attached.values():
+            if block is not None:
+                release_block(block)
+        _attached.clear()
+        block, buffer = attach_block(name)
+        _attached[name] = (block, map_force_block(buffer, N))
+    return _attached[name][1]
+
+def worker_loop(comm):
+    while True:
+        command = comm.bcast(None)
+        if command[0] == 'stop':
+            break
+        _, exchange, G = command
+        rank_forces(comm, exchange, G)
+    comm.close()
+
+class DistributedBackend:
+    """Force backend with the signature of integration.FORCE_BACKENDS entries, run on rank 0."""
+    def __init__(self, comm, exchange='allgather'):
+        if exchange not in ('allgather', 'ring', 'shared'):
+            raise ValueError(f"Unknown exchange pattern '{exchange}', use 'allgather', 'ring' or 'shared'")
+        self.comm = comm
+        self.exchange = exchange
+        self.closed = False
+        self._block = None
+        self._block_name = None
+        self._block_arrays = None
+
+    def _shared_block(self, N):
+        from shared_state import create_block, release_block
+        if self._block_arrays is None or len(self._block_arrays[1]) != N:
+            if self._block is not None:
+                self._block_arrays = None
+                _attached.clear()
+                release_block(self._block, unlink=True)
+            self._block_name = f"astrosim_forces_{os.getpid()}_{next(_block_ids)}"
+            self._block, buffer = create_block(self._block_name, N * 56)
+            self._block_arrays = map_force_block(buffer, N)
+            _attached.clear()
+            _attached[self._block_name] = (None, self._block_arrays)
+        return self._block_arrays
+
+    def __call__(self, pos, mass, G, acc):
+        self.comm.bcast(('forces', self.exchange, G))
+        if self.exchange == 'shared':
+            shared_pos, shared_mass, shared_acc = self._shared_block(len(pos))
+            shared_pos[:] = pos
+            shared_mass[:] = mass  # Mass rates change them every step, and a copy is cheap next to the forces
+            rank_forces(self.comm, self.exchange, G, pos, mass, (self._block_name, len(pos)))
+            acc[:] = shared_acc
+            return
+        acc[:] = np.concatenate(rank_forces(self.comm, self.exchange, G, pos, mass))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.comm.bcast(('stop',))
+            self.comm.close()
+            if self._block is not None:
+                from shared_state import release_block
+                self._block_arrays = None
+                _attached.clear()
+                release_block(self._block, unlink=True)
+
+def setup(transport='local', ranks=2, exchange='allgather'):
+    """
+    Register the 'distributed' force backend and return it.
+
+    With the 'mpi' transport every rank but 0 enters the worker loop here
+    and exits when the simulation closes the backend.
+    """
+    import integration
+
+    if transport == 'mpi':
+        comm = MPIComm()
+        if comm.rank != 0:
+            worker_loop(comm)
+            sys.exit(0)
+    elif transport == 'local':
+        comm = LocalComm.launch(ranks)
+    else:
+        raise ValueError(f"Unknown transport '{transport}', use 'local' or 'mpi'")
+    backend = DistributedBackend(comm, exchange)
+    integration.FORCE_BACKENDS['distributed'] = backend
+    atexit.register(backend.close)
+    return backend
+
+if __name__ == '__main__' and len(sys.argv) == 5 and sys.argv[1] == '--worker':
+    # Started by LocalComm.launch
+    rank, size, root_address = int(sys.argv[2]), int(sys.argv[3]), sys.argv[4]
+    worker_loop(LocalComm.connect(rank, size, root_address, bytes.fromhex(os.environ['DISTRIBUTED_AUTHKEY'])))
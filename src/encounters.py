@@ -0,0 +1,149 @@
+"""
+Close-encounter detection and sub-integration.
+
+Before each global step, every row gets a Hill radius with respect to its
+dominant attractor (its parent for named bodies, the most massive row
+otherwise). Pairs whose Hill spheres touch during the step are found with
+the sort-and-sweep kernel of collisions.py, so not every pair is scanned.
+Pairs that are gravitationally bound to each other (a moon and its planet)
+are regular orbits, not encounters, and are left alone.
+
+Connected pairs form groups. After the global step has moved everything,
+each group is integrated again over the same interval with an adaptive
+Dormand-Prince RK5(4) integrator. The group feels its own members exactly
+and the rest of the system along a cubic Hermite interpolation of the
+global step, so only the encountering rows pay for the small steps.
+"""
+import numpy as np
+from collisions import swept_pairs, name_of
+from distributed import block_accelerations
+
+enabled = False  # Set by main.py or the 'encounters' console command
+HILL_FACTOR = 1.0  # Encounter when closer than this many (summed) Hill radii
+TOLERANCE = 1e-10  # Relative error per substep of the sub-integrator
+MAX_SUBSTEPS = 100000  # Attempted substeps, accepted or not, per group and global step
+MIN_SUBSTEP = 1e-12  # Smallest substep as a fraction of the global step
+active = []  # Names of the rows in each group of the last step
+substeps = 0  # Substeps taken in the last step
+
+# Dormand-Prince 5(4) tableau
+DP_C = np.array([0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1, 1])
+DP_A = [
+    [],
+    [1 / 5],
+    [3 / 40, 9 / 40],
+    [44 / 45, -56 / 15, 32 / 9],
+    [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+    [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+    [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84],
+]
+DP_B = np.array([35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0])
+DP_E = DP_B - np.array([5179 / 57600, 0, 7571 / 16695, 393 / 640, -92097 / 339200, 187 / 2100, 1 / 40])
+
+def hill_radii(state):
+    """Hill radius of every row around its parent (named bodies) or the most massive row."""
+    primary = int(np.argmax(state.mass))
+    if state.mass[primary] == 0:
+        return np.zeros(state.n)
+    attractor = np.full(state.n, primary)
+    for i, b in enumerate(state.bodies):
+        row = state.row_of(b.parent) if b.parent is not None else None
+        if row is not None:
+            attractor[i] = row
+    distance = np.linalg.norm(state.pos - state.pos[attractor], axis=1)
+    radii = distance * np.cbrt(state.mass / (3 * state.mass[attractor]))
+    radii[primary] = 0.0
+    return radii
+
+def find_groups(state, dt, G):
+    """Rows that will pass through each other's Hill spheres during the next step, as lists of connected rows."""
+    if G == 0 or state.n < 2:
+        return []
+    rows = np.arange(state.n)
+    end = state.pos + state.vel * dt  # Straight-line prediction, enough for the broad phase
+    spread = state.pos.max(axis=0) - state.pos.min(axis=0)
+    pairs, _ = swept_pairs(state.pos, end, HILL_FACTOR * hill_radii(state), rows, int(np.argmax(spread)))
+    parent = {}
+    def root(i):
+        while parent.get(i, i) != i:
+            i = parent[i]
+        return i
+    for i, j in pairs:
+        r = np.linalg.norm(state.pos[j] - state.pos[i])
+        v = np.linalg.norm(state.vel[j] - state.vel[i])
+        if 0.5 * v**2 - G * (state.mass[i] + state.mass[j]) / r < 0:
+            continue  # Bound to each other
+        parent.setdefault(i, i)
+        parent.setdefault(j, j)
+        parent[root(i)] = root(j)
+    groups = {}
+    for i in parent:
+        groups.setdefault(root(i), []).append(i)
+    return [np.array(sorted(group)) for group in groups.values()]
+
+def hermite(p0, v0, p1, v1, s, dt):
+    """Cubic Hermite position at fraction s of a step of length dt."""
+    return ((2 * s**3 - 3 * s**2 + 1) * p0 + (s**3 - 2 * s**2 + s) * dt * v0
+            + (-2 * s**3 + 3 * s**2) * p1 + (s**3 - s**2) * dt * v1)
+
+def integrate_group(group, start_pos, start_vel, state, dt, G):
+    """
+    Re-integrate the rows of `group` from the start of the step; returns the number of substeps.
+
+    If the substeps run out or shrink below MIN_SUBSTEP before reaching the
+    end of the step, the group keeps the result of the global step, so it
+    never ends up at a different time than the rest of the system.
+    """
+    outside = state.mass > 0  # Massless rows outside the group pull on nothing
+    outside[group] = False
+    ext = (start_pos[outside], start_vel[outside], state.pos[outside], state.vel[outside])
+    ext_mass = state.mass[outside]
+    mass = state.mass[group]
+
+    def derivative(t, y):
+        pos = y[0]
+        acc = np.zeros_like(pos)
+        block_accelerations(pos, pos, mass, G, acc)
+        block_accelerations(pos, hermite(ext[0], ext[1], ext[2], ext[3], t / dt, dt), ext_mass, G, acc)
+        return np.stack([y[1], acc])
+
+    y = np.stack([start_pos[group], start_vel[group]])
+    t = 0.0
+    h = dt
+    steps = 0
+    attempts = 0
+    while t < dt and attempts < MAX_SUBSTEPS and h >= MIN_SUBSTEP * dt and t + h > t:
+        attempts += 1
+        h = min(h, dt - t)
+        k = []
+        for c, a in zip(DP_C, DP_A):
+            k.append(derivative(t + c * h, y + h * sum(a_j * k_j for a_j, k_j in zip(a, k))))
+        y_new = y + h * sum(b * k_i for b, k_i in zip(DP_B, k))
+        error = h * sum(e * k_i for e, k_i in zip(DP_E, k))
+        # Positions and velocities each against the largest of the group, so a row at rest still has a scale
+        scale = TOLERANCE * np.maximum(np.linalg.norm(y, axis=2), np.linalg.norm(y_new, axis=2)).max(axis=1)[:, None, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.max(np.abs(error) / scale)
+        if not np.isfinite(ratio):
+            ratio = np.inf  # Overflow or coincident rows: reject and shrink as far as allowed
+        if ratio <= 1.0:
+            t += h
+            if dt - t < MIN_SUBSTEP * dt:
+                t = dt  # What is left is rounding
+            y = y_new
+            steps += 1
+        h *= min(5.0, max(0.2, 0.9 * ratio ** -0.2)) if ratio > 0 else 5.0
+    if t < dt:
+        names = ', '.join(name_of(state, i) for i in group[:5])
+        print(f"Encounter of {names} not resolved after {attempts} substeps ({t / dt:.1%} of the step), keeping the global step")
+        return steps
+    state.pos[group] = y[0]
+    state.vel[group] = y[1]
+    return steps
+
+def sub_integrate(state, groups, start_pos, start_vel, dt, G):
+    """Replace the global step of the encountering groups with their sub-integration."""
+    global substeps
+    substeps = sum(integrate_group(group, start_pos, start_vel, state, dt, G) for group in groups)
+    active[:] = [[name_of(state, i) for i in group] for group in groups]
+    return substeps
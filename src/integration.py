@@ -1,110 +1,413 @@
 import numpy as np
 from numba import njit, prange
+from perf import perf
+from constants import C
+
+mass_epoch = 0  # Bumped by masses_changed; tables derived from the masses are kept until it moves
+
+def masses_changed(state=None):
+    """State mass listener: a mass event (rows added or removed, a merge, an edit), so derived tables are stale."""
+    global mass_epoch
+    mass_epoch += 1
+
+class MassTables:
+    """
+    Tables a force backend derives from the structure of the masses, e.g. the massive rows.
+
+    `build(mass)` runs again only for a mass array it has not seen or
+    after a mass event, not on every force evaluation. A few arrays are
+    kept at once, so the start-of-step masses and the stage buffers of
+    rows losing mass do not evict each other. Values that follow the
+    masses continuously (G * mass) are computed per call instead: mass
+    rates change them every step without a mass event. A row gaining
+    mass from zero joins the sources after the step it crossed.
+    """
+    SLOTS = 4
+
+    def __init__(self, build):
+        self.build = build
+        self.slots = []  # [(mass, key, tables)], most recent first
+
+    def __call__(self, mass):
+        key = (mass_epoch, len(mass))
+        for k, (slot_mass, slot_key, tables) in enumerate(self.slots):
+            if slot_mass is mass:
+                if slot_key == key:
+                    if k:
+                        self.slots.insert(0, self.slots.pop(k))
+                    return tables
+                del self.slots[k]
+                break
+        tables = self.build(mass)
+        perf.count('mass_table_builds')
+        self.slots.insert(0, (mass, key, tables))
+        del self.slots[self.SLOTS:]
+        return tables
+
+def massive_rows(mass):
+    # Only rows with mass pull on anything; test particles (mass 0) are targets only
+    return np.flatnonzero(mass > 0)
 
 @njit(parallel=True)
-def euler_step(pos, vel, mass, dt, G):
+def accelerations_kernel(pos, mass, sources, G, acc):
     N = pos.shape[0]
-    acc = np.zeros((N, 3))
     for i in prange(N):
-        for j in range(N):
+        ax = 0.0
+        ay = 0.0
+        az = 0.0
+        for s in range(sources.shape[0]):
+            j = sources[s]
             if i != j:
-                r = pos[j] - pos[i]
-                r_mag = np.sqrt(np.sum(r**2)) + 1e-12
-                acc[i] += G * mass[j] * r / r_mag**3
-    vel += acc * dt
-    pos += vel * dt
+                rx = pos[j, 0] - pos[i, 0]
+                ry = pos[j, 1] - pos[i, 1]
+                rz = pos[j, 2] - pos[i, 2]
+                r_mag = np.sqrt(rx * rx + ry * ry + rz * rz) + 1e-12
+                # One factor per pair instead of the original G * m * r / r**3 per component: the same
+                # to rounding, but velocities can differ from the old steps in the last bits (~1e-13 m/s)
+                f = G * mass[j] / r_mag**3
+                ax += f * rx
+                ay += f * ry
+                az += f * rz
+        acc[i, 0] = ax
+        acc[i, 1] = ay
+        acc[i, 2] = az
 
-@njit(parallel=True)
-def verlet_step(pos, vel, mass, dt, G):
+sources_numba = MassTables(massive_rows)
+
+def accelerations(pos, mass, G, acc):
+    accelerations_kernel(pos, mass, sources_numba(mass), G, acc)
+
+sources_numpy = MassTables(massive_rows)
+
+def accelerations_numpy(pos, mass, G, acc):
+    # Reference implementation, a block of rows at a time to bound the (rows, sources, 3) temporaries
     N = pos.shape[0]
-    acc = np.zeros((N, 3))
-    for i in prange(N):
-        for j in range(N):
-            if i != j:
-                r = pos[j] - pos[i]
-                r_mag = np.sqrt(np.sum(r**2)) + 1e-12
-                acc[i] += G * mass[j] * r / r_mag**3
-    pos_new = pos + vel * dt + 0.5 * acc * dt**2
-    acc_new = np.zeros((N, 3))
-    for i in prange(N):
-        for j in range(N):
-            if i != j:
-                r = pos_new[j] - pos_new[i]
-                r_mag = np.sqrt(np.sum(r**2)) + 1e-12
-                acc_new[i] += G * mass[j] * r / r_mag**3
-    vel += 0.5 * (acc + acc_new) * dt
-    pos[:] = pos_new
+    sources = sources_numpy(mass)
+    source_pos = pos[sources]
+    block = max(1, 2**20 // max(len(sources), 1))
+    for start in range(0, N, block):
+        stop = min(start + block, N)
+        r = source_pos[None, :, :] - pos[start:stop, None, :]
+        r_mag = np.sqrt(np.sum(r**2, axis=2)) + 1e-12
+        f = G * mass[None, sources] / r_mag**3
+        f[sources[None, :] == np.arange(start, stop)[:, None]] = 0.0
+        acc[start:stop] = np.sum(f[:, :, None] * r, axis=1)
 
 @njit(parallel=True)
-def leapfrog_step(pos, vel, mass, dt, G):
+def cluster_offsets(pos, origins, cluster, offsets):
+    # Nearest origin of every row and the row's float32 offset from it
     N = pos.shape[0]
-    acc = np.zeros((N, 3))
     for i in prange(N):
-        for j in range(N):
-            if i != j:
-                r = pos[j] - pos[i]
-                r_mag = np.sqrt(np.sum(r**2)) + 1e-12
-                acc[i] += G * mass[j] * r / r_mag**3
-    vel += 0.5 * acc * dt
-    pos += vel * dt
-    acc_new = np.zeros((N, 3))
+        best = 0
+        best_d = np.inf
+        for c in range(origins.shape[0]):
+            dx = pos[i, 0] - origins[c, 0]
+            dy = pos[i, 1] - origins[c, 1]
+            dz = pos[i, 2] - origins[c, 2]
+            d = dx * dx + dy * dy + dz * dz
+            if d < best_d:
+                best_d = d
+                best = c
+        cluster[i] = best
+        for k in range(3):
+            offsets[i, k] = np.float32(pos[i, k] - origins[best, k])
+
+@njit(parallel=True, fastmath=True)
+def accelerations_float32(offsets, cluster, deltas, source_x, source_y, source_z, source_gm, cluster_start, acc):
+    # Sources are sorted by cluster, so the inner loop runs over contiguous float32 arrays
+    N = offsets.shape[0]
+    C = deltas.shape[0]
     for i in prange(N):
-        for j in range(N):
-            if i != j:
-                r = pos[j] - pos[i]
-                r_mag = np.sqrt(np.sum(r**2)) + 1e-12
-                acc_new[i] += G * mass[j] * r / r_mag**3
-    vel += 0.5 * acc_new * dt
+        ci = cluster[i]
+        ax = np.float32(0.0)
+        ay = np.float32(0.0)
+        az = np.float32(0.0)
+        for c in range(C):
+            # Origin-to-origin part from the float64-derived table, so only the small offsets lose precision
+            bx = deltas[ci, c, 0] - offsets[i, 0]
+            by = deltas[ci, c, 1] - offsets[i, 1]
+            bz = deltas[ci, c, 2] - offsets[i, 2]
+            for s in range(cluster_start[c], cluster_start[c + 1]):
+                rx = bx + source_x[s]
+                ry = by + source_y[s]
+                rz = bz + source_z[s]
+                # A 1 m floor keeps the row itself (r = 0) finite so the loop needs no branch
+                r2 = max(rx * rx + ry * ry + rz * rz, np.float32(1.0))
+                inv_r = np.float32(1.0) / np.sqrt(r2)
+                # GM * inv_r first: r^3 itself overflows float32 beyond ~1e12 m
+                f = source_gm[s] * inv_r * inv_r * inv_r
+                ax += f * rx
+                ay += f * ry
+                az += f * rz
+        acc[i, 0] = ax
+        acc[i, 1] = ay
+        acc[i, 2] = az
+
+TILE_ROWS = 64   # Rows per parallel chunk
+TILE_SOURCES = 512  # Sources per tile, 4 float64 arrays of this length stay in L1
+
+def tiled_kernel(x, y, z, source_x, source_y, source_z, gm, acc_x, acc_y, acc_z):
+    N = x.shape[0]
+    M = source_x.shape[0]
+    n_chunks = (N + TILE_ROWS - 1) // TILE_ROWS
+    for chunk in prange(n_chunks):
+        i0 = chunk * TILE_ROWS
+        i1 = min(i0 + TILE_ROWS, N)
+        for i in range(i0, i1):
+            acc_x[i] = 0.0
+            acc_y[i] = 0.0
+            acc_z[i] = 0.0
+        # Every row of the chunk reuses one tile of sources while it is still in cache
+        for j0 in range(0, M, TILE_SOURCES):
+            j1 = min(j0 + TILE_SOURCES, M)
+            for i in range(i0, i1):
+                xi = x[i]
+                yi = y[i]
+                zi = z[i]
+                ax = 0.0
+                ay = 0.0
+                az = 0.0
+                for j in range(j0, j1):
+                    rx = source_x[j] - xi
+                    ry = source_y[j] - yi
+                    rz = source_z[j] - zi
+                    # The floor (the 1e-12 m softening squared) makes the row itself contribute 0 without a branch
+                    r2 = max(rx * rx + ry * ry + rz * rz, 1e-24)
+                    inv_r = 1.0 / np.sqrt(r2)
+                    f = gm[j] * inv_r * inv_r * inv_r
+                    ax += f * rx
+                    ay += f * ry
+                    az += f * rz
+                acc_x[i] += ax
+                acc_y[i] += ay
+                acc_z[i] += az
+
+# Same source twice: fastmath lets LLVM reorder the sums and vectorize the inner loop,
+# which changes the results in the last few bits
+accelerations_tiled_kernel = njit(parallel=True)(tiled_kernel)
+accelerations_tiled_fast_kernel = njit(parallel=True, fastmath=True)(tiled_kernel)
+
+def tiled_backend(kernel):
+    sources_tiled = MassTables(massive_rows)
+    def accelerations_tiled(pos, mass, G, acc):
+        # Separate x/y/z arrays so the inner loop reads contiguous memory
+        x = np.ascontiguousarray(pos[:, 0])
+        y = np.ascontiguousarray(pos[:, 1])
+        z = np.ascontiguousarray(pos[:, 2])
+        sources = sources_tiled(mass)
+        gm = G * mass[sources]
+        N = pos.shape[0]
+        acc_x = np.empty(N)
+        acc_y = np.empty(N)
+        acc_z = np.empty(N)
+        kernel(x, y, z, x[sources], y[sources], z[sources], gm, acc_x, acc_y, acc_z)
+        acc[:, 0] = acc_x
+        acc[:, 1] = acc_y
+        acc[:, 2] = acc_z
+    return accelerations_tiled
+
+MIXED_ORIGINS = 8  # Reference origins for the mixed-precision backend: the heaviest bodies
+
+def mixed_mass_tables(mass):
+    # The heaviest rows as origins and the rows that are sources at all
+    N = len(mass)
+    C = min(MIXED_ORIGINS, N)
+    heavy = np.argpartition(-mass, C - 1)[:C] if C < N else np.arange(N)
+    return heavy, massive_rows(mass)
+
+mixed_tables = MassTables(mixed_mass_tables)
+
+def accelerations_mixed(pos, mass, G, acc):
+    """
+    Mixed-precision accelerations for large particle counts.
+
+    Each row is stored as a float32 offset from the nearest of the heaviest
+    bodies (the Sun, the giant planets), and the separations between those
+    origins come from a float64 table, so a moon next to its planet keeps
+    its precision while the pairwise math runs in float32. Massless rows
+    are skipped as sources. The typical relative error is around 1e-6, with
+    the worst rows of large crowded systems near 1e-4; check it with
+    `backend_error` or `benchmark.py --validate` before relying on it.
+    """
+    N = pos.shape[0]
+    heavy, sources = mixed_tables(mass)
+    C = len(heavy)
+    origins = pos[heavy]
+    cluster = np.empty(N, dtype=np.int32)
+    offsets = np.empty((N, 3), dtype=np.float32)
+    cluster_offsets(pos, origins, cluster, offsets)
+    deltas = (origins[None, :, :] - origins[:, None, :]).astype(np.float32)
+    sources = sources[np.argsort(cluster[sources], kind='stable')]
+    cluster_start = np.searchsorted(cluster[sources], np.arange(C + 1)).astype(np.int64)
+    source_offsets = np.ascontiguousarray(offsets[sources].T)
+    acc32 = np.empty((N, 3), dtype=np.float32)
+    accelerations_float32(offsets, cluster, deltas, source_offsets[0], source_offsets[1], source_offsets[2],
+                          (G * mass[sources]).astype(np.float32), cluster_start, acc32)
+    acc[:] = acc32
+
+# Interchangeable implementations of accelerations(pos, mass, G, acc)
+FORCE_BACKENDS = {
+    'numba': accelerations,
+    'numpy': accelerations_numpy,
+    'mixed': accelerations_mixed,
+    'tiled': tiled_backend(accelerations_tiled_kernel),
+    'tiled_fastmath': tiled_backend(accelerations_tiled_fast_kernel),
+}
+force_backend = 'numba'
+
+def set_force_backend(name):
+    global force_backend
+    if name not in FORCE_BACKENDS:
+        raise ValueError(f"Unknown force backend '{name}', choose from {', '.join(FORCE_BACKENDS)}")
+    force_backend = name
+
+def backend_error(name, pos, mass, G, reference='numba'):
+    """Per-row relative acceleration error of a force backend against the reference: (max, median)."""
+    N = pos.shape[0]
+    acc = np.empty((N, 3))
+    acc_ref = np.empty((N, 3))
+    FORCE_BACKENDS[name](pos, mass, G, acc)
+    FORCE_BACKENDS[reference](pos, mass, G, acc_ref)
+    norm = np.linalg.norm(acc_ref, axis=1)
+    moving = norm > 0
+    error = np.linalg.norm(acc - acc_ref, axis=1)[moving] / norm[moving]
+    if len(error) == 0:
+        return 0.0, 0.0
+    return float(np.max(error)), float(np.median(error))
 
 @njit(parallel=True)
-def rk4_step(pos, vel, mass, dt, G):
+def post_newtonian_kernel(pos, vel, mass, G, central, c2, threshold, acc):
+    # 1PN correction of every row in the field of the central body (its Schwarzschild term),
+    # with the reaction on the central body so momentum is kept
     N = pos.shape[0]
-    k1_vel = np.copy(vel)
-    k1_acc = np.zeros((N, 3))
+    GM = G * mass[central]
+    reaction = np.zeros((N, 3))
     for i in prange(N):
-        for j in range(N):
-            if i != j:
-                r = pos[j] - pos[i]
-                r_mag = np.sqrt(np.sum(r**2)) + 1e-12
-                k1_acc[i] += G * mass[j] * r / r_mag**3
-    k1_pos = k1_vel * dt
+        if i == central:
+            continue
+        rx = pos[i, 0] - pos[central, 0]
+        ry = pos[i, 1] - pos[central, 1]
+        rz = pos[i, 2] - pos[central, 2]
+        vx = vel[i, 0] - vel[central, 0]
+        vy = vel[i, 1] - vel[central, 1]
+        vz = vel[i, 2] - vel[central, 2]
+        r = np.sqrt(rx * rx + ry * ry + rz * rz)
+        if r == 0.0 or GM / (c2 * r) < threshold:
+            continue
+        v2 = vx * vx + vy * vy + vz * vz
+        rv = rx * vx + ry * vy + rz * vz
+        f = GM / (c2 * r**3)
+        a = 4.0 * GM / r - v2
+        ax = f * (a * rx + 4.0 * rv * vx)
+        ay = f * (a * ry + 4.0 * rv * vy)
+        az = f * (a * rz + 4.0 * rv * vz)
+        acc[i, 0] += ax
+        acc[i, 1] += ay
+        acc[i, 2] += az
+        reaction[i, 0] = mass[i] * ax
+        reaction[i, 1] = mass[i] * ay
+        reaction[i, 2] = mass[i] * az
+    for k in range(3):
+        acc[central, k] -= reaction[:, k].sum() / mass[central]
+
+PN_THRESHOLD = 1e-12  # Rows where GM / (c^2 r) is below this get no 1PN term (beyond ~1e4 AU from the Sun)
+
+def post_newtonian(pos, vel, mass, G, acc):
+    """1PN (general relativity) correction around the most massive body, e.g. Mercury's perihelion precession."""
+    central = int(np.argmax(mass))
+    if mass[central] > 0:
+        post_newtonian_kernel(pos, vel, mass, G, central, C**2, PN_THRESHOLD, acc)
+
+# Velocity-dependent or extra forces added on top of the force backend: f(pos, vel, mass, G, acc) adds into acc
+PERTURBATIONS = {
+    '1pn': post_newtonian,
+}
+perturbations = []  # Enabled perturbations, applied in this order
+
+def set_perturbation(name, enabled=True):
+    if name not in PERTURBATIONS:
+        raise ValueError(f"Unknown perturbation '{name}', choose from {', '.join(PERTURBATIONS)}")
+    if enabled and name not in perturbations:
+        perturbations.append(name)
+    elif not enabled and name in perturbations:
+        perturbations.remove(name)
+
+counted_sources = MassTables(massive_rows)  # For the interactions counter, whichever backend runs
+
+def compute_accelerations(pos, mass, G, stage, vel=None):
+    # Every force evaluation goes through here so it can be timed and counted per stage
+    N = pos.shape[0]
+    acc = np.empty((N, 3))
+    with perf.timer(stage):
+        FORCE_BACKENDS[force_backend](pos, mass, G, acc)
+    for name in perturbations:
+        with perf.timer(f'perturbation.{name}'):
+            PERTURBATIONS[name](pos, vel, mass, G, acc)
+    perf.count('interactions', N * len(counted_sources(mass)))  # Targets times the massive sources
+    return acc
+
+stage_buffers = {}  # Stage name -> array the masses at that stage are written into, reused every step
+
+def stage_mass(mass, mdot, t, stage):
+    """Masses t seconds into a step of rows changing mass at mdot per second."""
+    if mdot is None:
+        return mass
+    out = stage_buffers.get(stage)
+    if out is None or out.shape != mass.shape:
+        out = stage_buffers[stage] = np.empty_like(mass)
+    np.multiply(mdot, t, out=out)
+    out += mass
+    np.maximum(out, 0.0, out=out)
+    return out
+
+# The steppers take the masses at the start of the step and, for rows losing or gaining mass, the rates
+# `mdot`, so every force evaluation sees the masses at its own time; they leave the masses themselves alone
+# (state.apply_mass_rates advances them after the step)
+def euler_step(pos, vel, mass, dt, G, mdot=None):
+    acc = compute_accelerations(pos, mass, G, 'euler.acc', vel)
+    with perf.timer('euler.update'):
+        vel += acc * dt
+        pos += vel * dt
+
+def verlet_step(pos, vel, mass, dt, G, mdot=None):
+    acc = compute_accelerations(pos, mass, G, 'verlet.acc', vel)
+    with perf.timer('verlet.drift'):
+        pos_new = pos + vel * dt + 0.5 * acc * dt**2
+    acc_new = compute_accelerations(pos_new, stage_mass(mass, mdot, dt, 'end'), G, 'verlet.acc_new', vel + acc * dt if perturbations else None)
+    with perf.timer('verlet.kick'):
+        vel += 0.5 * (acc + acc_new) * dt
+        pos[:] = pos_new
+
+def leapfrog_step(pos, vel, mass, dt, G, mdot=None):
+    acc = compute_accelerations(pos, mass, G, 'leapfrog.acc', vel)
+    with perf.timer('leapfrog.kick_drift'):
+        vel += 0.5 * acc * dt
+        pos += vel * dt
+    acc_new = compute_accelerations(pos, stage_mass(mass, mdot, dt, 'end'), G, 'leapfrog.acc_new', vel)
+    with perf.timer('leapfrog.kick'):
+        vel += 0.5 * acc_new * dt
+
+def rk4_step(pos, vel, mass, dt, G, mdot=None):
+    mid_mass = stage_mass(mass, mdot, 0.5 * dt, 'mid')
+    k1_acc = compute_accelerations(pos, mass, G, 'rk4.k1', vel)
+    k1_pos = vel * dt
     k1_acc_dt = k1_acc * dt
 
     k2_vel = vel + 0.5 * k1_acc_dt
-    k2_pos = pos + 0.5 * k1_pos
-    k2_acc = np.zeros((N, 3))
-    for i in prange(N):
-        for j in range(N):
-            if i != j:
-                r = k2_pos[j] - k2_pos[i]
-                r_mag = np.sqrt(np.sum(r**2)) + 1e-12
-                k2_acc[i] += G * mass[j] * r / r_mag**3
+    k2_acc = compute_accelerations(pos + 0.5 * k1_pos, mid_mass, G, 'rk4.k2', k2_vel)
     k2_pos = k2_vel * dt
     k2_acc_dt = k2_acc * dt
 
     k3_vel = vel + 0.5 * k2_acc_dt
-    k3_pos = pos + 0.5 * k2_pos
-    k3_acc = np.zeros((N, 3))
-    for i in prange(N):
-        for j in range(N):
-            if i != j:
-                r = k3_pos[j] - k3_pos[i]
-                r_mag = np.sqrt(np.sum(r**2)) + 1e-12
-                k3_acc[i] += G * mass[j] * r / r_mag**3
+    k3_acc = compute_accelerations(pos + 0.5 * k2_pos, mid_mass, G, 'rk4.k3', k3_vel)
     k3_pos = k3_vel * dt
     k3_acc_dt = k3_acc * dt
 
     k4_vel = vel + k3_acc_dt
-    k4_pos = pos + k3_pos
-    k4_acc = np.zeros((N, 3))
-    for i in prange(N):
-        for j in range(N):
-            if i != j:
-                r = k4_pos[j] - k4_pos[i]
-                r_mag = np.sqrt(np.sum(r**2)) + 1e-12
-                k4_acc[i] += G * mass[j] * r / r_mag**3
+    k4_acc = compute_accelerations(pos + k3_pos, stage_mass(mass, mdot, dt, 'end'), G, 'rk4.k4', k4_vel)
     k4_pos = k4_vel * dt
     k4_acc_dt = k4_acc * dt
 
-    pos += (k1_pos + 2 * k2_pos + 2 * k3_pos + k4_pos) / 6
-    vel += (k1_acc_dt + 2 * k2_acc_dt + 2 * k3_acc_dt + k4_acc_dt) / 6
\ No newline at end of file
+    with perf.timer('rk4.combine'):
+        pos += (k1_pos + 2 * k2_pos + 2 * k3_pos + k4_pos) / 6
+        vel += (k1_acc_dt + 2 * k2_acc_dt + 2 * k3_acc_dt + k4_acc_dt) / 6
@@ -2,13 +2,24 @@ import pygame
 import numpy as np
 #from load_scenario import load_scenario
 from planet import *
-from constants import YEAR, MONTH, WEEK, DAY, HOUR, MINUTE, SECOND
-from simulation import run_simulation
+from constants import YEAR, MONTH, WEEK, DAY, HOUR, MINUTE, SECOND, G
+from simulation import run_simulation, state, index
 from query import get_body_parameters
-from display import draw_objects, display_time, init_display, clear_body_trails
+from display import draw_objects, display_time, init_display, clear_body_trails, set_quality
 #from request import get_body_parameters
 from utilities import is_mouse_over_body, change_timestep, zoom, change_focus
 from starconsole import custom_repl
+from commands import CommandQueue, Settings
+from recorder import Recorder, next_screenshot_name
+from shared_state import SharedStateStore
+from remote import RemoteServer
+from stellar_evolution import StellarEvolution
+from scheduler import FrameScheduler
+from perf import perf
+from diagnostics import ConservationMonitor
+import integration
+import collisions
+import encounters
 import cProfile
 import threading
 import os
@@ -21,10 +32,17 @@ profile_simulation = False
 starconsole = True  # Enable console by default
 
 integration_method = 'rk4'
+force_backend = 'numba'  # See integration.FORCE_BACKENDS: 'numba', 'numpy', 'mixed', 'tiled', 'tiled_fastmath', 'distributed'
+distributed_transport = None  # 'local' (worker processes) or 'mpi' (under mpirun) registers the 'distributed' backend
+distributed_ranks = 4  # Processes for the 'local' transport; under MPI the size comes from mpirun
+distributed_exchange = 'allgather'  # 'allgather', 'ring' or 'shared' (shared memory, local transport only)
 
 get_real_parameters = True # Get real time body positions with 1 minute accuracy positions for objects from the Nasa Horizons API
+initial_epoch = None  # Julian date of the real positions; None is now, 'day' the last UTC midnight so launches on one day start identically
+state_snapshots = True  # Reuse the resolved initial state of the same bodies and epoch from state_cache/ (fixed initial_epoch only)
+scenario_path = None  # Replace the bodies of planet.py with a scenario file and its particle populations (beta/load_scenario.py)
 
-post_newtonian_correction = False
+post_newtonian_correction = False  # 1PN (general relativity) term around the Sun, see integration.PERTURBATIONS
 barnes_hut = False
 
 fade_trails = False
@@ -32,6 +50,7 @@ draw_trail_for_empty = True
 FULL_ORBITS = False
 display_names = True
 gravity_field = False  # Gravity field visualization
+particle_render = True  # Splat sub-pixel particles into the pixel buffer instead of drawing circles
 
 timestep_seconds = HOUR / 8 # Define the initial timestep value in seconds
 SCALE_DIST = 5e-10 # Calculate scaling factors for size and distance
@@ -39,12 +58,54 @@ ZOOM_SPEED = 1.2  # Adjust this value to increase/decrease the zoom speed
 screen_width = 1920
 screen_height = 1080
 gravity_enabled = True  # Default gravity state
+record_simulation = False  # Record every frame for the headless renderer (render.py --recording)
+recording_path = os.path.join("recordings", "latest")
+share_state = None  # Publish the state arrays in shared memory under this name (render.py --attach, analysis processes)
+remote_port = None  # Serve the console commands and a binary state stream over HTTP on this local port (remote.py)
+target_fps = 60  # Frame rate the scheduler aims for
+adaptive_quality = True  # Lower trail length, orbit resolution and gravity field density when frames run slow
+conservation_cadence = 100  # Steps between energy, momentum and angular momentum checks
+conservation_tolerance = 1e-6  # Relative energy drift considered acceptable
+auto_timestep = False  # Halve the timestep whenever the energy drift exceeds conservation_tolerance
+collisions_enabled = False  # Merge bodies and particles (with a radius) whose spheres touch during a step
+encounters_enabled = False  # Sub-integrate close flybys (Hill sphere overlaps) with an adaptive RK5(4) instead of the global step
+stellar_evolution_cadence = 1000  # Steps between batched updates of the age, stage, radius and color of every star
+stellar_time_scale = 1.0  # Stars age this many times faster than the simulation clock
 
-if get_real_parameters:
-    from query import get_body_parameters
+if distributed_transport:
+    import distributed
+    # Under MPI every rank but 0 stays inside setup as a force worker
+    distributed.setup(distributed_transport, distributed_ranks, distributed_exchange)
+integration.set_force_backend(force_backend)
+integration.set_perturbation('1pn', post_newtonian_correction)
+collisions.enabled = collisions_enabled
+encounters.enabled = encounters_enabled
 
+if scenario_path:
+    from beta.load_scenario import load_scenario, add_populations
+    scenario_bodies, scenario_populations = load_scenario(scenario_path)
+    bodies[:] = scenario_bodies  # In place: the state and the display share this list
+    focus_object = bodies[0]
+    state.pull_bodies()
+    add_populations(state, scenario_populations)
+
+if get_real_parameters and not scenario_path:
+    from query import get_all_body_parameters, julian_date_now, start_of_day
+    from state_cache import load_snapshot, save_snapshot
+
+    now = julian_date_now()
+    epoch = start_of_day(now) if initial_epoch == 'day' else initial_epoch if initial_epoch is not None else now
+    print(f"Initial state for Julian Date {epoch:.5f} ({(now - epoch) * 24:.1f} hours before now)")
+    # "Now" differs on every launch, so only a fixed epoch can be shared through a snapshot
+    snapshots = state_snapshots and initial_epoch is not None
+    if snapshots and load_snapshot(bodies, epoch):
+        print(f"Initial state for Julian Date {epoch:.5f} loaded from the snapshot cache")
+    else:
+        # Concurrently, one cache write; only states for exactly this epoch may go into a snapshot
+        resolved = get_all_body_parameters(bodies, epoch=epoch, exact=snapshots)
+        if snapshots and resolved:
+            save_snapshot(bodies, epoch)
     for body in bodies:
-        get_body_parameters(body)
         if debug:
             print(f"Updated {body.name}: Position = {body.pos}, Velocity = {body.vel}")
 
@@ -79,21 +140,16 @@ if profile_simulation:
     cProfile.run('profile(500)')
     exit()
 
-# Create a context dictionary that will be updated with simulation state
+# Commands from the console, applied by the main loop between steps
+commands = CommandQueue()
+
+# Namespace of the console; the main loop settings are copied in when console Python code runs
 sim_context = {
     'bodies': bodies,
-    'timestep_seconds': timestep_seconds,
-    'SCALE_DIST': SCALE_DIST,
-    'focus_object': focus_object,
-    'paused': False,
-    'running': True,
-    'gravity_enabled': gravity_enabled,
-    'integration_method': integration_method,
-    'FULL_ORBITS': FULL_ORBITS,
-    'display_names': display_names,
-    'fade_trails': fade_trails,
-    'draw_trail_for_empty': draw_trail_for_empty,
-    'gravity_field': gravity_field,
+    'state': state,
+    'index': index,
+    'commands': commands,
+    'perf': perf,
     'Sun': Sun,
     'Earth': Earth,
     'Mercury': Mercury,
@@ -127,6 +183,18 @@ if starconsole:
     repl_thread = threading.Thread(target=start_repl, daemon=True)
     repl_thread.start()
 
+recorder = Recorder(recording_path, state) if record_simulation else None
+shared_store = SharedStateStore(state, share_state) if share_state else None
+scheduler = FrameScheduler(target_fps, adaptive_quality)
+settings = Settings(globals(), scheduler)
+sim_context['scheduler'] = scheduler
+monitor = ConservationMonitor(conservation_cadence, conservation_tolerance, auto_timestep)
+sim_context['monitor'] = monitor
+evolution = StellarEvolution(stellar_evolution_cadence, stellar_time_scale)
+sim_context['evolution'] = evolution
+remote = RemoteServer(sim_context, remote_port).start() if remote_port else None
+sim_time = 0.0
+
 # Main simulation loop
 running = True
 paused = False
@@ -154,19 +222,9 @@ while running:
             if event.key == pygame.K_SPACE:
                 paused = not paused  # Toggle paused state
             elif event.key == pygame.K_F12:
-                # Create a folder if it doesn't exist
                 if debug_2:
                     print("Screenshot key pressed")
-                if not os.path.exists("screenshots"):
-                    os.mkdir("screenshots")
-                screenshot_folder = "screenshots"
-                screenshot_name = os.path.join(screenshot_folder, "screenshot.png")
-
-                if os.path.exists(screenshot_name):
-                    index = 1
-                    while os.path.exists(os.path.join(screenshot_folder, f"screenshot_{index}.png")):
-                        index += 1
-                    screenshot_name = os.path.join(screenshot_folder, f"screenshot_{index}.png")
+                screenshot_name = next_screenshot_name("screenshots")
 
                 pygame.image.save(screen, screenshot_name)
                 
@@ -192,47 +250,44 @@ while running:
                 # Zoom out: Page Down
                 SCALE_DIST = zoom(SCALE_DIST, ZOOM_SPEED, 'down')
 
-    # Sync with console: read console changes first, then update context
-    if starconsole:
-        # Read console-modified values first (before overwriting)
-        timestep_seconds = sim_context.get('timestep_seconds', timestep_seconds)
-        SCALE_DIST = sim_context.get('SCALE_DIST', SCALE_DIST)
-        focus_object = sim_context.get('focus_object', focus_object)
-        paused = sim_context.get('paused', paused)
-        running = sim_context.get('running', running)
-        gravity_enabled = sim_context.get('gravity_enabled', gravity_enabled)
-        FULL_ORBITS = sim_context.get('FULL_ORBITS', FULL_ORBITS)
-        fade_trails = sim_context.get('fade_trails', fade_trails)
-        draw_trail_for_empty = sim_context.get('draw_trail_for_empty', draw_trail_for_empty)
-        display_names = sim_context.get('display_names', display_names)
-        gravity_field = sim_context.get('gravity_field', gravity_field)
-        
-        # Now update context with current simulation state (for console to read)
-        sim_context.update({
-            'bodies': bodies,
-            'timestep_seconds': timestep_seconds,
-            'SCALE_DIST': SCALE_DIST,
-            'focus_object': focus_object,
-            'paused': paused,
-            'running': running,
-            'gravity_enabled': gravity_enabled,
-            'FULL_ORBITS': FULL_ORBITS,
-            'fade_trails': fade_trails,
-            'draw_trail_for_empty': draw_trail_for_empty,
-            'display_names': display_names,
-            'gravity_field': gravity_field,
-        })
-    
-    if not paused:
-        for body in bodies:
-            run_simulation(timestep_seconds, integration_method, FULL_ORBITS, gravity_enabled)
-        if debug:
-            for body in bodies:
-                print(body.name, body.pos, body.vel)
+    # Apply console and remote commands between steps
+    if starconsole or remote is not None:
+        with scheduler.phase('console'):
+            commands.apply(settings)
+
+    with scheduler.phase('physics'):
+        if not paused:
+            if shared_store is not None:
+                shared_store.begin_write()
+            # One step per body, counted before stepping: merges remove bodies from the list mid-frame
+            steps = len(bodies)
+            for _ in range(steps):
+                run_simulation(timestep_seconds, integration_method, FULL_ORBITS, gravity_enabled)
+                sim_time += timestep_seconds
+            state.push_masses()
+            if shared_store is not None:
+                shared_store.end_write(sim_time)
+            with perf.timer('diagnostics'):
+                if monitor.sample(state, G if gravity_enabled else 0.0, steps, sim_time):
+                    timestep_seconds /= 2
+                    monitor.reset()
+                    print(f"Energy drift {monitor.energy_drift:.2e} exceeds {monitor.tolerance:.0e}, timestep reduced to {timestep_seconds:.2f} s")
+            with perf.timer('stellar_evolution'):
+                evolution.advance(state, steps, steps * timestep_seconds)
+            if recorder is not None:
+                recorder.record(sim_time)
+            if debug:
+                for body in list(bodies):
+                    print(body.name, body.pos, body.vel)
+
+    if remote is not None:
+        with scheduler.phase('remote'):
+            remote.publish(sim_time)
 
     # Draw everything
-    draw_objects(focus_object, SCALE_DIST, FULL_ORBITS, draw_trail_for_empty, screen, fade_trails, display_names, gravity_field)
-    display_time(timestep_seconds, screen, paused)
+    with scheduler.phase('draw'):
+        draw_objects(focus_object, SCALE_DIST, FULL_ORBITS, draw_trail_for_empty, screen, fade_trails, display_names, gravity_field, particle_render)
+        display_time(timestep_seconds, screen, paused)
     
     """# Draw the button
     mouse_pos = pygame.mouse.get_pos()
@@ -242,7 +297,19 @@ while running:
         current_button_color = button_color
     draw_button(screen, button_rect, current_button_color)"""
     
-    pygame.display.flip()
-    pygame.time.wait(10)
+    with scheduler.phase('draw'):
+        pygame.display.flip()
+
+    # Sleep out the rest of the frame budget, trading drawing quality for speed when over it
+    if scheduler.end_frame():
+        set_quality(scheduler.quality)
+        if debug_2:
+            print(f"Drawing quality level {scheduler.level}: {scheduler.quality}")
 
+if recorder is not None:
+    recorder.close()
+if shared_store is not None:
+    shared_store.close()
+if remote is not None:
+    remote.close()
 pygame.quit()
\ No newline at end of file
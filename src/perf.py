@@ -0,0 +1,129 @@
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+
+class RollingStat:
+    """Per-frame totals of one timer or counter over the last `window` frames, plus lifetime totals."""
+    def __init__(self, window):
+        self.frames = deque(maxlen=window)
+        self.current = 0.0
+        self.calls = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.current += value
+        self.total += value
+        self.calls += 1
+
+    def end_frame(self):
+        self.frames.append(self.current)
+        self.current = 0.0
+
+    @property
+    def mean(self):
+        return sum(self.frames) / len(self.frames) if self.frames else 0.0
+
+    @property
+    def peak(self):
+        return max(self.frames) if self.frames else 0.0
+
+class PerfMonitor:
+    """
+    Always-on timers and counters for the hot paths.
+
+    Timers (`timer`, `add`) and counters (`count`) accumulate within a frame;
+    `end_frame` folds the frame into rolling windows so the report shows
+    recent per-frame costs and rates such as steps/s without restarting the
+    run. The cost per sample is two perf_counter calls and a dict lookup.
+    """
+    def __init__(self, window=120):
+        self.window = window
+        self.enabled = True
+        self.timers = {}
+        self.counters = {}
+        self._frame_times = deque(maxlen=window)
+        self._frame_start = time.perf_counter()
+        self.started = time.time()
+
+    def _stat(self, table, name):
+        stat = table.get(name)
+        if stat is None:
+            stat = table[name] = RollingStat(self.window)
+        return stat
+
+    @contextmanager
+    def timer(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._stat(self.timers, name).add(time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        if self.enabled:
+            self._stat(self.timers, name).add(seconds)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self._stat(self.counters, name).add(n)
+
+    def end_frame(self):
+        now = time.perf_counter()
+        self._frame_times.append(now - self._frame_start)
+        self._frame_start = now
+        for stat in self.timers.values():
+            stat.end_frame()
+        for stat in self.counters.values():
+            stat.end_frame()
+
+    def rate(self, name):
+        """Counter events per second of wall time over the rolling window."""
+        stat = self.counters.get(name)
+        elapsed = sum(self._frame_times)
+        if stat is None or elapsed == 0:
+            return 0.0
+        return sum(stat.frames) / elapsed
+
+    def reset(self):
+        self.timers = {}
+        self.counters = {}
+        self._frame_times.clear()
+        self._frame_start = time.perf_counter()
+        self.started = time.time()
+
+    def snapshot(self):
+        """Machine-readable summary: per-frame means in seconds, rates per second, lifetime totals."""
+        # Read from the console thread while the main loop adds new names, hence the list() copies
+        frames = len(self._frame_times)
+        return {
+            'time': time.time(),
+            'since': self.started,
+            'window_frames': frames,
+            'frame_time': sum(self._frame_times) / frames if frames else 0.0,
+            'timers': {name: {'mean': stat.mean, 'peak': stat.peak, 'calls': stat.calls, 'total': stat.total}
+                       for name, stat in sorted(list(self.timers.items()))},
+            'counters': {name: {'mean': stat.mean, 'rate': self.rate(name), 'total': stat.total}
+                         for name, stat in sorted(list(self.counters.items()))},
+        }
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def report(self):
+        snap = self.snapshot()
+        lines = [f"Last {snap['window_frames']} frames, {snap['frame_time'] * 1000:.2f} ms per frame"]
+        lines.append(f"{'Timer':<24}{'ms/frame':>10}{'peak ms':>10}{'calls':>10}")
+        for name, t in snap['timers'].items():
+            lines.append(f"{name:<24}{t['mean'] * 1000:>10.3f}{t['peak'] * 1000:>10.3f}{t['calls']:>10}")
+        lines.append(f"{'Counter':<24}{'per frame':>10}{'per s':>14}")
+        for name, c in snap['counters'].items():
+            lines.append(f"{name:<24}{c['mean']:>10.4g}{c['rate']:>14.4g}")
+        return "\n".join(lines)
+
+# Shared by the simulation, the display and the console
+perf = PerfMonitor()
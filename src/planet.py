@@ -1,6 +1,6 @@
 from constants import AU, KM_TO_M, SUN_AGE_SECONDS, SOLAR_MASS, G
 import numpy as np
-from body import body, Star, STAR_COLORS, Planet, Atmosphere
+from body import body, BodyList, Star, STAR_COLORS, Planet, Atmosphere
 
 Sun = Star(
     name="Sun",
@@ -276,7 +276,7 @@ Voyager2 = body(
 
 #bodies = [Sun, Earth]
 #bodies = [Sun, Earth, Mars]
-bodies = [Sun, Earth, Mercury, Venus, Mars, Jupiter, Saturn, Uranus, Neptune]
+bodies = BodyList([Sun, Earth, Mercury, Venus, Mars, Jupiter, Saturn, Uranus, Neptune])  # Counts its changes for the state
 #bodies.extend([Moon])
 #bodies.extend([io, europa, ganymede, callisto, dione, rhea, tethys, triton])
 bodies.extend([Voyager1, Voyager2])
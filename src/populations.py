@@ -0,0 +1,128 @@
+"""
+Procedural particle populations from orbital-element distributions.
+
+Every generator samples a, e, i, Ω, ω and M for n particles around a
+parent body, converts them to Cartesian positions and velocities in bulk
+and returns a population dict ('name', 'pos', 'vel', 'mass', 'radius',
+'color') that state.add_particles, beta/load_scenario.save_scenario and
+the 'populate' console command accept. The same seed gives the same scene.
+
+Example:
+    from planet import Sun
+    belt = asteroid_belt(100000, Sun, seed=1)
+    state.add_particles(belt['pos'], belt['vel'], belt['mass'], belt['radius'], belt['color'])
+"""
+import numpy as np
+from numba import njit, prange
+from constants import G, AU
+
+@njit(parallel=True, cache=True)
+def solve_kepler(M, e, tolerance=1e-12):
+    """Eccentric anomaly E with E - e sin E = M, by Newton's method per element."""
+    E = np.empty_like(M)
+    for k in prange(M.shape[0]):
+        x = M[k] if e[k] < 0.8 else np.pi
+        for _ in range(50):
+            dx = (x - e[k] * np.sin(x) - M[k]) / (1.0 - e[k] * np.cos(x))
+            x -= dx
+            if abs(dx) < tolerance:
+                break
+        E[k] = x
+    return E
+
+def elements_to_cartesian(a, e, i, Omega, omega, M, mu):
+    """Positions and velocities (N, 3) relative to the parent for elliptic orbits; angles in radians."""
+    M = np.mod(M, 2 * np.pi)
+    E = solve_kepler(M, e)
+    cos_E, sin_E = np.cos(E), np.sin(E)
+    b = np.sqrt(1 - e**2)
+    # In the orbital plane, periapsis along x
+    x = a * (cos_E - e)
+    y = a * b * sin_E
+    rate = np.sqrt(mu / a**3) / (1 - e * cos_E)  # dE/dt
+    vx = -a * sin_E * rate
+    vy = a * b * cos_E * rate
+    # Rotate by ω, i and Ω
+    cO, sO = np.cos(Omega), np.sin(Omega)
+    co, so = np.cos(omega), np.sin(omega)
+    ci, si = np.cos(i), np.sin(i)
+    P = np.stack([cO * co - sO * so * ci, sO * co + cO * so * ci, so * si], axis=1)
+    Q = np.stack([-cO * so - sO * co * ci, -sO * so + cO * co * ci, co * si], axis=1)
+    pos = x[:, None] * P + y[:, None] * Q
+    vel = vx[:, None] * P + vy[:, None] * Q
+    return pos, vel
+
+def rayleigh(rng, scale, n, limit):
+    # Rayleigh-distributed values redrawn above `limit`, the usual shape of e and i in a belt
+    values = rng.rayleigh(scale, n)
+    while True:
+        over = values >= limit
+        if not over.any():
+            return values
+        values[over] = rng.rayleigh(scale, over.sum())
+
+def make_population(name, parent, a, e, i, rng, mass=None, radius=None, color=(200, 200, 200)):
+    """Population dict around `parent` for the given a, e and i, with random Ω, ω and M."""
+    n = len(a)
+    pos, vel = elements_to_cartesian(a, e, i, rng.uniform(0, 2 * np.pi, n), rng.uniform(0, 2 * np.pi, n),
+                                     rng.uniform(0, 2 * np.pi, n), G * parent.mass)
+    pos += parent.pos
+    vel += parent.vel
+    return {
+        'name': name,
+        'pos': pos,
+        'vel': vel,
+        'mass': None if mass is None else np.broadcast_to(np.asarray(mass, dtype=float), n).copy(),
+        'radius': None if radius is None else np.broadcast_to(np.asarray(radius, dtype=float), n).copy(),
+        'color': color,
+    }
+
+# Kirkwood gaps (3:1, 5:2, 7:3 and 2:1 resonances with Jupiter) in AU, half width 0.02 AU
+KIRKWOOD_GAPS = [2.50, 2.82, 2.95, 3.27]
+
+def asteroid_belt(n, parent, seed=0, inner=2.1, outer=3.3, mass=None, radius=None, color=(150, 150, 150)):
+    """Main belt between `inner` and `outer` AU with the Kirkwood gaps cleared."""
+    rng = np.random.default_rng(seed)
+    a = rng.uniform(inner, outer, n)
+    for gap in KIRKWOOD_GAPS:
+        while True:
+            inside = np.abs(a - gap) < 0.02
+            if not inside.any():
+                break
+            a[inside] = rng.uniform(inner, outer, inside.sum())
+    e = rayleigh(rng, 0.1, n, 0.4)
+    i = rayleigh(rng, np.radians(8), n, np.radians(40))
+    return make_population('asteroid belt', parent, a * AU, e, i, rng, mass, radius, color)
+
+def kuiper_belt(n, parent, seed=0, plutinos=0.2, mass=None, radius=None, color=(120, 160, 200)):
+    """Classical Kuiper belt (42-48 AU, cold) plus a fraction of plutinos in the 3:2 resonance at 39.4 AU."""
+    rng = np.random.default_rng(seed)
+    resonant = rng.random(n) < plutinos
+    a = np.where(resonant, rng.normal(39.4, 0.2, n), rng.uniform(42, 48, n))
+    e = np.where(resonant, rayleigh(rng, 0.15, n, 0.35), rayleigh(rng, 0.05, n, 0.2))
+    i = np.where(resonant, rayleigh(rng, np.radians(10), n, np.radians(40)), rayleigh(rng, np.radians(2), n, np.radians(20)))
+    return make_population('kuiper belt', parent, a * AU, e, i, rng, mass, radius, color)
+
+def debris_disk(n, parent, inner=30 * AU, outer=150 * AU, seed=0, slope=-1.5, e_scale=0.02, i_scale=0.01, mass=None, radius=None, color=(200, 180, 140)):
+    """
+    Thin disk between `inner` and `outer` (meters) with surface density ∝ r**slope.
+
+    Semi-major axes come from inverting the cumulative distribution of the
+    power law, so the disk needs no rejection sampling.
+    """
+    rng = np.random.default_rng(seed)
+    u = rng.random(n)
+    p = slope + 2  # Cumulative count ∝ a**p
+    if p == 0:
+        a = inner * (outer / inner) ** u
+    else:
+        a = (inner**p + u * (outer**p - inner**p)) ** (1 / p)
+    e = rayleigh(rng, e_scale, n, 0.9)
+    i = rayleigh(rng, i_scale, n, np.pi / 2)
+    return make_population('debris disk', parent, a, e, i, rng, mass, radius, color)
+
+GENERATORS = {
+    'belt': asteroid_belt,
+    'kuiper': kuiper_belt,
+    'disk': debris_disk,
+}
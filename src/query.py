@@ -1,14 +1,37 @@
+"""
+Positions and velocities of real bodies from JPL Horizons, with a cache.
+
+`get_all_body_parameters` fetches every body whose cached state is too old
+concurrently, through a bounded pool of reused HTTP connections with a
+shared rate limit and retries, and writes the cache once at the end.
+Requests go through a transport: `HorizonsAPITransport` talks to the
+Horizons REST API (point `base_url` at a local server to test without the
+network) and `AstroqueryTransport` uses astroquery as before.
+"""
+import http.client
 import json
 import os
-from astroquery.jplhorizons import Horizons
+import queue
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from astropy.time import Time
 from constants import AU, DAY
 
 # Define the cache file path
 CACHE_FILE = 'planet_cache.json'
 CACHE_TIME_THRESHOLD = 1  # Maximum cache age in days
 
+HORIZONS_URL = 'https://ssd.jpl.nasa.gov/api/horizons.api'
+MAX_WORKERS = 32  # Concurrent requests
+MAX_CONNECTIONS = 32  # Open connections kept for reuse
+REQUEST_RATE = 20.0  # Requests per second, sustained
+REQUEST_BURST = 64  # Requests allowed at once before the rate applies, enough for a whole startup
+RETRIES = 4
+BACKOFF = 0.5  # Seconds before the first retry, doubled on each further one
+
 # Load the cache from a file if it exists
 if os.path.exists(CACHE_FILE):
     with open(CACHE_FILE, 'r') as f:
@@ -21,42 +44,193 @@ def save_cache():
     with open(CACHE_FILE, 'w') as f:
         json.dump(cache, f)
 
-def get_body_parameters(body):
+def julian_date_now():
+    return time.time() / DAY + 2440587.5
+
+class HorizonsError(Exception):
+    """A failed Horizons request; `retry` tells whether trying again may help."""
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+class RateLimiter:
+    """Token bucket shared by the request threads: `rate` requests per second with bursts of `burst`."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class HorizonsAPITransport:
+    """Vectors from the Horizons REST API over a pool of reused http.client connections."""
+    def __init__(self, base_url=HORIZONS_URL, max_connections=MAX_CONNECTIONS, timeout=30):
+        url = urllib.parse.urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.host = url.netloc
+        self.path = url.path
+        self.timeout = timeout
+        self.pool = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(max_connections)
+
+    def request(self, params):
+        target = f"{self.path}?{urllib.parse.urlencode(params)}"
+        with self.slots:
+            try:
+                conn = self.pool.get_nowait()
+            except queue.Empty:
+                conn = self.connection_class(self.host, timeout=self.timeout)
+            try:
+                conn.request('GET', target)
+                response = conn.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()  # Not reusable after a failure
+                raise HorizonsError(f"Request failed: {e}")
+            self.pool.put(conn)
+        if response.status == 429 or response.status >= 500:
+            raise HorizonsError(f"HTTP {response.status}")
+        if response.status != 200:
+            raise HorizonsError(f"HTTP {response.status}: {body[:200]!r}", retry=False)
+        return json.loads(body)
+
+    def vectors(self, body_id, jd):
+        """Position (AU) and velocity (AU/day) relative to the Sun, ecliptic frame."""
+        data = self.request({
+            'format': 'json',
+            'COMMAND': f"'{body_id}'",
+            'EPHEM_TYPE': 'VECTORS',
+            'CENTER': "'500@10'",
+            'TLIST': f"'{jd}'",
+            'REF_PLANE': 'ECLIPTIC',
+            'OUT_UNITS': 'AU-D',
+            'VEC_TABLE': '2',
+            'CSV_FORMAT': 'YES',
+            'OBJ_DATA': 'NO',
+        })
+        if 'error' in data:
+            raise HorizonsError(data['error'], retry=False)
+        result = data['result']
+        try:
+            row = result[result.index('$$SOE') + 5:result.index('$$EOE')].strip().splitlines()[0]
+        except ValueError:
+            raise HorizonsError(f"No vectors for {body_id}: {result[-200:]}", retry=False)
+        # JDTDB, Calendar Date, X, Y, Z, VX, VY, VZ
+        values = [float(v) for v in row.split(',')[2:8]]
+        return values[:3], values[3:]
+
+    def close(self):
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+class AstroqueryTransport:
+    """The same through astroquery, one connection per request."""
+    def vectors(self, body_id, jd):
+        from astroquery.jplhorizons import Horizons
+        obj = Horizons(id=body_id, location='500@10', epochs=jd, id_type=None)
+        eph = obj.vectors(refplane='ecliptic')
+        return ([eph['x'][0], eph['y'][0], eph['z'][0]], [eph['vx'][0], eph['vy'][0], eph['vz'][0]])
+
+    def close(self):
+        pass
+
+def fetch_vectors(transport, body_id, jd, limiter=None):
+    """Position (m) and velocity (m/s) of a body, retrying with exponential backoff and jitter."""
+    for attempt in range(RETRIES + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            pos, vel = transport.vectors(body_id, jd)
+            return np.array(pos) * AU, np.array(vel) * AU / DAY  # Convert from AU and AU/day to meters and m/s
+        except HorizonsError as e:
+            if not e.retry or attempt == RETRIES:
+                raise
+            time.sleep(BACKOFF * 2**attempt * random.uniform(0.5, 1.5))
+
+def cached_state(body, current_time, threshold=CACHE_TIME_THRESHOLD):
+    cache_key = str(body.id)
+    if cache_key in cache:
+        cached_time, cached_data = cache[cache_key]
+        if abs(current_time - cached_time) <= threshold:
+            print(f"Using cached data for {body.name} (Julian Date {cached_time})")
+            return np.array(cached_data[0]), np.array(cached_data[1])
+        print(f"Cached data for {body.name} is outdated (Julian Date {cached_time}), fetching new data...")
+    return None
+
+def get_body_parameters(body, transport=None):
     """
     Fetches the position and velocity of a specific body and updates the body object.
 
     Parameters:
     - body: A planet object with attributes `id`, `pos`, and `vel`.
     """
-    if body.id is None:
-        print(f"No Horizons ID available for {body.name}")
-        return
+    get_all_body_parameters([body], transport)
 
-    current_time = Time.now().jd
-    cache_key = str(body.id)
+def start_of_day(jd):
+    """Julian date of the last UTC midnight, the epoch shared by all launches of a day (initial_epoch = 'day')."""
+    return np.floor(jd - 0.5) + 0.5
 
-    if cache_key in cache:
-        cached_time, cached_data = cache[cache_key]
-        time_difference = current_time - cached_time
+def get_all_body_parameters(bodies, transport=None, workers=MAX_WORKERS, epoch=None, exact=False):
+    """
+    Fetches the position and velocity of every body concurrently and updates the body objects.
 
-        if time_difference <= CACHE_TIME_THRESHOLD:
-            print(f"Using cached data for {body.name} (Julian Date {cached_time})")
-            body.pos, body.vel = np.array(cached_data[0]), np.array(cached_data[1])
-            return
+    `epoch` is a Julian date, by default now. Bodies with a cache entry
+    within CACHE_TIME_THRESHOLD days of it are not requested; with `exact`
+    only an entry for the epoch itself counts, so the states really belong
+    to that epoch (as a state_cache snapshot stored under it must). The
+    cache file is written once when everything has arrived. A body whose
+    request keeps failing keeps its current state. Returns True if every
+    body was resolved.
+    """
+    current_time = epoch if epoch is not None else julian_date_now()
+    threshold = 0.0 if exact else CACHE_TIME_THRESHOLD
+    stale = []
+    for body in bodies:
+        if body.id is None:
+            print(f"No Horizons ID available for {body.name}")
+            continue
+        state = cached_state(body, current_time, threshold)
+        if state is not None:
+            body.pos, body.vel = state
         else:
-            print(f"Cached data for {body.name} is outdated (Julian Date {cached_time}), fetching new data...")
-
-    obj = Horizons(id=body.id, location='500@10', epochs=current_time, id_type=None)
-    eph = obj.vectors(refplane='ecliptic')
-    
-    # Update the body's position and velocity in the simulation
-    pos = np.array([eph['x'][0], eph['y'][0], eph['z'][0]]) * AU  # Convert from AU to meters
-    vel = np.array([eph['vx'][0], eph['vy'][0], eph['vz'][0]]) * AU / DAY  # Convert from AU/day to m/s
-
-    # Update the body and store in the cache
-    body.pos = pos
-    body.vel = vel
-    cache[cache_key] = (current_time, (pos.tolist(), vel.tolist()))
-
-    # Save the updated cache to a file
-    save_cache()
\ No newline at end of file
+            stale.append(body)
+    if not stale:
+        return True
+
+    own_transport = transport is None
+    if own_transport:
+        transport = HorizonsAPITransport()
+    limiter = RateLimiter(REQUEST_RATE, REQUEST_BURST)
+    fetched = 0
+    try:
+        with ThreadPoolExecutor(max_workers=min(workers, len(stale))) as executor:
+            futures = [(body, executor.submit(fetch_vectors, transport, body.id, current_time, limiter)) for body in stale]
+            for body, future in futures:
+                try:
+                    pos, vel = future.result()
+                except Exception as e:
+                    print(f"Could not fetch {body.name} from Horizons: {e}")
+                    continue
+                # Update the body and store in the cache
+                body.pos = pos
+                body.vel = vel
+                cache[str(body.id)] = (current_time, (pos.tolist(), vel.tolist()))
+                fetched += 1
+    finally:
+        if own_transport:
+            transport.close()
+    print(f"Fetched {fetched} of {len(stale)} bodies from Horizons")
+    save_cache()
+    return fetched == len(stale)
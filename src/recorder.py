@@ -0,0 +1,98 @@
+import json
+import os
+import numpy as np
+
+HEADER_FILE = 'recording.json'
+POSITIONS_FILE = 'positions.bin'
+TIMES_FILE = 'times.bin'
+STATIC_FILE = 'static.npz'
+
+class Recorder:
+    """
+    Appends the position array of every recorded frame to a raw binary file.
+
+    The layout is described by a small JSON header so a recording can be
+    memory-mapped frame by frame with `load_recording` without reading it all.
+    """
+    def __init__(self, path, state, dtype=np.float64):
+        self.path = path
+        self.state = state
+        self.dtype = np.dtype(dtype)
+        self.frames = 0
+        os.makedirs(path, exist_ok=True)
+        self.n = state.n
+        self._positions = open(os.path.join(path, POSITIONS_FILE), 'wb')
+        self._times = open(os.path.join(path, TIMES_FILE), 'wb')
+        np.savez(os.path.join(path, STATIC_FILE), radius=state.radius, color=state.color)
+        self._write_header()
+
+    def _write_header(self):
+        header = {
+            'n': self.n,
+            'frames': self.frames,
+            'dtype': self.dtype.str,
+            'bodies': [body.name for body in self.state.bodies],
+        }
+        with open(os.path.join(self.path, HEADER_FILE), 'w') as f:
+            json.dump(header, f)
+
+    def record(self, sim_time):
+        if self.state.n != self.n:
+            print(f"Recorder: body count changed from {self.n} to {self.state.n}, stopping recording")
+            self.close()
+            return
+        self._positions.write(self.state.pos.astype(self.dtype, copy=False).tobytes())
+        self._times.write(np.float64(sim_time).tobytes())
+        self.frames += 1
+
+    def close(self):
+        if self._positions.closed:
+            return
+        self._positions.close()
+        self._times.close()
+        self._write_header()
+
+def load_recording(path):
+    """
+    Return (header, positions, times) with positions memory-mapped as (frames, n, 3).
+
+    The per-row radius and color arrays are added to the header.
+    """
+    with open(os.path.join(path, HEADER_FILE), 'r') as f:
+        header = json.load(f)
+    with np.load(os.path.join(path, STATIC_FILE)) as static:
+        header['radius'] = static['radius']
+        header['color'] = static['color']
+    # Count frames from the file size so an interrupted recording still replays
+    n = header['n']
+    frame_bytes = n * 3 * np.dtype(header['dtype']).itemsize
+    frames = os.path.getsize(os.path.join(path, POSITIONS_FILE)) // frame_bytes if frame_bytes else 0
+    frames = min(frames, os.path.getsize(os.path.join(path, TIMES_FILE)) // 8)
+    if frames == 0:
+        return header, np.zeros((0, n, 3)), np.zeros(0)
+    positions = np.memmap(os.path.join(path, POSITIONS_FILE), dtype=header['dtype'], mode='r', shape=(frames, n, 3))
+    times = np.fromfile(os.path.join(path, TIMES_FILE), dtype=np.float64, count=frames)
+    return header, positions, times
+
+_screenshot_index = {}
+
+def next_screenshot_name(folder="screenshots"):
+    """
+    Next free screenshot filename in `folder`.
+
+    The folder is listed once; after that the index is just incremented
+    instead of probing every existing name with os.path.exists.
+    """
+    if not os.path.exists(folder):
+        os.mkdir(folder)
+    if folder not in _screenshot_index:
+        used = -1
+        for name in os.listdir(folder):
+            if name == "screenshot.png":
+                used = max(used, 0)
+            elif name.startswith("screenshot_") and name.endswith(".png") and name[11:-4].isdigit():
+                used = max(used, int(name[11:-4]))
+        _screenshot_index[folder] = used
+    _screenshot_index[folder] += 1
+    index = _screenshot_index[folder]
+    return os.path.join(folder, "screenshot.png" if index == 0 else f"screenshot_{index}.png")
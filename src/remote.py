@@ -0,0 +1,343 @@
+"""
+Remote control and telemetry for a running simulation over local HTTP.
+
+RemoteServer serves the StarConsole command set and a binary stream of
+state frames, so dashboards and scripts can steer and watch a run without
+a terminal or scraping stdout. A command runs exactly as if typed in the
+console (anything touching the simulation goes through the command queue
+to the main loop) and what it prints is sent back. Anyone who can call
+it can run Python in the simulation, so the server listens on the
+loopback interface only unless given another host, and every request
+must carry the token printed at startup in the X-Astrosim-Token header.
+Requests from a web page (an Origin header) or for a Host name other
+than the loopback or the server's own address are refused, so neither a
+page posting to 127.0.0.1 nor DNS rebinding gets through.
+
+    POST /command   body: one console line      -> {"output": "...", "open": true}
+    GET  /settings                              -> the main loop settings as JSON
+    GET  /bodies                                -> {"names": [...], "n": ..., "n_bodies": ..., "version": ...}
+    GET  /stream?every=10&fields=pos,vel&dtype=float32&frames=100
+         -> a frame (see FRAME) every 10 main loop frames, until 100 were sent or the client disconnects
+
+Main loop:
+    remote = RemoteServer(sim_context, 8765).start()
+    remote.publish(sim_time)  # Once per frame, between steps
+
+Client, or LocalClient(remote) for the same calls in-process without sockets:
+    client = RemoteClient('http://127.0.0.1:8765', token)
+    print(client.command('status'))
+    for frame in client.stream(every=10, fields=('pos',), frames=100):
+        print(frame['sim_time'], frame['pos'][3])
+"""
+import hmac
+import io
+import json
+import queue
+import secrets
+import struct
+import threading
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from commands import Call, GetSettings, thread_output
+from starconsole import run_command
+
+HOST = '127.0.0.1'
+PORT = 8765
+QUEUE_FRAMES = 8  # Frames kept for a slow subscriber; older ones are dropped, the simulation never waits
+TOKEN_HEADER = 'X-Astrosim-Token'
+LOCAL_HOSTS = {'127.0.0.1', 'localhost', '::1'}
+
+# Frame header: magic, format version, field bits, bytes per value, n, n_bodies, frame number, sim_time,
+# state.version (changes when rows are added or removed, fetch /bodies again). Little endian, followed by
+# the arrays of the fields in FIELDS order as n rows of float32 or float64.
+FRAME = struct.Struct('<4sBBBxIIqdI')
+MAGIC = b'ASTF'
+FORMAT_VERSION = 1
+FIELDS = {'pos': (1, 3), 'vel': (2, 3), 'mass': (4, 1)}  # Bit and columns
+DTYPES = {'float32': np.dtype('<f4'), 'float64': np.dtype('<f8')}
+
+def encode_frame(state, sim_time, frame, fields, dtype):
+    """Header and arrays of one frame as bytes."""
+    bits = sum(FIELDS[field][0] for field in fields)
+    parts = [FRAME.pack(MAGIC, FORMAT_VERSION, bits, dtype.itemsize, state.n, state.n_bodies, frame, sim_time, state.version)]
+    for field in FIELDS:
+        if field in fields:
+            parts.append(getattr(state, field).astype(dtype, copy=False).tobytes())
+    return b''.join(parts)
+
+def read_exact(read, size):
+    data = b''
+    while len(data) < size:
+        chunk = read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def read_frame(read):
+    """Decode the next frame from a `read(size)` function; returns None at the end of the stream."""
+    header = read_exact(read, FRAME.size)
+    if header is None:
+        return None
+    magic, version, bits, itemsize, n, n_bodies, frame, sim_time, state_version = FRAME.unpack(header)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"Not a version {FORMAT_VERSION} state frame")
+    dtype = DTYPES['float32' if itemsize == 4 else 'float64']
+    decoded = {'frame': frame, 'sim_time': sim_time, 'n': n, 'n_bodies': n_bodies, 'version': state_version}
+    for field, (bit, columns) in FIELDS.items():
+        if bits & bit:
+            data = read_exact(read, n * columns * itemsize)
+            if data is None:
+                return None
+            values = np.frombuffer(data, dtype=dtype)
+            decoded[field] = values.reshape(n, 3) if columns == 3 else values
+    return decoded
+
+def body_table(state):
+    return {'names': [b.name for b in state.bodies], 'n': state.n, 'n_bodies': state.n_bodies, 'version': state.version}
+
+def host_name(value):
+    # 'localhost:8765', '[::1]:8765' or 'http://127.0.0.1:8765' -> the host name alone
+    return urllib.parse.urlsplit(value if '//' in value else f'//{value}').hostname or ''
+
+def jsonable(value):
+    if hasattr(value, 'name'):
+        return value.name  # focus_object
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    return str(value)
+
+class Subscription:
+    def __init__(self, every, fields, dtype, frames):
+        self.every = max(1, int(every))
+        self.fields = tuple(field for field in FIELDS if field in fields)
+        self.dtype = dtype
+        self.remaining = frames
+        self.frames = queue.Queue(QUEUE_FRAMES)
+
+    def push(self, data):
+        while True:
+            try:
+                self.frames.put_nowait(data)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def __iter__(self):
+        """Encoded frames as they are published; ends after `frames` of them or when the server closes."""
+        while self.remaining is None or self.remaining > 0:
+            data = self.frames.get()
+            if data is None:
+                return
+            if self.remaining is not None:
+                self.remaining -= 1
+            yield data
+
+class RemoteServer:
+    def __init__(self, context, port=PORT, host=HOST, token=None):
+        self.context = context
+        self.state = context['state']
+        self.address = (host, port)
+        self.token = token or secrets.token_urlsafe(24)  # New for every run unless given
+        self.frame = 0
+        self.subscriptions = []
+        self.lock = threading.Lock()
+        self.httpd = None
+
+    def start(self):
+        """Serve on a background thread and return self."""
+        thread_output()
+        self.httpd = ThreadingHTTPServer(self.address, RemoteHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.remote = self
+        self.address = self.httpd.server_address
+        threading.Thread(target=self.httpd.serve_forever, daemon=True, name='remote').start()
+        print(f"Remote control on http://{self.address[0]}:{self.address[1]}, token {self.token}")
+        return self
+
+    def allowed(self, headers):
+        """Whether a request carries the token, comes from no web page and names a local Host."""
+        if not hmac.compare_digest(headers.get(TOKEN_HEADER, '').encode(), self.token.encode()):
+            return False
+        hosts = LOCAL_HOSTS | {self.address[0]}
+        if headers.get('Origin') is not None and host_name(headers['Origin']) not in hosts:
+            return False
+        return host_name(headers.get('Host', '')) in hosts
+
+    def execute(self, line):
+        """Run a console line and return (what it printed, whether the console would stay open)."""
+        output = thread_output()
+        output.local.buffer = io.StringIO()
+        try:
+            keep_open = run_command(self.context, line)
+            return output.local.buffer.getvalue(), keep_open
+        finally:
+            output.local.buffer = None
+
+    def settings(self):
+        values = self.context['commands'].request(GetSettings())
+        return {name: jsonable(value) for name, value in values.items()}
+
+    def bodies(self):
+        # On the main loop, like everything else that reads the body list
+        return self.context['commands'].request(Call(body_table, self.state))
+
+    def subscribe(self, every=1, fields=('pos',), dtype='float64', frames=None):
+        unknown = set(fields) - set(FIELDS)
+        if unknown or dtype not in DTYPES:
+            raise ValueError(f"Unknown fields {sorted(unknown)} or dtype '{dtype}'")
+        subscription = Subscription(every, fields, DTYPES[dtype], frames)
+        with self.lock:
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+    def publish(self, sim_time):
+        """Send a frame to every subscriber due this frame; called by the main loop between steps."""
+        self.frame += 1
+        with self.lock:
+            due = [s for s in self.subscriptions if self.frame % s.every == 0]
+        encoded = {}
+        for subscription in due:
+            key = (subscription.fields, subscription.dtype)
+            if key not in encoded:
+                encoded[key] = encode_frame(self.state, sim_time, self.frame, subscription.fields, subscription.dtype)
+            subscription.push(encoded[key])
+
+    def close(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        with self.lock:
+            for subscription in self.subscriptions:
+                subscription.push(None)
+            self.subscriptions = []
+
+class RemoteHandler(BaseHTTPRequestHandler):
+    def send_json(self, value, status=200):
+        body = json.dumps(value).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def refused(self):
+        if self.server.remote.allowed(self.headers):
+            return False
+        self.send_json({'error': f"Forbidden, send the token printed at startup in {TOKEN_HEADER}"}, 403)
+        return True
+
+    def do_POST(self):
+        if self.refused():
+            return
+        if self.path != '/command':
+            return self.send_json({'error': f"Unknown path {self.path}"}, 404)
+        line = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        output, keep_open = self.server.remote.execute(line)
+        self.send_json({'output': output, 'open': keep_open})
+
+    def do_GET(self):
+        if self.refused():
+            return
+        url = urllib.parse.urlsplit(self.path)
+        remote = self.server.remote
+        if url.path == '/settings':
+            return self.send_json(remote.settings())
+        if url.path == '/bodies':
+            return self.send_json(remote.bodies())
+        if url.path != '/stream':
+            return self.send_json({'error': f"Unknown path {url.path}"}, 404)
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            subscription = remote.subscribe(
+                int(query.get('every', ['1'])[0]),
+                query.get('fields', ['pos'])[0].split(','),
+                query.get('dtype', ['float64'])[0],
+                int(query['frames'][0]) if 'frames' in query else None,
+            )
+        except ValueError as e:
+            return self.send_json({'error': str(e)}, 400)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.end_headers()
+        try:
+            for data in subscription:
+                self.wfile.write(data)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            remote.unsubscribe(subscription)
+
+    def log_message(self, format, *args):
+        pass  # Requests are not worth a line on the console
+
+class RemoteClient:
+    """Calls a RemoteServer over HTTP with the token it printed at startup."""
+    def __init__(self, base_url=f"http://{HOST}:{PORT}", token='', timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def request(self, path, data=None):
+        method = 'GET' if data is None else 'POST'
+        return urllib.request.Request(f"{self.base_url}{path}", data=data, headers={TOKEN_HEADER: self.token}, method=method)
+
+    def get(self, path):
+        with urllib.request.urlopen(self.request(path), timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def command(self, line):
+        """Run a console line and return what it printed."""
+        with urllib.request.urlopen(self.request('/command', line.encode()), timeout=self.timeout) as response:
+            return json.loads(response.read())['output']
+
+    def settings(self):
+        return self.get('/settings')
+
+    def bodies(self):
+        return self.get('/bodies')
+
+    def stream(self, every=1, fields=('pos',), dtype='float64', frames=None):
+        """Decoded frames (dicts of arrays) as the server publishes them."""
+        query = {'every': every, 'fields': ','.join(fields), 'dtype': dtype}
+        if frames is not None:
+            query['frames'] = frames
+        with urllib.request.urlopen(self.request(f"/stream?{urllib.parse.urlencode(query)}"), timeout=self.timeout) as response:
+            while True:
+                frame = read_frame(response.read)
+                if frame is None:
+                    return
+                yield frame
+
+class LocalClient:
+    """The RemoteClient calls against a RemoteServer in the same process, for tests without sockets."""
+    def __init__(self, remote):
+        self.remote = remote
+
+    def command(self, line):
+        return self.remote.execute(line)[0]
+
+    def settings(self):
+        return json.loads(json.dumps(self.remote.settings()))
+
+    def bodies(self):
+        return self.remote.bodies()
+
+    def stream(self, every=1, fields=('pos',), dtype='float64', frames=None):
+        subscription = self.remote.subscribe(every, fields, dtype, frames)
+        try:
+            for data in subscription:
+                yield read_frame(io.BytesIO(data).read)
+        finally:
+            self.remote.unsubscribe(subscription)
@@ -0,0 +1,222 @@
+"""
+Headless renderer for outreach animations.
+
+Replays a recording made with the Recorder, follows a running simulation
+through shared memory, or runs the simulation live, and writes every frame
+to a PNG sequence or pipes it into ffmpeg. pygame runs on the dummy video
+driver, so no display is needed. PNG encoding is spread over a process pool
+while the main process keeps drawing.
+
+Examples:
+    python render.py --recording recordings/latest --frames frames/
+    python render.py --attach astrosim --count 300 --frames frames/
+    python render.py --live 600 --steps-per-frame 24 --focus Earth --video earth.mp4
+"""
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import argparse
+import multiprocessing
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pygame
+
+def encode_png(raw, size, filename):
+    # Runs in a worker process
+    surface = pygame.image.frombuffer(raw, size, 'RGB')
+    pygame.image.save(surface, filename)
+    return filename
+
+class FrameSequenceWriter:
+    """Writes numbered PNG files, encoding them in a pool of worker processes."""
+    def __init__(self, folder, size, workers=None):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.size = size
+        workers = workers or os.cpu_count() or 1
+        # Spawned rather than forked: the parent already runs numba's worker threads
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.max_pending = 2 * workers
+        self.pending = []
+        self.index = 0
+
+    def write(self, raw):
+        filename = os.path.join(self.folder, f"frame_{self.index:06d}.png")
+        self.pending.append(self.pool.submit(encode_png, raw, self.size, filename))
+        self.index += 1
+        # Keep a bounded number of frames in flight so memory stays flat
+        while len(self.pending) > self.max_pending:
+            self.pending.pop(0).result()
+
+    def close(self):
+        for future in self.pending:
+            future.result()
+        self.pool.shutdown()
+
+class VideoPipeWriter:
+    """Pipes raw RGB frames into ffmpeg from a background thread."""
+    def __init__(self, filename, size, fps=30):
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            raise RuntimeError("ffmpeg not found on PATH; use --frames to write a PNG sequence instead")
+        width, height = size
+        self.process = subprocess.Popen(
+            [ffmpeg, '-loglevel', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}',
+             '-r', str(fps), '-i', '-', '-c:v', 'libx264', '-pix_fmt', 'yuv420p', filename],
+            stdin=subprocess.PIPE,
+        )
+        self.frames = queue.Queue(maxsize=8)
+        self.thread = threading.Thread(target=self._pump, daemon=True)
+        self.thread.start()
+
+    def _pump(self):
+        while True:
+            raw = self.frames.get()
+            if raw is None:
+                break
+            self.process.stdin.write(raw)
+
+    def write(self, raw):
+        self.frames.put(raw)
+
+    def close(self):
+        self.frames.put(None)
+        self.thread.join()
+        self.process.stdin.close()
+        self.process.wait()
+
+def match_rows(names, n, radius, color):
+    """Give the local simulation state the same bodies and row count as a recorded or remote one."""
+    from simulation import state
+    from body import body
+
+    if [b.name for b in state.bodies] != names:
+        # The source has a different body set: stand-ins are enough to draw it
+        from display import clear_body_trails
+        state.bodies[:] = [body(name=name, mass=0, radius=radius[i], color=color[i].tolist()) for i, name in enumerate(names)]
+        state.load_bodies()
+        clear_body_trails()
+    if state.n != n:
+        state.clear_particles()
+        state.add_particles(np.zeros((n - state.n, 3)), np.zeros((n - state.n, 3)))
+    state.radius[len(names):] = radius[len(names):]
+    state.color[:] = color
+
+def replay_frames(path, every=1):
+    """Load a recording into the simulation state frame by frame; yields the simulation time."""
+    from recorder import load_recording
+    from simulation import state
+
+    header, positions, times = load_recording(path)
+    match_rows(header['bodies'], header['n'], header['radius'], header['color'])
+
+    for k in range(0, len(positions), every):
+        state.pos[:] = positions[k]
+        yield times[k]
+
+def attach_frames(name, count, interval=1 / 30):
+    """Follow a running simulation published with share_state; yields the simulation time."""
+    from shared_state import SharedStateView
+    from simulation import state
+
+    view = SharedStateView(name)
+    generation = None
+    try:
+        for _ in range(count):
+            snapshot = view.snapshot()
+            if view.generation != generation or len(snapshot['pos']) != state.n:
+                match_rows(view.names, len(snapshot['pos']), view.radius, view.color)
+                generation = view.generation
+            state.pos[:] = snapshot['pos']
+            yield snapshot['sim_time']
+            time.sleep(interval)
+    finally:
+        view.close()
+
+def live_frames(count, steps_per_frame, timestep_seconds, integration_method, FULL_ORBITS, gravity_enabled=True):
+    """Run the simulation and yield the simulation time after every rendered frame."""
+    from simulation import run_simulation
+
+    sim_time = 0.0
+    for _ in range(count):
+        for _ in range(steps_per_frame):
+            run_simulation(timestep_seconds, integration_method, FULL_ORBITS, gravity_enabled)
+            sim_time += timestep_seconds
+        yield sim_time
+
+def render(frames, writer, screen, focus_name, SCALE_DIST, FULL_ORBITS=False, draw_trails=True, display_names=True, particle_render=True):
+    from display import draw_objects, display_time, clear_body_trails
+    from simulation import state, index as name_index
+    from perf import perf
+
+    clear_body_trails()
+    previous_time = None
+    for index, sim_time in enumerate(frames):
+        # Resolved every frame, the body list may have been replaced by the replay
+        focus_object = name_index.find(focus_name) if focus_name else state.bodies[0]
+        if focus_object is None:
+            raise ValueError(f"Focus body '{focus_name}' not found")
+        draw_objects(focus_object, SCALE_DIST, FULL_ORBITS, draw_trails, screen, False, display_names, False, particle_render)
+        if previous_time is not None:
+            display_time(sim_time - previous_time, screen, False)
+        previous_time = sim_time
+        writer.write(pygame.image.tobytes(screen, 'RGB'))
+        perf.end_frame()
+        if index % 100 == 0:
+            print(f"Rendered frame {index}")
+    writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a recorded or live simulation without a display.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--recording', help="Recording folder written by the Recorder")
+    source.add_argument('--live', type=int, metavar='FRAMES', help="Run the simulation live for this many frames")
+    source.add_argument('--attach', metavar='NAME', help="Follow a running simulation started with share_state = NAME")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('--frames', help="Folder for a numbered PNG sequence")
+    output.add_argument('--video', help="Video file to encode with ffmpeg")
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--scale', type=float, default=5e-10, help="SCALE_DIST, pixels per meter")
+    parser.add_argument('--focus', default=None, help="Body to keep centered (default: the first body)")
+    parser.add_argument('--every', type=int, default=1, help="Render every Nth recorded frame")
+    parser.add_argument('--count', type=int, default=300, help="Frames to capture with --attach")
+    parser.add_argument('--interval', type=float, default=1 / 30, help="Seconds between frames with --attach")
+    parser.add_argument('--steps-per-frame', type=int, default=8)
+    parser.add_argument('--timestep', type=float, default=3600 / 8, help="Live timestep in seconds")
+    parser.add_argument('--method', default='rk4')
+    parser.add_argument('--horizons', action='store_true', help="Fetch real positions from Horizons before a live run")
+    parser.add_argument('--full-orbits', action='store_true')
+    parser.add_argument('--no-trails', action='store_true')
+    parser.add_argument('--no-names', action='store_true')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--workers', type=int, default=None, help="PNG encoder processes")
+    args = parser.parse_args()
+
+    pygame.init()
+    size = (args.width, args.height)
+    screen = pygame.Surface(size)
+
+    if args.recording:
+        frames = replay_frames(args.recording, args.every)
+    elif args.attach:
+        frames = attach_frames(args.attach, args.count, args.interval)
+    else:
+        if args.horizons:
+            from query import get_all_body_parameters
+            from planet import bodies
+            get_all_body_parameters(bodies)  # Concurrent and rate limited, one cache write
+        frames = live_frames(args.live, args.steps_per_frame, args.timestep, args.method, args.full_orbits)
+
+    writer = FrameSequenceWriter(args.frames, size, args.workers) if args.frames else VideoPipeWriter(args.video, size, args.fps)
+    render(frames, writer, screen, args.focus, args.scale, args.full_orbits, not args.no_trails, not args.no_names)
+    pygame.quit()
+
+if __name__ == '__main__':
+    main()
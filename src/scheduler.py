@@ -0,0 +1,108 @@
+import time
+from contextlib import contextmanager
+from perf import perf
+
+# Drawing quality from full detail down to the cheapest setting the scheduler may fall back to.
+# trail_length None keeps every trail point.
+QUALITY_LEVELS = [
+    {'trail_length': None, 'orbit_resolution': 1000, 'gravity_grid_size': 50},
+    {'trail_length': 2000, 'orbit_resolution': 500, 'gravity_grid_size': 35},
+    {'trail_length': 1000, 'orbit_resolution': 250, 'gravity_grid_size': 25},
+    {'trail_length': 500, 'orbit_resolution': 120, 'gravity_grid_size': 15},
+    {'trail_length': 200, 'orbit_resolution': 60, 'gravity_grid_size': 10},
+]
+
+class FrameScheduler:
+    """
+    Keeps the main loop at a target frame rate.
+
+    Each frame is split into named phases (physics, draw, console) whose
+    durations are smoothed over recent frames. When the frame keeps running
+    over budget the drawing quality is lowered one level at a time, and raised
+    again once there is headroom. Whatever time is left in the budget is slept.
+    """
+    def __init__(self, target_fps=60, adaptive=True, levels=QUALITY_LEVELS, smoothing=0.1, patience=15):
+        self.target_fps = target_fps
+        self.adaptive = adaptive
+        self.levels = levels
+        self.level = 0
+        self.smoothing = smoothing
+        self.patience = patience  # Frames over/under budget before the quality changes
+        self.phase_times = {}
+        self._current = {}
+        self.frame_time = 0.0
+        self.work_time = 0.0
+        self._over = 0
+        self._under = 0
+        self._restore_after = 4 * patience
+        self._last_change = None
+        self._frame_start = time.perf_counter()
+
+    @property
+    def budget(self):
+        return 1.0 / self.target_fps
+
+    @property
+    def quality(self):
+        return self.levels[self.level]
+
+    @property
+    def fps(self):
+        return 1.0 / self.frame_time if self.frame_time > 0 else 0.0
+
+    def _smooth(self, old, new):
+        return new if old == 0.0 else old + self.smoothing * (new - old)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # A phase may be entered several times per frame; it is smoothed once in end_frame
+            elapsed = time.perf_counter() - start
+            self._current[name] = self._current.get(name, 0.0) + elapsed
+            perf.add(name, elapsed)
+
+    def end_frame(self):
+        """Adapt the quality level and sleep out the rest of the budget. Returns True if the level changed."""
+        self.work_time = self._smooth(self.work_time, time.perf_counter() - self._frame_start)
+        for name, elapsed in self._current.items():
+            self.phase_times[name] = self._smooth(self.phase_times.get(name, 0.0), elapsed)
+        self._current = {}
+        perf.end_frame()
+        changed = self.adaptive and self._adapt()
+
+        remaining = self.budget - (time.perf_counter() - self._frame_start)
+        if remaining > 0:
+            time.sleep(remaining)
+        now = time.perf_counter()
+        self.frame_time = self._smooth(self.frame_time, now - self._frame_start)
+        self._frame_start = now
+        return changed
+
+    def _adapt(self):
+        # Lower quality only helps when drawing is a real share of the frame
+        drawing = self.phase_times.get('draw', 0.0) > 0.25 * self.work_time
+        if self.work_time > self.budget and drawing:
+            self._over += 1
+            self._under = 0
+        elif self.work_time < 0.6 * self.budget:
+            self._under += 1
+            self._over = 0
+        else:
+            self._over = self._under = 0
+
+        if self._over >= self.patience and self.level < len(self.levels) - 1:
+            if self._last_change == 'restore':
+                # The restored level did not fit: wait twice as long before trying it again
+                self._restore_after = min(2 * self._restore_after, 64 * self.patience)
+            self.level += 1
+            self._last_change = 'lower'
+        elif self._under >= self._restore_after and self.level > 0:
+            self.level -= 1
+            self._last_change = 'restore'
+        else:
+            return False
+        self._over = self._under = 0
+        return True
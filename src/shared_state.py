@@ -0,0 +1,215 @@
+"""
+Simulation state arrays in shared memory or memory-mapped files.
+
+A SharedStateStore moves the SimulationState arrays into a shared block, so
+the integrators write straight into memory that other processes can map.
+A SharedStateView attaches to it from another process (a renderer, an
+analysis script, a recorder) by name, without pickling anything.
+
+Two blocks are used: a small fixed control block under the given name and a
+data block per layout generation. Adding or removing rows allocates a new
+data block and bumps the generation in the control block, so views remap
+on their next refresh. A sequence counter in the control block (odd while
+the simulation is stepping) lets views take consistent snapshots.
+
+Example, in another process while main.py runs with share_state = 'astrosim':
+    view = SharedStateView('astrosim')
+    print(view.names[3], view.pos[3])
+"""
+import json
+import os
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+CONTROL_SIZE = 256
+NAME_OFFSET = 64  # Data block name, after the int64 fields
+NAME_SIZE = 128
+# int64 fields of the control block
+SEQ, GENERATION, N, N_BODIES, VERSION, SIM_TIME, NAMES_SIZE = range(7)
+
+def create_block(name, size, kind='shm'):
+    """Create a named shared block and return (handle, buffer)."""
+    if kind == 'shm':
+        block = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+        return block, block.buf
+    block = np.memmap(name, dtype=np.uint8, mode='w+', shape=(max(size, 1),))
+    return block, block
+
+def attach_block(name, kind='shm'):
+    """Attach to an existing block and return (handle, buffer)."""
+    if kind == 'shm':
+        try:
+            block = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13 the resource tracker would unlink the block when this process exits
+            from multiprocessing import resource_tracker
+            block = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(block._name, 'shared_memory')
+        return block, block.buf
+    block = np.memmap(name, dtype=np.uint8, mode='r+')
+    return block, block
+
+def release_block(block, unlink=False):
+    if isinstance(block, np.memmap):
+        return True
+    try:
+        block.close()
+    except BufferError:
+        return False  # Arrays still point into it; the mapping goes away with them
+    finally:
+        if unlink:
+            block.unlink()
+    return True
+
+def layout(n, names_size):
+    """Byte offsets of pos, vel, mass, radius, color and the body names in a data block of n rows."""
+    offsets = {}
+    offset = 0
+    for field, nbytes in [('pos', n * 24), ('vel', n * 24), ('mass', n * 8), ('radius', n * 8), ('color', n * 3), ('names', names_size)]:
+        offsets[field] = offset
+        offset += nbytes
+    return offsets, offset
+
+def as_bytes(buffer):
+    return np.ndarray(len(buffer), dtype=np.uint8, buffer=buffer)
+
+def map_arrays(buffer, n):
+    # Directly on the block's buffer (not through another array), so row views of pos and vel
+    # have pos and vel as their base like the state's own arrays
+    offsets, _ = layout(n, 0)
+    return {
+        'pos': np.ndarray((n, 3), dtype=np.float64, buffer=buffer, offset=offsets['pos']),
+        'vel': np.ndarray((n, 3), dtype=np.float64, buffer=buffer, offset=offsets['vel']),
+        'mass': np.ndarray(n, dtype=np.float64, buffer=buffer, offset=offsets['mass']),
+        'radius': np.ndarray(n, dtype=np.float64, buffer=buffer, offset=offsets['radius']),
+        'color': np.ndarray((n, 3), dtype=np.uint8, buffer=buffer, offset=offsets['color']),
+    }
+
+class SharedStateStore:
+    """Publishes a SimulationState under `name`; `kind` is 'shm' or 'file' (then `name` is a path)."""
+    def __init__(self, state, name, kind='shm'):
+        self.state = state
+        self.name = name
+        self.kind = kind
+        self.generation = 0
+        self._control, buffer = create_block(name, CONTROL_SIZE, kind)
+        self.control = np.ndarray(NAME_OFFSET // 8, dtype=np.int64, buffer=buffer)
+        self.control[:] = 0
+        self._control_bytes = as_bytes(buffer)
+        self._data = None
+        self._data_name = None
+        self._version = None
+        self._retired = []
+        self.publish()
+
+    def publish(self):
+        """Move the state into a new data block if its rows changed since the last publish."""
+        if self.state.version == self._version:
+            return
+        state = self.state
+        names = json.dumps([b.name for b in state.bodies]).encode()
+        self.generation += 1
+        data_name = f"{self.name}_{self.generation}" if self.kind == 'shm' else f"{self.name}.{self.generation}"
+        offsets, size = layout(state.n, len(names))
+        data, buffer = create_block(data_name, size, self.kind)
+        arrays = map_arrays(buffer, state.n)
+        as_bytes(buffer)[offsets['names']:offsets['names'] + len(names)] = np.frombuffer(names, dtype=np.uint8)
+        # From here on the integrators write into the shared block
+        state.use_buffers(arrays['pos'], arrays['vel'], arrays['mass'], arrays['radius'], arrays['color'])
+
+        self.control[N] = state.n
+        self.control[N_BODIES] = state.n_bodies
+        self.control[VERSION] = state.version
+        self.control[NAMES_SIZE] = len(names)
+        self._control_bytes[NAME_OFFSET:NAME_OFFSET + NAME_SIZE] = np.frombuffer(data_name.encode().ljust(NAME_SIZE, b'\0'), dtype=np.uint8)
+        self.control[GENERATION] = self.generation  # Last, views read it first
+
+        if self._data is not None:
+            self._retire(self._data)
+        self._data, self._data_name = data, data_name
+        self._version = state.version
+
+    def _retire(self, block):
+        # Views remap on the generation change; the old block is unlinked now and closed once unused
+        if self.kind == 'shm':
+            block.unlink()
+        else:
+            os.remove(block.filename)
+        self._retired = [b for b in self._retired + [block] if not release_block(b)]
+
+    def begin_write(self):
+        self.control[SEQ] += 1  # Odd: a step is in progress
+
+    def end_write(self, sim_time=None):
+        if sim_time is not None:
+            self.control[SIM_TIME:SIM_TIME + 1].view(np.float64)[0] = sim_time
+        self.control[SEQ] += 1
+        self.publish()
+
+    def close(self):
+        # Give the state private arrays again before the blocks go away. Files are left in place
+        # as a snapshot of the last state
+        state = self.state
+        state.use_buffers(state.pos.copy(), state.vel.copy(), state.mass.copy(), state.radius.copy(), state.color.copy())
+        self.control = self._control_bytes = None
+        self._retired = [b for b in self._retired if not release_block(b)]
+        release_block(self._data, unlink=self.kind == 'shm')
+        release_block(self._control, unlink=self.kind == 'shm')
+
+class SharedStateView:
+    """Read side of a SharedStateStore, for another process; attach with the same name and kind."""
+    def __init__(self, name, kind='shm'):
+        self.name = name
+        self.kind = kind
+        self._control, buffer = attach_block(name, kind)
+        self._control_bytes = as_bytes(buffer)
+        self.control = np.ndarray(NAME_OFFSET // 8, dtype=np.int64, buffer=buffer)
+        self.generation = None
+        self._data = None
+        self.refresh()
+
+    def refresh(self):
+        """Remap if the simulation changed its rows. Returns True if it did."""
+        generation = int(self.control[GENERATION])
+        if generation == self.generation:
+            return False
+        data_name = bytes(self._control_bytes[NAME_OFFSET:NAME_OFFSET + NAME_SIZE]).rstrip(b'\0').decode()
+        n = int(self.control[N])
+        old = self._data
+        self._data, buffer = attach_block(data_name, self.kind)
+        arrays = map_arrays(buffer, n)
+        self.pos, self.vel, self.mass, self.radius, self.color = arrays['pos'], arrays['vel'], arrays['mass'], arrays['radius'], arrays['color']
+        offsets, _ = layout(n, 0)
+        names_size = int(self.control[NAMES_SIZE])
+        self.names = json.loads(bytes(as_bytes(buffer)[offsets['names']:offsets['names'] + names_size]).decode())
+        self.n = n
+        self.n_bodies = int(self.control[N_BODIES])
+        self.generation = generation
+        if old is not None:
+            release_block(old)
+        return True
+
+    @property
+    def sim_time(self):
+        return float(self.control[SIM_TIME:SIM_TIME + 1].view(np.float64)[0])
+
+    def snapshot(self, timeout=1.0):
+        """Consistent copies of the arrays, taken between two simulation steps."""
+        deadline = time.perf_counter() + timeout
+        while True:
+            self.refresh()
+            seq = int(self.control[SEQ])
+            if seq % 2 == 0:
+                copy = {'pos': self.pos.copy(), 'vel': self.vel.copy(), 'mass': self.mass.copy(), 'sim_time': self.sim_time}
+                if int(self.control[SEQ]) == seq and int(self.control[GENERATION]) == self.generation:
+                    return copy
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"No consistent snapshot of '{self.name}' within {timeout} s")
+            time.sleep(0.0005)
+
+    def close(self):
+        self.pos = self.vel = self.mass = self.radius = self.color = None
+        self.control = self._control_bytes = None
+        release_block(self._data)
+        release_block(self._control)
@@ -2,6 +2,17 @@ from constants import G, C
 from planet import bodies
 import numpy as np
 import integration
+import collisions
+import encounters
+import diagnostics
+from perf import perf
+from state import SimulationState
+from body_index import BodyIndex
+
+# Persistent state arrays shared by the integrators and the renderer
+state = SimulationState(bodies)
+index = BodyIndex(state)  # Name, type and parent lookups, rebuilt when rows change
+state.mass_listeners.append(integration.masses_changed)
 
 def calculate_net_force(target_body):
     net_force = np.array([0.0, 0.0, 0.0])
@@ -36,22 +47,47 @@ def run_simulation_array(timescale_seconds, method, FULL_ORBITS, gravity_enabled
     from constants import G
     # Use G=0 if gravity is disabled, otherwise use normal G
     effective_G = G if gravity_enabled else 0.0
-    pos, vel, mass = bodies_to_arrays(bodies)
+    with perf.timer('state.pull'):
+        state.pull_bodies()
+    pos, vel, mass = state.pos, state.vel, state.mass
+    mdot = state.mdot if state.mdot.any() else None
+    colliding = collisions.enabled  # Read once, so the start positions and the merge check agree
+    start = pos.copy() if colliding or encounters.enabled else None
+    groups = encounters.find_groups(state, timescale_seconds, effective_G) if encounters.enabled else []
+    start_vel = vel.copy() if groups else None
+    if mdot is not None:
+        with perf.timer('mass_rates'):
+            rates = diagnostics.mass_rate_effects(pos, vel, mass, mdot, effective_G)
     if method == 'euler':
-        integration.euler_step(pos, vel, mass, timescale_seconds, effective_G)
+        integration.euler_step(pos, vel, mass, timescale_seconds, effective_G, mdot)
     elif method == 'verlet':
-        integration.verlet_step(pos, vel, mass, timescale_seconds, effective_G)
+        integration.verlet_step(pos, vel, mass, timescale_seconds, effective_G, mdot)
     elif method == 'leapfrog':
-        integration.leapfrog_step(pos, vel, mass, timescale_seconds, effective_G)
+        integration.leapfrog_step(pos, vel, mass, timescale_seconds, effective_G, mdot)
     elif method == 'rk4':
-        integration.rk4_step(pos, vel, mass, timescale_seconds, effective_G)
+        integration.rk4_step(pos, vel, mass, timescale_seconds, effective_G, mdot)
     else:
         raise ValueError(f'Unknown integration method: {method}')
-    arrays_to_bodies(pos, vel, bodies)
+    perf.count('steps')
+    if groups:
+        with perf.timer('encounters'):
+            perf.count('encounter_substeps', encounters.sub_integrate(state, groups, start, start_vel, timescale_seconds, effective_G))
+    elif encounters.active:
+        encounters.active.clear()
+    if mdot is not None:
+        with perf.timer('mass_rates'):
+            state.apply_mass_rates(timescale_seconds)
+            # What the lost mass carried away over the step, for the conservation monitor
+            rates += diagnostics.mass_rate_effects(pos, vel, mass, mdot, effective_G)
+            state.mass_rate_ledger += 0.5 * rates * timescale_seconds
+    if colliding:
+        with perf.timer('collisions'):
+            perf.count('merges', collisions.resolve(state, start))
     if FULL_ORBITS:
-        for body in bodies:
-            if body.parent:
-                calculate_orbital_parameters(body)
+        with perf.timer('orbital_elements'):
+            for body in bodies:
+                if body.parent:
+                    calculate_orbital_parameters(body)
 
 def get_integrator(method):
     integrators = {
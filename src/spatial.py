@@ -0,0 +1,97 @@
+import numpy as np
+
+class ScreenGrid:
+    """
+    Bucketed uniform grid over the projected screen positions of the bodies.
+
+    Rebuilt once per frame from the projected positions. Bodies whose disc does
+    not touch the screen are culled before bucketing, so drawing and picking
+    only ever look at the visible subset.
+    """
+    def __init__(self, screen_pos, radii, width, height, cell_size=64):
+        self.cell_size = cell_size
+        self.width = width
+        self.height = height
+        self.screen_pos = screen_pos
+        self.radii = radii
+
+        x = screen_pos[:, 0]
+        y = screen_pos[:, 1]
+        on_screen = (x + radii >= 0) & (x - radii < width) & (y + radii >= 0) & (y - radii < height)
+        self.on_screen = on_screen
+        self.visible = np.flatnonzero(on_screen)
+
+        # Bodies drawn larger than a cell are kept aside and tested directly,
+        # so a zoomed-in Sun does not force every query to scan the whole screen.
+        large = radii[self.visible] > cell_size
+        self.large = self.visible[large]
+        small = self.visible[~large]
+
+        self.cols = max(1, int(np.ceil(width / cell_size)))
+        self.rows = max(1, int(np.ceil(height / cell_size)))
+        cx = np.clip((x[small] // cell_size).astype(np.int64), 0, self.cols - 1)
+        cy = np.clip((y[small] // cell_size).astype(np.int64), 0, self.rows - 1)
+        keys = cy * self.cols + cx
+        order = np.argsort(keys, kind='stable')
+        self._cell_bodies = small[order]
+        self._cell_starts = np.searchsorted(keys[order], np.arange(self.cols * self.rows + 1))
+
+    def _cell_of(self, point):
+        cx = int(np.clip(point[0] // self.cell_size, 0, self.cols - 1))
+        cy = int(np.clip(point[1] // self.cell_size, 0, self.rows - 1))
+        return cx, cy
+
+    def _ring(self, cx, cy, ring):
+        # Indices of the bodies in the square ring of cells `ring` steps away from (cx, cy)
+        x0, x1 = max(cx - ring, 0), min(cx + ring, self.cols - 1)
+        y0, y1 = max(cy - ring, 0), min(cy + ring, self.rows - 1)
+        chunks = []
+        for gy in range(y0, y1 + 1):
+            if gy in (cy - ring, cy + ring):
+                xs = range(x0, x1 + 1)
+            else:
+                xs = [gx for gx in (cx - ring, cx + ring) if x0 <= gx <= x1]
+            for gx in xs:
+                key = gy * self.cols + gx
+                start, end = self._cell_starts[key], self._cell_starts[key + 1]
+                if end > start:
+                    chunks.append(self._cell_bodies[start:end])
+        if not chunks:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(chunks)
+
+    def _closest_of(self, candidates, point):
+        if len(candidates) == 0:
+            return None, float('inf')
+        d2 = np.sum((self.screen_pos[candidates] - point) ** 2, axis=1)
+        k = int(np.argmin(d2))
+        return int(candidates[k]), float(np.sqrt(d2[k]))
+
+    def nearest(self, point):
+        """Index of the visible body whose centre is closest to `point`, or None."""
+        point = np.asarray(point, dtype=float)
+        best, best_dist = self._closest_of(self.large, point)
+        cx, cy = self._cell_of(point)
+        max_ring = max(self.cols, self.rows)
+        for ring in range(max_ring + 1):
+            # Everything in this ring is at least (ring - 1) cells away
+            if (ring - 1) * self.cell_size > best_dist:
+                break
+            candidate, dist = self._closest_of(self._ring(cx, cy, ring), point)
+            if dist < best_dist:
+                best, best_dist = candidate, dist
+        return best
+
+    def bodies_at(self, point):
+        """Indices of the visible bodies whose screen disc contains `point`."""
+        point = np.asarray(point, dtype=float)
+        cx, cy = self._cell_of(point)
+        # A small body's disc is at most one cell wide, so its centre lies in a neighbouring cell
+        candidates = np.concatenate([self.large, self._ring(cx, cy, 0), self._ring(cx, cy, 1)])
+        if len(candidates) == 0:
+            return candidates
+        d = np.sqrt(np.sum((self.screen_pos[candidates] - point) ** 2, axis=1))
+        return candidates[d < self.radii[candidates]]
+
+    def is_visible(self, index):
+        return bool(self.on_screen[index])
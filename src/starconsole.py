@@ -1,5 +1,7 @@
 import sys
 import os
+from constants import AU
+from commands import Call, GetSettings, RunCode, SetSetting, Snapshot, ToggleSetting, captured_output
 
 # Try to import readline for command history (enables up/down arrow navigation)
 _history_file = '.starconsole_history'
@@ -48,12 +50,24 @@ def get_input_with_history(prompt):
     
     return cmd
 
+def get_setting(context, name):
+    """Current value of a main loop setting, read between steps."""
+    return context['commands'].request(GetSettings([name]))[name]
+
+def set_setting(context, name, value):
+    return context['commands'].request(SetSetting(name, value))
+
+def toggle_setting(context, name):
+    return context['commands'].request(ToggleSetting(name))
+
 def custom_repl(context):
     """
     Custom REPL for interactive star management.
     
     Parameters:
     - context: Dictionary containing the local context in which to execute commands.
+      Its 'commands' queue carries everything that reads or changes the running
+      simulation to the main loop, which applies it between steps.
     """
     print("\n=== StarConsole ===")
     print("Welcome to the interactive simulation console!")
@@ -65,259 +79,543 @@ def custom_repl(context):
         try:
             # Read with history support
             cmd = get_input_with_history("StarConsole >>> ")
-            
-            if cmd.strip() == "exit":
-                print("Exiting StarConsole.")
+            if not run_command(context, cmd):
                 break
-            
-            if cmd.strip() == "help":
-                print_help()
-                continue
-            
-            if cmd.strip() == "list_bodies":
-                list_bodies(context.get('bodies', []))
-                continue
-            
-            if cmd.strip().startswith("focus "):
-                body_name = cmd.strip()[6:].strip()
-                focus_body(context, body_name)
-                continue
-            
-            if cmd.strip().startswith("pause"):
-                context['paused'] = True
-                print("Simulation paused. Use 'unpause' or set paused=False to resume.")
-                continue
-            
-            if cmd.strip().startswith("unpause") or cmd.strip().startswith("resume"):
-                context['paused'] = False
-                print("Simulation resumed.")
-                continue
-            
-            if cmd.strip().startswith("timestep ") or cmd.strip().startswith("set_timestep "):
-                try:
-                    parts = cmd.split()
-                    value = float(parts[-1])
-                    context['timestep_seconds'] = value
-                    # Force immediate update
-                    if 'timestep_updated' in context:
-                        context['timestep_updated'] = True
-                    print(f"Timestep set to {value} seconds")
-                except (ValueError, IndexError) as e:
-                    print(f"Usage: timestep <value_in_seconds>")
-                    print(f"Error: {e}")
-                continue
-            
-            if cmd.strip().startswith("zoom ") or cmd.strip().startswith("set_zoom "):
-                try:
-                    parts = cmd.split()
-                    value = float(parts[-1])
-                    context['SCALE_DIST'] = value
-                    print(f"Zoom/Scale set to {value}")
-                except (ValueError, IndexError) as e:
-                    print(f"Usage: zoom <value>")
-                    print(f"Error: {e}")
-                continue
-            
-            if cmd.strip().startswith("gravity ") or cmd.strip().startswith("set_gravity "):
-                try:
-                    parts = cmd.split()
-                    if len(parts) > 1:
-                        value = parts[-1].lower()
-                        if value in ['on', 'true', '1', 'enable']:
-                            context['gravity_enabled'] = True
-                            print("Gravity enabled")
-                        elif value in ['off', 'false', '0', 'disable']:
-                            context['gravity_enabled'] = False
-                            print("Gravity disabled")
-                        else:
-                            print("Usage: gravity <on|off>")
-                    else:
-                        # Toggle gravity
-                        current = context.get('gravity_enabled', True)
-                        context['gravity_enabled'] = not current
-                        status = "enabled" if context['gravity_enabled'] else "disabled"
-                        print(f"Gravity {status}")
-                except Exception as e:
-                    print(f"Usage: gravity <on|off> or just 'gravity' to toggle")
-                    print(f"Error: {e}")
-                continue
-
-            # Toggle flags: FULL_ORBITS, fade_trails, draw_trail_for_empty, display_names
-            if cmd.strip().startswith("full_orbits"):
-                try:
-                    parts = cmd.split()
-                    if len(parts) == 1:
-                        context['FULL_ORBITS'] = not context.get('FULL_ORBITS', False)
+        
+        except KeyboardInterrupt:
+            print("\nUse 'exit' to close the console.")
+        except EOFError:
+            print("\nExiting StarConsole.")
+            break
+        except Exception as e:
+            print(f"Error: {e}")
+
+
+def run_command(context, cmd):
+    """
+    Run one console command, or any other input as Python; returns False on 'exit'.
+
+    Used by the stdin console and by remote.py, which captures what it prints.
+    """
+    try:
+        if cmd.strip() == "exit":
+            print("Exiting StarConsole.")
+            return False
+
+        if cmd.strip() == "help":
+            print_help()
+            return True
+
+        if cmd.strip() == "list_bodies":
+            list_bodies(context.get('bodies', []))
+            return True
+
+        if cmd.strip().startswith("focus "):
+            body_name = cmd.strip()[6:].strip()
+            focus_body(context, body_name)
+            return True
+
+        if cmd.strip() == "pause":
+            set_setting(context, 'paused', True)
+            print("Simulation paused. Use 'unpause' or set paused=False to resume.")
+            return True
+
+        if cmd.strip().startswith("unpause") or cmd.strip().startswith("resume"):
+            set_setting(context, 'paused', False)
+            print("Simulation resumed.")
+            return True
+
+        if cmd.strip().startswith("timestep ") or cmd.strip().startswith("set_timestep "):
+            try:
+                parts = cmd.split()
+                value = float(parts[-1])
+                set_setting(context, 'timestep_seconds', value)
+                print(f"Timestep set to {value} seconds")
+            except (ValueError, IndexError) as e:
+                print(f"Usage: timestep <value_in_seconds>")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip().startswith("zoom ") or cmd.strip().startswith("set_zoom "):
+            try:
+                parts = cmd.split()
+                value = float(parts[-1])
+                set_setting(context, 'SCALE_DIST', value)
+                print(f"Zoom/Scale set to {value}")
+            except (ValueError, IndexError) as e:
+                print(f"Usage: zoom <value>")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip() == "gravity" or cmd.strip().startswith("gravity ") or cmd.strip().startswith("set_gravity "):
+            try:
+                parts = cmd.split()
+                if len(parts) > 1:
+                    value = parts[-1].lower()
+                    if value in ['on', 'true', '1', 'enable']:
+                        set_setting(context, 'gravity_enabled', True)
+                        print("Gravity enabled")
+                    elif value in ['off', 'false', '0', 'disable']:
+                        set_setting(context, 'gravity_enabled', False)
+                        print("Gravity disabled")
                     else:
-                        val = parts[-1].lower()
-                        context['FULL_ORBITS'] = val in ['on','true','1','enable']
-                    print(f"FULL_ORBITS: {context['FULL_ORBITS']}")
-                except Exception as e:
-                    print(f"Usage: full_orbits [on|off]")
-                    print(f"Error: {e}")
-                continue
-
-            if cmd.strip().startswith("fade_trails"):
-                try:
-                    parts = cmd.split()
-                    if len(parts) == 1:
-                        context['fade_trails'] = not context.get('fade_trails', False)
+                        print("Usage: gravity <on|off>")
+                else:
+                    # Toggle gravity
+                    status = "enabled" if toggle_setting(context, 'gravity_enabled') else "disabled"
+                    print(f"Gravity {status}")
+            except Exception as e:
+                print(f"Usage: gravity <on|off> or just 'gravity' to toggle")
+                print(f"Error: {e}")
+            return True
+
+        # Toggle flags: FULL_ORBITS, fade_trails, draw_trail_for_empty, display_names
+        if cmd.strip().startswith("full_orbits"):
+            try:
+                parts = cmd.split()
+                if len(parts) == 1:
+                    toggle_setting(context, 'FULL_ORBITS')
+                else:
+                    val = parts[-1].lower()
+                    set_setting(context, 'FULL_ORBITS', val in ['on','true','1','enable'])
+                print(f"FULL_ORBITS: {get_setting(context, 'FULL_ORBITS')}")
+            except Exception as e:
+                print(f"Usage: full_orbits [on|off]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip().startswith("fade_trails"):
+            try:
+                parts = cmd.split()
+                if len(parts) == 1:
+                    toggle_setting(context, 'fade_trails')
+                else:
+                    val = parts[-1].lower()
+                    set_setting(context, 'fade_trails', val in ['on','true','1','enable'])
+                print(f"fade_trails: {get_setting(context, 'fade_trails')}")
+            except Exception as e:
+                print(f"Usage: fade_trails [on|off]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip().startswith("draw_empty") or cmd.strip().startswith("draw_trail_for_empty"):
+            try:
+                parts = cmd.split()
+                if len(parts) == 1:
+                    toggle_setting(context, 'draw_trail_for_empty')
+                else:
+                    val = parts[-1].lower()
+                    set_setting(context, 'draw_trail_for_empty', val in ['on','true','1','enable'])
+                print(f"draw_trail_for_empty: {get_setting(context, 'draw_trail_for_empty')}")
+            except Exception as e:
+                print(f"Usage: draw_empty [on|off]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip().startswith("display_names"):
+            try:
+                parts = cmd.split()
+                if len(parts) == 1:
+                    toggle_setting(context, 'display_names')
+                else:
+                    val = parts[-1].lower()
+                    set_setting(context, 'display_names', val in ['on','true','1','enable'])
+                print(f"display_names: {get_setting(context, 'display_names')}")
+            except Exception as e:
+                print(f"Usage: display_names [on|off]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip().startswith("gravity_field"):
+            try:
+                parts = cmd.split()
+                if len(parts) == 1:
+                    toggle_setting(context, 'gravity_field')
+                else:
+                    val = parts[-1].lower()
+                    set_setting(context, 'gravity_field', val in ['on','true','1','enable'])
+                status = "enabled" if get_setting(context, 'gravity_field') else "disabled"
+                print(f"Gravity field visualization: {status}")
+            except Exception as e:
+                print(f"Usage: gravity_field [on|off]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip().startswith("particles"):
+            try:
+                parts = cmd.split()
+                if len(parts) == 1:
+                    toggle_setting(context, 'particle_render')
+                else:
+                    val = parts[-1].lower()
+                    set_setting(context, 'particle_render', val in ['on','true','1','enable'])
+                mode = "point splat" if get_setting(context, 'particle_render') else "circles"
+                print(f"Particle rendering: {mode}")
+            except Exception as e:
+                print(f"Usage: particles [on|off]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip().startswith("fps ") or cmd.strip().startswith("set_fps "):
+            try:
+                parts = cmd.split()
+                value = float(parts[-1])
+                if value <= 0:
+                    raise ValueError("target frame rate must be positive")
+                set_setting(context, 'target_fps', value)
+                print(f"Target frame rate set to {value} FPS")
+            except (ValueError, IndexError) as e:
+                print(f"Usage: fps <frames_per_second>")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip().startswith("adaptive"):
+            try:
+                parts = cmd.split()
+                if len(parts) == 1:
+                    toggle_setting(context, 'adaptive_quality')
+                else:
+                    val = parts[-1].lower()
+                    set_setting(context, 'adaptive_quality', val in ['on','true','1','enable'])
+                print(f"adaptive_quality: {get_setting(context, 'adaptive_quality')}")
+            except Exception as e:
+                print(f"Usage: adaptive [on|off]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip() == "backend" or cmd.strip().startswith("backend "):
+            try:
+                import integration
+                parts = cmd.split()
+                if len(parts) > 1:
+                    context['commands'].request(Call(integration.set_force_backend, parts[1]))
+                print(f"Force backend: {integration.force_backend} (available: {', '.join(integration.FORCE_BACKENDS)})")
+            except Exception as e:
+                print(f"Usage: backend [name]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip().startswith("populate "):
+            try:
+                import populations
+                state = context['state']
+                parts = cmd.split()
+                if parts[1] == 'clear':
+                    context['commands'].request(Call(state.clear_particles))
+                    print("Removed all particles.")
+                    return True
+                generator = populations.GENERATORS[parts[1]]
+                n = int(float(parts[2]))
+                parent = find_body_by_name(context, parts[3]) if len(parts) > 3 else max(context['bodies'], key=lambda b: b.mass)
+                if parent is None:
+                    raise ValueError(f"Body '{parts[3]}' not found")
+                seed = int(parts[4]) if len(parts) > 4 else 0
+                population = generator(n, parent, seed=seed)
+                context['commands'].request(Call(state.add_particles, population['pos'], population['vel'], population['mass'], population['radius'], population['color']))
+                print(f"Added {n} particles ({population['name']} around {parent.name}), {state.n_particles} in total.")
+            except Exception as e:
+                print(f"Usage: populate <belt|kuiper|disk> <count> [parent] [seed] | populate clear")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip() == "perturbation" or cmd.strip().startswith("perturbation "):
+            try:
+                import integration
+                parts = cmd.split()
+                if len(parts) > 1:
+                    name = parts[1]
+                    if len(parts) > 2:
+                        enabled = parts[2].lower() in ['on', 'true', '1', 'yes']
                     else:
-                        val = parts[-1].lower()
-                        context['fade_trails'] = val in ['on','true','1','enable']
-                    print(f"fade_trails: {context['fade_trails']}")
-                except Exception as e:
-                    print(f"Usage: fade_trails [on|off]")
-                    print(f"Error: {e}")
-                continue
-
-            if cmd.strip().startswith("draw_empty") or cmd.strip().startswith("draw_trail_for_empty"):
-                try:
-                    parts = cmd.split()
-                    if len(parts) == 1:
-                        context['draw_trail_for_empty'] = not context.get('draw_trail_for_empty', False)
+                        enabled = name not in integration.perturbations
+                    context['commands'].request(Call(integration.set_perturbation, name, enabled))
+                for name in integration.PERTURBATIONS:
+                    print(f"  {name:<10} {'ON' if name in integration.perturbations else 'OFF'}")
+            except Exception as e:
+                print(f"Usage: perturbation [name [on|off]]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip() == "collisions" or cmd.strip().startswith("collisions "):
+            try:
+                import collisions
+                parts = cmd.split()
+                if len(parts) > 1:
+                    if parts[1].lower() in ['on', 'true', '1', 'yes']:
+                        context['commands'].request(Call(setattr, collisions, 'enabled', True))
+                    elif parts[1].lower() in ['off', 'false', '0', 'no']:
+                        context['commands'].request(Call(setattr, collisions, 'enabled', False))
+                    elif parts[1].lower() == 'clear':
+                        context['commands'].request(Call(collisions.history.clear))
                     else:
-                        val = parts[-1].lower()
-                        context['draw_trail_for_empty'] = val in ['on','true','1','enable']
-                    print(f"draw_trail_for_empty: {context['draw_trail_for_empty']}")
-                except Exception as e:
-                    print(f"Usage: draw_empty [on|off]")
-                    print(f"Error: {e}")
-                continue
-
-            if cmd.strip().startswith("display_names"):
-                try:
-                    parts = cmd.split()
-                    if len(parts) == 1:
-                        context['display_names'] = not context.get('display_names', True)
+                        raise ValueError(f"Unknown option '{parts[1]}'")
+                print(f"Collisions: {'ON' if collisions.enabled else 'OFF'}, {len(collisions.history)} recent merges")
+                for survivor, absorbed in collisions.history[-10:]:
+                    print(f"  {absorbed} merged into {survivor}")
+            except Exception as e:
+                print(f"Usage: collisions [on|off|clear]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip() == "encounters" or cmd.strip().startswith("encounters "):
+            try:
+                import encounters
+                parts = cmd.split()
+                if len(parts) > 1:
+                    if parts[1].lower() in ['on', 'true', '1', 'yes']:
+                        context['commands'].request(Call(setattr, encounters, 'enabled', True))
+                    elif parts[1].lower() in ['off', 'false', '0', 'no']:
+                        context['commands'].request(Call(setattr, encounters, 'enabled', False))
+                    elif parts[1].lower() == 'tolerance':
+                        context['commands'].request(Call(setattr, encounters, 'TOLERANCE', float(parts[2])))
                     else:
-                        val = parts[-1].lower()
-                        context['display_names'] = val in ['on','true','1','enable']
-                    print(f"display_names: {context['display_names']}")
-                except Exception as e:
-                    print(f"Usage: display_names [on|off]")
-                    print(f"Error: {e}")
-                continue
-
-            if cmd.strip().startswith("gravity_field"):
-                try:
-                    parts = cmd.split()
-                    if len(parts) == 1:
-                        context['gravity_field'] = not context.get('gravity_field', False)
+                        raise ValueError(f"Unknown option '{parts[1]}'")
+                print(f"Encounters: {'ON' if encounters.enabled else 'OFF'}, tolerance {encounters.TOLERANCE:.0e}, {encounters.substeps} substeps last step")
+                for group in context['commands'].request(Call(list, encounters.active)):
+                    print(f"  {', '.join(group)}")
+            except Exception as e:
+                print(f"Usage: encounters [on|off|tolerance <value>]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip() == "conservation" or cmd.strip().startswith("conservation "):
+            try:
+                monitor = context['monitor']
+                parts = cmd.split()
+                if len(parts) == 1:
+                    show_conservation(monitor)
+                elif parts[1] == "reset":
+                    context['commands'].request(Call(monitor.reset))
+                    print("Conservation baseline will be retaken at the next sample.")
+                elif parts[1] == "cadence":
+                    cadence = max(1, int(parts[2]))
+                    context['commands'].request(Call(setattr, monitor, 'cadence', cadence))
+                    print(f"Conservation checked every {cadence} steps")
+                elif parts[1] == "tolerance":
+                    tolerance = float(parts[2])
+                    context['commands'].request(Call(setattr, monitor, 'tolerance', tolerance))
+                    print(f"Energy drift tolerance set to {tolerance:.2e}")
+                elif parts[1] == "auto":
+                    if len(parts) == 2:
+                        auto_reduce = not monitor.auto_reduce
                     else:
-                        val = parts[-1].lower()
-                        context['gravity_field'] = val in ['on','true','1','enable']
-                    status = "enabled" if context['gravity_field'] else "disabled"
-                    print(f"Gravity field visualization: {status}")
-                except Exception as e:
-                    print(f"Usage: gravity_field [on|off]")
-                    print(f"Error: {e}")
-                continue
-
-            if cmd.strip() == "clear_trails" or cmd.strip() == "clear_trail":
-                try:
-                    from display import clear_body_trails
-                    clear_body_trails()
-                    print("All trails cleared.")
-                except Exception as e:
-                    print(f"Error clearing trails: {e}")
-                continue
-
-            if cmd.strip() == "status":
-                show_status(context)
-                continue
-
-            if cmd.strip().startswith("distance "):
-                try:
-                    parts = cmd.split()
-                    if len(parts) < 3:
-                        print("Usage: distance <body1> <body2>")
+                        auto_reduce = parts[2].lower() in ['on','true','1','enable']
+                    context['commands'].request(Call(setattr, monitor, 'auto_reduce', auto_reduce))
+                    print(f"Automatic timestep reduction: {auto_reduce}")
+                else:
+                    raise ValueError(f"unknown option '{parts[1]}'")
+            except Exception as e:
+                print(f"Usage: conservation [reset|cadence <steps>|tolerance <value>|auto [on|off]]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip() == "evolution" or cmd.strip().startswith("evolution "):
+            try:
+                evolution = context['evolution']
+                parts = cmd.split()
+                if len(parts) == 1:
+                    print(f"Stellar evolution: {'ON' if evolution.enabled else 'OFF'}, every {evolution.cadence} steps, "
+                          f"{evolution.time_scale:g}x the simulation clock, {evolution.updates} updates")
+                    for stage, count in evolution.counts().items():
+                        print(f"  {stage:15} {count}")
+                elif parts[1] in ['on', 'off']:
+                    context['commands'].request(Call(setattr, evolution, 'enabled', parts[1] == 'on'))
+                    print(f"Stellar evolution: {parts[1].upper()}")
+                elif parts[1] == "cadence":
+                    cadence = max(1, int(parts[2]))
+                    context['commands'].request(Call(setattr, evolution, 'cadence', cadence))
+                    print(f"Stars evolved every {cadence} steps")
+                elif parts[1] == "scale":
+                    time_scale = float(parts[2])
+                    context['commands'].request(Call(setattr, evolution, 'time_scale', time_scale))
+                    print(f"Stars age {time_scale:g}x faster than the simulation clock")
+                else:
+                    raise ValueError(f"unknown option '{parts[1]}'")
+            except Exception as e:
+                print(f"Usage: evolution [on|off|cadence <steps>|scale <factor>]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip() == "mass_rate" or cmd.strip().startswith("mass_rate "):
+            try:
+                from constants import SOLAR_MASS, YEAR
+                state = context['state']
+                parts = cmd.split()
+                if len(parts) == 1:
+                    print(context['commands'].request(Call(mass_rates_report, state)))
+                else:
+                    body = find_body_by_name(context, parts[1])
+                    if body is None:
+                        raise ValueError(f"no single body matches '{parts[1]}'")
+                    rate = float(parts[2]) * SOLAR_MASS / YEAR
+                    context['commands'].request(Call(set_body_mass_rate, state, body, rate))
+                    print(f"{body.name} changes mass by {float(parts[2]):g} solar masses per year ({rate:.3e} kg/s)")
+            except Exception as e:
+                print(f"Usage: mass_rate [<body> <solar masses per year>]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip() == "perf" or cmd.strip().startswith("perf "):
+            try:
+                from perf import perf
+                parts = cmd.split()
+                if len(parts) == 1:
+                    print(perf.report())
+                elif parts[1] == "json":
+                    import json
+                    print(json.dumps(perf.snapshot(), indent=2))
+                elif parts[1] == "dump":
+                    path = parts[2] if len(parts) > 2 else "perf.json"
+                    perf.dump(path)
+                    print(f"Performance counters written to {path}")
+                elif parts[1] == "reset":
+                    perf.reset()
+                    print("Performance counters reset.")
+                elif parts[1] in ['on', 'off']:
+                    perf.enabled = parts[1] == 'on'
+                    print(f"Performance counters: {parts[1]}")
+                else:
+                    raise ValueError(f"unknown option '{parts[1]}'")
+            except Exception as e:
+                print(f"Usage: perf [json|dump [file]|reset|on|off]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip() == "clear_trails" or cmd.strip() == "clear_trail":
+            try:
+                from display import clear_body_trails
+                clear_body_trails()
+                print("All trails cleared.")
+            except Exception as e:
+                print(f"Error clearing trails: {e}")
+            return True
+
+        if cmd.strip() == "status":
+            show_status({**context, **context['commands'].request(GetSettings())})
+            return True
+
+        if cmd.strip().startswith("distance "):
+            try:
+                parts = cmd.split()
+                if len(parts) < 3:
+                    print("Usage: distance <body1> <body2>")
+                else:
+                    body1_name = parts[1]
+                    body2_name = parts[2]
+                    body1 = find_body_by_name(context, body1_name)
+                    body2 = find_body_by_name(context, body2_name)
+                    if body1 and body2:
+                        from constants import AU
+                        dist = calculate_distance_3d(body1.pos, body2.pos)
+                        print(f"Distance between {body1.name} and {body2.name}: {dist:.2e} m ({dist/AU:.4f} AU)")
                     else:
-                        body1_name = parts[1]
-                        body2_name = parts[2]
-                        bodies_list = context.get('bodies', [])
-                        body1 = find_body_by_name(bodies_list, body1_name)
-                        body2 = find_body_by_name(bodies_list, body2_name)
-                        if body1 and body2:
-                            from constants import AU
-                            dist = calculate_distance_3d(body1.pos, body2.pos)
-                            print(f"Distance between {body1.name} and {body2.name}: {dist:.2e} m ({dist/AU:.4f} AU)")
-                        else:
-                            if not body1:
-                                print(f"Body '{body1_name}' not found.")
-                            if not body2:
-                                print(f"Body '{body2_name}' not found.")
-                except Exception as e:
-                    print(f"Error: {e}")
-                continue
-
-            if cmd.strip().startswith("lagrange_points ") or cmd.strip().startswith("lagrange "):
-                try:
-                    parts = cmd.split()
-                    if len(parts) < 3:
-                        print("Usage: lagrange_points <body1> <body2>")
-                        print("       Calculates L1, L2, L3, L4, L5 Lagrange points")
+                        if not body1:
+                            print(f"Body '{body1_name}' not found.")
+                        if not body2:
+                            print(f"Body '{body2_name}' not found.")
+            except Exception as e:
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip().startswith("lagrange_points ") or cmd.strip().startswith("lagrange "):
+            try:
+                parts = cmd.split()
+                if len(parts) < 3:
+                    print("Usage: lagrange_points <body1> <body2>")
+                    print("       Calculates L1, L2, L3, L4, L5 Lagrange points")
+                else:
+                    body1_name = parts[1]
+                    body2_name = parts[2]
+                    body1 = find_body_by_name(context, body1_name)
+                    body2 = find_body_by_name(context, body2_name)
+                    if body1 and body2:
+                        calculate_lagrange_points(body1, body2)
                     else:
-                        body1_name = parts[1]
-                        body2_name = parts[2]
-                        bodies_list = context.get('bodies', [])
-                        body1 = find_body_by_name(bodies_list, body1_name)
-                        body2 = find_body_by_name(bodies_list, body2_name)
-                        if body1 and body2:
-                            calculate_lagrange_points(body1, body2)
-                        else:
-                            if not body1:
-                                print(f"Body '{body1_name}' not found.")
-                            if not body2:
-                                print(f"Body '{body2_name}' not found.")
-                except Exception as e:
-                    print(f"Error: {e}")
-                continue
-
-            if cmd.strip().startswith("filter "):
-                try:
-                    parts = cmd.split()
-                    if len(parts) < 2:
-                        print("Usage: filter <type>")
-                        print("       Types: planet, moon, star, probe, or 'all' to show all")
+                        if not body1:
+                            print(f"Body '{body1_name}' not found.")
+                        if not body2:
+                            print(f"Body '{body2_name}' not found.")
+            except Exception as e:
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip() == "distances" or cmd.strip().startswith("distances "):
+            try:
+                import analysis
+                parts = cmd.split()[1:]
+                unit = parts.pop(0) if parts and parts[0] in UNITS else 'AU'
+                (pos, vel, mass, bodies_list, n_bodies), rows = snapshot_with_rows(context, parts)
+                missing = [name for name, row in zip(parts, rows) if row is None]
+                if missing:
+                    raise ValueError(f"No single body matches: {', '.join(missing)}")
+                rows = rows or list(range(n_bodies))
+                matrix = context['commands'].analyse(analysis.distance_matrix, pos[rows]).result()
+                print_distance_matrix([bodies_list[i].name for i in rows], matrix / UNITS[unit], unit)
+            except Exception as e:
+                print(f"Usage: distances [m|km|AU] [body ...]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip() == "nearest" or cmd.strip().startswith("nearest "):
+            try:
+                import analysis
+                everything = cmd.split()[1:] == ['all']
+                pos, vel, mass, bodies_list, n_bodies = context['commands'].request(Snapshot(context['state']), timeout=None)
+                queries = None if everything else range(n_bodies)
+                index, distance = context['commands'].analyse(analysis.nearest_neighbours, pos, queries).result()
+                if everything:
+                    print_nearest_summary(bodies_list, n_bodies, index, distance)
+                else:
+                    print_nearest(bodies_list, n_bodies, index, distance)
+            except Exception as e:
+                print(f"Usage: nearest [all]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip() == "lagrange_table" or cmd.strip().startswith("lagrange_table "):
+            try:
+                import analysis
+                positions = cmd.split()[1:] == ['positions']
+                pos, vel, mass, bodies_list, n_bodies = context['commands'].request(Snapshot(context['state']), timeout=None)
+                table = context['commands'].analyse(analysis.lagrange_table, pos, vel, mass, analysis.parent_rows(bodies_list, n_bodies)).result()
+                print_lagrange_table(bodies_list, pos, *table, positions=positions)
+            except Exception as e:
+                print(f"Usage: lagrange_table [positions]")
+                print(f"Error: {e}")
+            return True
+
+        if cmd.strip().startswith("filter "):
+            try:
+                parts = cmd.split()
+                if len(parts) < 2:
+                    print("Usage: filter <type>")
+                    print("       Types: planet, moon, star, probe, or 'all' to show all")
+                else:
+                    filter_type = parts[1].lower()
+                    if filter_type == 'all':
+                        list_bodies(context.get('bodies', []))
                     else:
-                        filter_type = parts[1].lower()
-                        bodies_list = context.get('bodies', [])
-                        if filter_type == 'all':
-                            list_bodies(bodies_list)
+                        filtered = query_index(context, 'of_type', filter_type)
+                        if filtered:
+                            list_bodies(filtered)
                         else:
-                            filtered = [b for b in bodies_list if b.type and b.type.lower() == filter_type]
-                            if filtered:
-                                list_bodies(filtered)
-                            else:
-                                print(f"No bodies found with type '{filter_type}'")
-                                print("Available types:", set(b.type for b in bodies_list if b.type))
-                except Exception as e:
-                    print(f"Error: {e}")
-                continue
-
-            # Evaluate (for commands that return a value like variable access)
-            try:
-                result = eval(cmd, context)
-                if result is not None:
-                    print(result)
-            except SyntaxError:
-                # If evaluation failed, then try exec (for statements that don't return a value)
-                exec(cmd, context)
+                            print(f"No bodies found with type '{filter_type}'")
+                            print("Available types:", set(query_index(context, 'types')))
             except Exception as e:
-                # If eval failed with non-SyntaxError, try exec
-                try:
-                    exec(cmd, context)
-                except Exception as e2:
-                    print(f"Error: {e2}")
-        
-        except KeyboardInterrupt:
-            print("\nUse 'exit' to close the console.")
-        except EOFError:
-            print("\nExiting StarConsole.")
-            break
+                print(f"Error: {e}")
+            return True
+
+        # Any other input is Python, run on the main thread between steps
+        try:
+            result = context['commands'].request(RunCode(cmd, context, captured_output()), timeout=None)
+            if result is not None:
+                print(result)
         except Exception as e:
             print(f"Error: {e}")
+        return True
+    except Exception as e:
+        print(f"Error: {e}")
+    return True
 
 
 def print_help():
@@ -338,10 +636,30 @@ Available Commands:
   draw_empty [on|off]   - Toggle drawing trails for empty bodies
   display_names [on|off] - Toggle name labels
   gravity_field [on|off] - Toggle gravity field visualization
+  particles [on|off]    - Toggle point-splat rendering of sub-pixel particles
+  fps <value>           - Set the target frame rate
+  adaptive [on|off]     - Toggle automatic drawing quality reduction on slow frames
+  backend [name]        - Show or select the force backend (numba, numpy, mixed, tiled, tiled_fastmath)
+  perturbation [name [on|off]] - Show or toggle extra forces (1pn: general relativity around the Sun)
+  populate <belt|kuiper|disk> <count> [parent] [seed] - Add a generated particle population
+  populate clear        - Remove all particles
+  collisions [on|off|clear] - Toggle merging of touching bodies and show recent merges
+  encounters [on|off|tolerance <value>] - Toggle sub-integration of close flybys and show active ones
+  conservation          - Show energy, momentum and angular momentum drift
+  conservation cadence <steps> | tolerance <value> | auto [on|off] | reset
+                        - Configure the drift checks and automatic timestep reduction
+  evolution [on|off|cadence <steps>|scale <factor>] - Show or configure batched stellar evolution
+  mass_rate [<body> <Msun/yr>] - Show the rows losing or gaining mass, or set a body's rate (negative to lose)
+  perf                  - Show per-phase timings, steps/s and interactions/s
+  perf dump [file]      - Write the performance counters as JSON (default perf.json)
+  perf json|reset|on|off - Print as JSON, reset, or toggle the counters
   clear_trails          - Clear all body trails
   status                - Show current simulation status and settings
   distance <b1> <b2>    - Calculate distance between two bodies
   lagrange_points <b1> <b2> - Calculate Lagrange points between two bodies
+  distances [m|km|AU] [body ...] - Table of distances between all (or the given) bodies
+  nearest [all]         - Nearest neighbour of every body (or summary over all particles)
+  lagrange_table [positions] - L1-L5 of every body around its parent
   filter <type>         - Filter bodies by type (planet, moon, star, probe, all)
 
 Python Access:
@@ -354,6 +672,12 @@ Python Access:
     - running            - Simulation running state
     - gravity_enabled    - Gravity state (True/False)
     - gravity_field      - Gravity field visualization (True/False)
+    - particle_render    - Point-splat rendering of particles (True/False)
+    - target_fps         - Frame rate the scheduler aims for
+    - adaptive_quality   - Automatic quality reduction (True/False)
+    - scheduler          - Frame scheduler with per-phase timings
+    - perf               - Rolling hot-path timers and counters
+    - monitor            - Conservation monitor (drift, cadence, tolerance)
     - FULL_ORBITS        - Draw full orbits
     - fade_trails        - Trail fading enabled
     - draw_trail_for_empty - Draw trails for empty bodies
@@ -390,24 +714,39 @@ def list_bodies(bodies):
     print("-" * 60)
 
 
-def find_body_by_name(bodies, name):
-    """Find a body by name (case-insensitive, supports partial matching)."""
-    name_lower = name.lower()
-    
-    # Try exact match first
-    for b in bodies:
-        if b.name.lower() == name_lower:
-            return b
-    
-    # Try partial match
-    matches = [b for b in bodies if name_lower in b.name.lower()]
-    if len(matches) == 1:
-        return matches[0]
-    elif len(matches) > 1:
-        print(f"Multiple matches found for '{name}': {[b.name for b in matches]}")
+def query_index(context, method, *args):
+    """Call a BodyIndex method on the main loop, where the body list cannot change while the index refreshes."""
+    return context['commands'].request(Call(getattr(context['index'], method), *args))
+
+
+def find_body_by_name(context, name):
+    """Find a body by name or NAIF id (case-insensitive, supports prefix and partial matching)."""
+    matches = query_index(context, 'matches', name)
+    if len(matches) > 1:
+        print(f"Multiple matches found for '{name}': {match_names(matches)}")
         return None
-    
-    return None
+    return matches[0] if matches else None
+
+
+def snapshot_with_rows(context, names):
+    """
+    A Snapshot and the row of each name in it, None where not exactly one
+    body matches, taken together on the main loop so the rows belong to
+    the snapshot even if bodies merge in between.
+    """
+    state, index = context['state'], context['index']
+    def take():
+        rows = []
+        for name in names:
+            matches = index.matches(name)
+            rows.append(state.row_of(matches[0]) if len(matches) == 1 else None)
+        return Snapshot(state).apply(None), rows
+    return context['commands'].request(Call(take), timeout=None)
+
+
+def match_names(matches, limit=10):
+    names = [b.name for b in matches[:limit]]
+    return f"{names} and {len(matches) - limit} more" if len(matches) > limit else str(names)
 
 
 def calculate_distance_3d(pos1, pos2):
@@ -507,6 +846,73 @@ def calculate_lagrange_points(body1, body2):
     print("-" * 70)
 
 
+UNITS = {'m': 1.0, 'km': 1e3, 'AU': AU}
+
+def row_name(bodies, n_bodies, row):
+    return bodies[row].name if row < n_bodies else f"particle {row - n_bodies}"
+
+def print_distance_matrix(names, matrix, unit):
+    """Print a distance matrix with one row and column per body."""
+    width = max(10, max(len(name) for name in names) + 1)
+    print(f"\nDistances ({unit}):")
+    print(" " * width + "".join(f"{name[:9]:>10}" for name in names))
+    for name, row in zip(names, matrix):
+        print(f"{name:<{width}}" + "".join(f"{d:10.3g}" for d in row))
+
+def print_nearest(bodies, n_bodies, index, distance):
+    """Print the nearest neighbour of every named body."""
+    from constants import AU
+    print(f"\nNearest neighbours of {n_bodies} body(ies):")
+    print("-" * 70)
+    for row in range(n_bodies):
+        if index[row] < 0:
+            print(f"{bodies[row].name:15} | none")
+            continue
+        print(f"{bodies[row].name:15} | {row_name(bodies, n_bodies, index[row]):20} | {distance[row]:.3e} m ({distance[row]/AU:.4f} AU)")
+    print("-" * 70)
+
+def print_nearest_summary(bodies, n_bodies, index, distance, count=10):
+    """Print nearest-neighbour statistics over all rows and the closest pairs."""
+    import numpy as np
+    from constants import AU
+    found = index >= 0
+    if not found.any():
+        print("Fewer than two rows in the simulation.")
+        return
+    d = distance[found]
+    print(f"\nNearest-neighbour distances over {len(d)} rows (AU):")
+    print(f"  min {d.min()/AU:.4e} | median {np.median(d)/AU:.4e} | mean {d.mean()/AU:.4e} | max {d.max()/AU:.4e}")
+    # Each close pair appears twice, once from each side
+    rows = np.flatnonzero(found)
+    rows = rows[np.argsort(distance[rows], kind='stable')]
+    rows = rows[rows < index[rows]][:count]
+    print(f"Closest pairs:")
+    for row in rows:
+        print(f"  {row_name(bodies, n_bodies, row):20} - {row_name(bodies, n_bodies, index[row]):20} {distance[row]:.3e} m ({distance[row]/AU:.4e} AU)")
+
+def print_lagrange_table(bodies, pos, pairs, mu, separation, points, positions=False):
+    """Print L1-L5 for every (secondary, primary) pair from analysis.lagrange_table."""
+    import numpy as np
+    from constants import AU
+    if not len(pairs):
+        print("No bodies with a massive parent in the simulation.")
+        return
+    print(f"\nLagrange points of {len(pairs)} pair(s):")
+    if positions:
+        print(f"{'Body':15} {'Point':5} {'x (AU)':>12} {'y (AU)':>12} {'z (AU)':>12}")
+        for (secondary, primary), pair_points in zip(pairs, points):
+            for k, point in enumerate(pair_points):
+                print(f"{bodies[secondary].name:15} L{k + 1:<4} {point[0]/AU:12.6f} {point[1]/AU:12.6f} {point[2]/AU:12.6f}")
+        return
+    # L1 and L2 from the secondary, L3 from the primary; L4 and L5 are one separation from both
+    from_secondary = np.linalg.norm(points[:, :2] - pos[pairs[:, 0]][:, None, :], axis=2)
+    from_primary = np.linalg.norm(points[:, 2] - pos[pairs[:, 1]], axis=1)
+    print(f"{'Body':15} {'Primary':12} {'mu':>10} {'Sep. (AU)':>11} {'L1 (km)':>12} {'L2 (km)':>12} {'L3 (AU)':>11}")
+    print("-" * 88)
+    for (secondary, primary), m, r, (l1, l2), l3 in zip(pairs, mu, separation, from_secondary, from_primary):
+        print(f"{bodies[secondary].name:15} {bodies[primary].name:12} {m:10.3e} {r/AU:11.5f} {l1/1e3:12.4g} {l2/1e3:12.4g} {l3/AU:11.5f}")
+
+
 def show_status(context):
     """Display current simulation status and settings."""
     print("\n" + "=" * 70)
@@ -518,6 +924,15 @@ def show_status(context):
     print(f"Paused:            {context.get('paused', 'N/A')}")
     print(f"Gravity Enabled:   {context.get('gravity_enabled', 'N/A')}")
     print(f"Integration Method: {context.get('integration_method', 'N/A')}")
+    import integration
+    print(f"Force Backend:     {integration.force_backend}")
+    print(f"Perturbations:     {', '.join(integration.perturbations) or 'none'}")
+    import collisions
+    print(f"Collisions:        {'ON' if collisions.enabled else 'OFF'}")
+    import encounters
+    print(f"Encounters:        {'ON' if encounters.enabled else 'OFF'}")
+    if 'evolution' in context:
+        print(f"Stellar Evolution: {'ON' if context['evolution'].enabled else 'OFF'} (every {context['evolution'].cadence} steps)")
     
     # Display settings
     print(f"\nDisplay Settings:")
@@ -528,6 +943,7 @@ def show_status(context):
     print(f"  Draw Empty:       {context.get('draw_trail_for_empty', 'N/A')}")
     print(f"  Display Names:   {context.get('display_names', 'N/A')}")
     print(f"  Gravity Field:   {context.get('gravity_field', False)}")
+    print(f"  Particle Render: {context.get('particle_render', True)}")
     
     # Simulation settings
     print(f"\nSimulation Settings:")
@@ -547,9 +963,26 @@ def show_status(context):
     else:
         print(f"  Timestep:        {timestep}")
     
+    scheduler = context.get('scheduler')
+    if scheduler is not None:
+        print(f"\nFrame Timing:")
+        print(f"  FPS:             {scheduler.fps:.1f} (target {scheduler.target_fps:g})")
+        phases = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in scheduler.phase_times.items())
+        print(f"  Phases:          {phases or 'N/A'}")
+        adaptive = "adaptive" if scheduler.adaptive else "fixed"
+        print(f"  Quality Level:   {scheduler.level} ({adaptive}) {scheduler.quality}")
+
+    monitor = context.get('monitor')
+    if monitor is not None:
+        print(f"\nConservation:")
+        show_conservation(monitor)
+
     # Body count
     bodies = context.get('bodies', [])
     print(f"\nBodies:            {len(bodies)}")
+    sim_state = context.get('state')
+    if sim_state is not None and sim_state.n_particles:
+        print(f"Particles:         {sim_state.n_particles}")
     if bodies:
         body_types = {}
         for body in bodies:
@@ -560,29 +993,53 @@ def show_status(context):
     print("=" * 70 + "\n")
 
 
+def show_conservation(monitor):
+    """Print the drift of the conserved quantities since the monitor's baseline."""
+    if monitor.samples == 0:
+        print(f"  No samples yet (checked every {monitor.cadence} steps)")
+        return
+    auto = "on" if monitor.auto_reduce else "off"
+    print(f"  Energy Drift:    {monitor.energy_drift:.2e} (max {monitor.max_energy_drift:.2e}, tolerance {monitor.tolerance:.0e})")
+    print(f"  Momentum Drift:  {monitor.momentum_drift:.2e}")
+    print(f"  Angular Drift:   {monitor.angular_momentum_drift:.2e}")
+    print(f"  Cadence:         every {monitor.cadence} steps, auto timestep {auto}")
+
+
+def set_body_mass_rate(state, body, rate):
+    """Set one body's mass rate; run it on the main loop, where its row cannot move."""
+    row = state.row_of(body)
+    if row is None:
+        raise ValueError(f"{body.name} is no longer part of the simulation")
+    state.set_mass_rates([row], rate)
+
+
+def mass_rates_report(state, limit=20):
+    """The rows changing mass and what their rates carried away so far; run it on the main loop."""
+    import numpy as np
+    from constants import SOLAR_MASS, YEAR
+    rows = np.flatnonzero(state.mdot)
+    if len(rows) == 0:
+        return "No bodies are changing mass."
+    lines = [f"{len(rows)} rows changing mass:"]
+    for row in rows[:limit].tolist():
+        lines.append(f"  {row_name(state.bodies, state.n_bodies, row):20} {state.mass[row]:.4e} kg  {state.mdot[row] * YEAR / SOLAR_MASS:+.3e} Msun/yr")
+    if len(rows) > limit:
+        lines.append(f"  ... and {len(rows) - limit} more")
+    lines.append(f"  Energy added so far: {state.mass_rate_ledger[0]:+.4e} J")
+    return "\n".join(lines)
+
+
 def focus_body(context, body_name):
     """Focus the camera on a specific body by name."""
-    bodies = context.get('bodies', [])
-    body = None
-    
-    # Try exact match first
-    for b in bodies:
-        if b.name.lower() == body_name.lower():
-            body = b
-            break
-    
-    # Try partial match if exact match failed
-    if body is None:
-        matches = [b for b in bodies if body_name.lower() in b.name.lower()]
-        if len(matches) == 1:
-            body = matches[0]
-        elif len(matches) > 1:
-            print(f"Multiple matches found: {[b.name for b in matches]}")
-            print("Please use a more specific name.")
-            return
+    matches = query_index(context, 'matches', body_name)
+    if len(matches) > 1:
+        print(f"Multiple matches found: {match_names(matches)}")
+        print("Please use a more specific name.")
+        return
     
-    if body:
-        context['focus_object'] = body
+    if matches:
+        body = matches[0]
+        set_setting(context, 'focus_object', body)
         from display import clear_body_trails
         clear_body_trails()
         print(f"Focus changed to {body.name}")
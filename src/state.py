@@ -0,0 +1,238 @@
+import numpy as np
+
+class SimulationState:
+    """
+    Contiguous position, velocity, mass and radius arrays for the simulation.
+
+    Row i belongs to bodies[i]. After a sync the body's `pos` and `vel` are
+    views into these arrays, so the integrators and the renderer can work on
+    the whole arrays without copying anything per body. Rows after the named
+    bodies are bulk particles (asteroids, debris) that have no Python object.
+
+    `mdot` holds the mass change per second of every row (stellar winds,
+    outgassing); the integrators use it for the masses inside a step and
+    `apply_mass_rates` advances the masses after it. That continuous change
+    is not a mass event: `masses_changed` (and `mass_version`) is for
+    discrete ones, rows added or removed, merges, edits, a remnant left by
+    a supernova, a row losing or gaining all its mass. Whatever derives
+    tables from the masses registers in `mass_listeners` to hear about them.
+    """
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.n_bodies = 0
+        self.pos = np.zeros((0, 3))
+        self.vel = np.zeros((0, 3))
+        self.mass = np.zeros(0)
+        self.radius = np.zeros(0)
+        self.color = np.zeros((0, 3), dtype=np.uint8)
+        self.mdot = np.zeros(0)
+        self.version = 0  # Bumped whenever rows are added or removed
+        self.mass_version = 0  # Bumped by mass events (masses_changed)
+        self.mass_listeners = []  # f(state), called by masses_changed
+        # Energy, momentum (3) and angular momentum (3) the mass rates have added to the system so far,
+        # negative when carried away; kept by simulation.run_simulation_array for the conservation monitor
+        self.mass_rate_ledger = np.zeros(7)
+        self._body_ids = []
+        self._rows = {}
+        self._edited = {}  # Body -> which of pos, vel, mass and radius were assigned since the last pull
+        self._list_changes = None
+        self.load_bodies()
+
+    @property
+    def n(self):
+        return len(self.mass)
+
+    @property
+    def n_particles(self):
+        return self.n - self.n_bodies
+
+    def load_bodies(self):
+        """Rebuild the named rows from the body objects, keeping the particle rows."""
+        K = len(self.bodies)
+        old = self.n_bodies
+        pos = np.zeros((K + self.n_particles, 3))
+        vel = np.zeros((K + self.n_particles, 3))
+        mass = np.zeros(K + self.n_particles)
+        radius = np.zeros(K + self.n_particles)
+        color = np.zeros((K + self.n_particles, 3), dtype=np.uint8)
+        mdot = np.zeros(K + self.n_particles)
+        pos[K:] = self.pos[old:]
+        vel[K:] = self.vel[old:]
+        mass[K:] = self.mass[old:]
+        radius[K:] = self.radius[old:]
+        color[K:] = self.color[old:]
+        mdot[K:] = self.mdot[old:]
+        for i, b in enumerate(self.bodies):
+            if id(b) in self._rows:
+                mdot[i] = self.mdot[self._rows[id(b)]]
+            pos[i] = b.pos
+            vel[i] = b.vel
+            mass[i] = b.mass
+            radius[i] = b.radius
+            color[i] = b.color if b.color is not None else (255, 255, 255)
+        self.pos, self.vel, self.mass, self.radius, self.color, self.mdot = pos, vel, mass, radius, color, mdot
+        self.n_bodies = K
+        self._body_ids = [id(b) for b in self.bodies]
+        self._rows = {body_id: i for i, body_id in enumerate(self._body_ids)}
+        self._edited.clear()
+        for b in self.bodies:
+            b.__dict__['_edited'] = self._edited
+        self.attach_views()
+        self._list_changes = getattr(self.bodies, 'changes', None)
+        self.version += 1
+        self.masses_changed()
+
+    def attach_views(self):
+        """Point every named body's pos and vel at its rows."""
+        for i, b in enumerate(self.bodies):
+            # Straight into the instance dict, so re-attaching does not count as an edit
+            b.__dict__['pos'] = self.pos[i]
+            b.__dict__['vel'] = self.vel[i]
+
+    def bodies_changed(self):
+        """Whether bodies were added to, removed from or replaced in the list since the rows were built."""
+        changes = getattr(self.bodies, 'changes', None)
+        if changes is not None:
+            return changes != self._list_changes
+        # A plain list: compare the entries
+        return len(self.bodies) != len(self._body_ids) or list(map(id, self.bodies)) != self._body_ids
+
+    def pull_bodies(self):
+        """
+        Bring the arrays up to date with the body objects.
+
+        Picks up bodies added or removed from the list and attributes that were
+        replaced from outside (e.g. `Earth.pos = ...` in the console or a
+        Horizons query), then re-attaches the views. Bodies report such
+        assignments themselves (body.__setattr__), so only the edited ones
+        are visited.
+        """
+        if self.bodies_changed():
+            self.load_bodies()
+            return
+        if not self._edited:
+            return
+        edited = list(self._edited.items())
+        self._edited.clear()
+        pos, vel, mass, radius = self.pos, self.vel, self.mass, self.radius
+        masses_changed = False
+        for b, names in edited:
+            i = self._rows.get(id(b))
+            if i is None:
+                continue
+            if 'pos' in names and getattr(b.pos, "base", None) is not pos:
+                pos[i] = b.pos
+                b.__dict__['pos'] = pos[i]
+            if 'vel' in names and getattr(b.vel, "base", None) is not vel:
+                vel[i] = b.vel
+                b.__dict__['vel'] = vel[i]
+            if 'mass' in names and mass[i] != b.mass:
+                mass[i] = b.mass
+                masses_changed = True
+            if 'radius' in names:
+                radius[i] = b.radius
+        if masses_changed:
+            self.masses_changed()
+
+    def masses_changed(self):
+        """Tell the mass listeners about a mass event; call it after changing `mass` directly."""
+        self.mass_version += 1
+        for listener in self.mass_listeners:
+            listener(self)
+
+    def set_masses(self, rows, masses):
+        """Write the masses of rows, and of their body objects so `pull_bodies` keeps them."""
+        rows = np.asarray(rows, dtype=np.int64)
+        self.mass[rows] = masses
+        for i in rows[rows < self.n_bodies].tolist():
+            self.bodies[i].mass = float(self.mass[i])
+        self.masses_changed()
+
+    def set_mass_rates(self, rows, rates):
+        """Mass change per second of rows, negative for mass loss."""
+        self.mdot[np.asarray(rows, dtype=np.int64)] = rates
+
+    def apply_mass_rates(self, dt):
+        """
+        Advance the masses of rows with a mass rate by dt, never below zero.
+
+        Only the arrays change; `push_masses` copies them to the body
+        objects once per frame. A row that loses or gains all its mass
+        changes which rows are sources, so that is a mass event. Returns the
+        number of rows changed.
+        """
+        rows = np.flatnonzero(self.mdot)
+        if len(rows):
+            old = self.mass[rows]
+            new = np.maximum(old + self.mdot[rows] * dt, 0.0)
+            self.mass[rows] = new
+            if np.any((old > 0) != (new > 0)):
+                self.masses_changed()
+        return len(rows)
+
+    def push_masses(self):
+        """Copy the masses of named rows with a mass rate to their body objects."""
+        for i in np.flatnonzero(self.mdot[:self.n_bodies]).tolist():
+            self.bodies[i].__dict__['mass'] = float(self.mass[i])  # Not an edit to pull back
+
+    def use_buffers(self, pos, vel, mass, radius, color):
+        """Move the arrays into caller-provided buffers of the same shapes, e.g. shared memory."""
+        pos[:] = self.pos
+        vel[:] = self.vel
+        mass[:] = self.mass
+        radius[:] = self.radius
+        color[:] = self.color
+        self.pos, self.vel, self.mass, self.radius, self.color = pos, vel, mass, radius, color
+        self.attach_views()
+        self.masses_changed()
+
+    def row_of(self, body):
+        """Row index of a body object, or None if it is not part of the state."""
+        return self._rows.get(id(body))
+
+    def add_particles(self, pos, vel, mass=None, radius=None, color=(200, 200, 200)):
+        """
+        Append bulk particles as rows without creating a body object for each.
+
+        `mass` defaults to zero (test particles) and `color` may be a single RGB
+        triple or one per particle.
+        """
+        pos = np.asarray(pos, dtype=float).reshape(-1, 3)
+        M = len(pos)
+        self.pos = np.concatenate([self.pos, pos])
+        self.vel = np.concatenate([self.vel, np.asarray(vel, dtype=float).reshape(M, 3)])
+        self.mass = np.concatenate([self.mass, np.zeros(M) if mass is None else np.broadcast_to(mass, M)])
+        self.radius = np.concatenate([self.radius, np.zeros(M) if radius is None else np.broadcast_to(radius, M)])
+        self.color = np.concatenate([self.color, np.broadcast_to(np.asarray(color, dtype=np.uint8), (M, 3))])
+        self.mdot = np.concatenate([self.mdot, np.zeros(M)])
+        # The arrays moved, so the named bodies need their views re-attached
+        self.attach_views()
+        self.version += 1
+        self.masses_changed()
+        return np.arange(self.n - M, self.n)
+
+    def clear_particles(self):
+        """Drop every particle row, keeping the named bodies."""
+        K = self.n_bodies
+        self.pos, self.vel = self.pos[:K].copy(), self.vel[:K].copy()
+        self.mass, self.radius, self.color = self.mass[:K].copy(), self.radius[:K].copy(), self.color[:K].copy()
+        self.mdot = self.mdot[:K].copy()
+        self.attach_views()
+        self.version += 1
+        self.masses_changed()
+
+    def remove_rows(self, rows):
+        """Delete rows, compacting the arrays; named bodies among them are removed from the body list too."""
+        keep = np.ones(self.n, dtype=bool)
+        keep[np.asarray(rows, dtype=np.int64)] = False
+        for i in sorted((i for i in set(rows) if i < self.n_bodies), reverse=True):
+            del self.bodies[i]  # In place: planet.bodies is the same list
+        self._list_changes = getattr(self.bodies, 'changes', None)
+        self.n_bodies = len(self.bodies)
+        self.pos, self.vel, self.mass, self.radius, self.color = self.pos[keep], self.vel[keep], self.mass[keep], self.radius[keep], self.color[keep]
+        self.mdot = self.mdot[keep]
+        self.attach_views()
+        self._body_ids = [id(b) for b in self.bodies]
+        self._rows = {body_id: i for i, body_id in enumerate(self._body_ids)}
+        self.version += 1
+        self.masses_changed()
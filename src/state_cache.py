@@ -0,0 +1,68 @@
+"""
+Content-addressed snapshots of fully resolved initial states.
+
+A snapshot holds the positions and velocities (SI units) of a set of
+bodies at one epoch in one reference frame, as a single (K, 6) float64
+.npy file named after a hash of (body ids, epoch, frame). Launches and
+ensemble workers asking for the same key get identical initial
+conditions without touching Horizons or the per-body cache, and can map
+the file instead of reading it.
+
+Example:
+    if not load_snapshot(bodies, epoch):
+        get_all_body_parameters(bodies, epoch=epoch)
+        save_snapshot(bodies, epoch)
+"""
+import hashlib
+import json
+import os
+import numpy as np
+
+CACHE_DIR = 'state_cache'
+FRAME = '500@10 ecliptic'  # Horizons center (the Sun) and reference plane used by query.py
+
+def snapshot_ids(bodies):
+    # Bodies without a Horizons id are defined by the scenario itself and not part of the snapshot
+    return sorted({int(b.id) for b in bodies if b.id is not None})
+
+def snapshot_key(ids, epoch, frame=FRAME):
+    description = json.dumps({'ids': list(ids), 'epoch': float(epoch), 'frame': frame}, sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()[:32]
+
+def snapshot_path(ids, epoch, frame=FRAME, directory=CACHE_DIR):
+    return os.path.join(directory, f"{snapshot_key(ids, epoch, frame)}.npy")
+
+def open_snapshot(ids, epoch, frame=FRAME, directory=CACHE_DIR):
+    """The memory-mapped (K, 6) rows of a snapshot in `ids` order, or None if there is none."""
+    path = snapshot_path(ids, epoch, frame, directory)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r')
+
+def load_snapshot(bodies, epoch, frame=FRAME, directory=CACHE_DIR):
+    """Set pos and vel of the bodies from a snapshot; returns False (and changes nothing) if there is none."""
+    ids = snapshot_ids(bodies)
+    rows = open_snapshot(ids, epoch, frame, directory)
+    if rows is None or len(rows) != len(ids):
+        return False
+    row_of = {body_id: k for k, body_id in enumerate(ids)}
+    for b in bodies:
+        if b.id is not None:
+            row = rows[row_of[int(b.id)]]
+            b.pos = np.array(row[:3])
+            b.vel = np.array(row[3:])
+    return True
+
+def save_snapshot(bodies, epoch, frame=FRAME, directory=CACHE_DIR):
+    """Write the current pos and vel of the bodies as the snapshot for this key and return its path."""
+    ids = snapshot_ids(bodies)
+    by_id = {int(b.id): b for b in bodies if b.id is not None}
+    rows = np.array([np.concatenate([by_id[body_id].pos, by_id[body_id].vel]) for body_id in ids], dtype=np.float64).reshape(-1, 6)
+    os.makedirs(directory, exist_ok=True)
+    path = snapshot_path(ids, epoch, frame, directory)
+    # Written under a temporary name first, so a worker never maps half a file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        np.save(f, rows)
+    os.replace(temporary, path)
+    return path
@@ -0,0 +1,229 @@
+"""
+Stellar evolution of every star in the simulation as one batched update.
+
+The per-object `Star.evolve` steps one star at a time through chained
+stage checks. Here mass, age, stage, hydrogen, helium, radius and
+temperature of all stars are arrays and one update ages them together,
+every `cadence` steps of the main loop rather than every step, so a
+cluster of thousands of stars costs a few array operations now and then.
+Radius and temperature are computed from the zero-age values and the
+current age, so the result does not depend on how often it runs, and
+colors come from a lookup table over temperature.
+
+The stages and thresholds are those of body.Star: stars under 0.5 solar
+masses stay on the main sequence, up to 8 solar masses they become red
+giants after 10 Gyr and white dwarfs after 12 Gyr, heavier ones become red
+supergiants after 5 Myr and go supernova after 10 Myr.
+
+Giants lose mass: red giants and supergiants blow winds, set as mass rates
+in state.mdot so the integrators see the mass drop smoothly, and a white
+dwarf or supernova leaves only its remnant mass at the moment of the stage
+change. Stages and lifetimes follow the zero-age mass, so a star does not
+change track as it loses mass.
+
+Example, in the main loop:
+    evolution = StellarEvolution(cadence=1000)
+    evolution.advance(state, steps, steps * timestep_seconds)
+"""
+import numpy as np
+from body import Star, STAR_COLORS
+from constants import DAY, SOLAR_MASS
+
+MAIN_SEQUENCE, RED_GIANT, WHITE_DWARF, RED_SUPERGIANT, SUPERNOVA = range(5)
+STAGES = ['main_sequence', 'red_giant', 'white_dwarf', 'red_supergiant', 'supernova']  # Star.stage names by code
+STAGE_CODES = {name: code for code, name in enumerate(STAGES)}
+STAGE_TITLES = ['Main Sequence star', 'Red Giant', 'White Dwarf', 'Red Supergiant', 'Supernova']
+
+GIGAYEAR = 1e9 * 365 * DAY  # Year of 365 days, as in body.Star
+MAIN_SEQUENCE_LIFETIME = 10 * GIGAYEAR  # Of one solar mass, scaling with mass**-3
+RED_GIANT_AGE = 10 * GIGAYEAR
+WHITE_DWARF_AGE = 12 * GIGAYEAR
+RED_SUPERGIANT_AGE = 5e-3 * GIGAYEAR
+SUPERNOVA_AGE = 1e-2 * GIGAYEAR
+HYDROGEN_BURN_RATE = 0.0001  # Content per second on the main sequence, as in Star.burn_hydrogen
+
+# Fraction of the zero-age mass blown away over each stage by winds, the length of the stage, and the
+# mass left at the end of a star's life
+STAGE_MASS_LOSS = np.array([0.0, 0.3, 0.0, 0.5, 0.0])
+STAGE_DURATION = np.array([np.inf, WHITE_DWARF_AGE - RED_GIANT_AGE, np.inf, SUPERNOVA_AGE - RED_SUPERGIANT_AGE, np.inf])
+WHITE_DWARF_MASS = 0.6 * SOLAR_MASS
+NEUTRON_STAR_MASS = 1.4 * SOLAR_MASS
+
+# Over the main sequence the radius grows by GROWTH and the temperature falls by COOLING (fractions of
+# the zero-age values); later stages scale the end-of-main-sequence radius and temperature by these
+MAIN_SEQUENCE_GROWTH = 1.0
+MAIN_SEQUENCE_COOLING = 0.5
+STAGE_RADIUS = np.array([1.0, 100.0, 0.01, 100.0, 100.0])
+STAGE_TEMPERATURE = np.array([1.0, 0.7, 1.5, 0.7, 0.7])
+
+TEMPERATURE_STEP = 50.0  # Kelvin per color table entry
+TEMPERATURE_MAX = 100000.0
+
+def color_table():
+    """Color by temperature with the thresholds of Star._get_color_from_temperature, one row per TEMPERATURE_STEP."""
+    # Entry k covers ((k - 1) * step, k * step], so thresholds on multiples of the step fall exactly on entry edges
+    t = np.arange(0, TEMPERATURE_MAX + TEMPERATURE_STEP, TEMPERATURE_STEP)[:, None]
+    conditions = [t > 20000, t > 10000, t > 7500, t > 6000, t > 5000, t > 3500]
+    choices = [[255, 255, 255], STAR_COLORS["O"], STAR_COLORS["B"], STAR_COLORS["A"], STAR_COLORS["F"], STAR_COLORS["G"]]
+    return np.select(conditions, [np.array(c)[None, :] for c in choices], np.array(STAR_COLORS["M"])[None, :]).astype(np.uint8)
+
+COLOR_TABLE = color_table()
+COLOR_LISTS = COLOR_TABLE.tolist()  # The same as lists, for body.color
+
+def color_index(temperature):
+    return np.clip(np.ceil(temperature / TEMPERATURE_STEP), 0, len(COLOR_TABLE) - 1).astype(np.int64)
+
+def main_sequence_lifetime(mass):
+    return MAIN_SEQUENCE_LIFETIME / (mass / SOLAR_MASS) ** 3
+
+def size_factors(age, lifetime, stage):
+    """Radius and temperature as multiples of the zero-age values."""
+    f = np.minimum(age / lifetime, 1.0)
+    return (1 + MAIN_SEQUENCE_GROWTH * f) * STAGE_RADIUS[stage], (1 - MAIN_SEQUENCE_COOLING * f) * STAGE_TEMPERATURE[stage]
+
+def mass_rates(initial_mass, stage, time_scale=1.0):
+    """Wind mass loss in kg per simulated second, negative; stars age `time_scale` times faster than the clock."""
+    return -STAGE_MASS_LOSS[stage] * initial_mass / STAGE_DURATION[stage] * time_scale
+
+def remnant_masses(mass, stage):
+    """Mass left after a stage change: white dwarfs and supernova remnants keep at most their remnant mass."""
+    remnant = np.where(stage == WHITE_DWARF, WHITE_DWARF_MASS, np.where(stage == SUPERNOVA, NEUTRON_STAR_MASS, np.inf))
+    return np.minimum(mass, remnant)
+
+def next_stages(mass, age, stage):
+    """The stage of every star at its age; stages only move forward."""
+    solar = mass / SOLAR_MASS
+    sun_like = (solar >= 0.5) & (solar <= 8)
+    massive = solar > 8
+    stage = stage.copy()
+    stage[sun_like & (age > RED_GIANT_AGE) & (stage == MAIN_SEQUENCE)] = RED_GIANT
+    stage[sun_like & (age > WHITE_DWARF_AGE) & ((stage == MAIN_SEQUENCE) | (stage == RED_GIANT))] = WHITE_DWARF
+    stage[massive & (age >= RED_SUPERGIANT_AGE) & (stage == MAIN_SEQUENCE)] = RED_SUPERGIANT
+    stage[massive & (age >= SUPERNOVA_AGE) & ((stage == MAIN_SEQUENCE) | (stage == RED_SUPERGIANT))] = SUPERNOVA
+    return stage
+
+class StellarEvolution:
+    """
+    Ages the Star bodies of a state together every `cadence` steps.
+
+    The arrays are rebuilt from the Star objects when rows are added or
+    removed. Results are written back to the objects (age, stage, radius,
+    temperature, hydrogen and helium, color when it changes class, mass
+    through state.set_masses), so the display, the state arrays and saved
+    scenarios see them. Each star remembers its zero-age mass as
+    `initial_mass`.
+    `time_scale` makes stars age that many times faster than the
+    simulation clock.
+    """
+    def __init__(self, cadence=1000, time_scale=1.0, enabled=True):
+        self.cadence = cadence
+        self.time_scale = time_scale
+        self.enabled = enabled
+        self.updates = 0
+        self.events = []  # (name, stage code) of the latest stage changes
+        self.stars = []
+        self.winds = False  # Whether mass rates are set in the state for any star
+        self._version = None
+        self._count = None
+        self._steps = 0
+        self._elapsed = 0.0
+
+    def track(self, state):
+        """Rebuild the arrays from the Star objects if rows changed since the last update."""
+        if state.version == self._version and len(state.bodies) == self._count:
+            return
+        self._version = state.version
+        self._count = len(state.bodies)
+        self.stars = [b for b in state.bodies if isinstance(b, Star)]
+        self.rows = np.array([state.row_of(b) for b in self.stars], dtype=np.int64)
+        self.age = np.array([b.age for b in self.stars], dtype=float)
+        self.stage = np.array([STAGE_CODES.get(b.stage, MAIN_SEQUENCE) for b in self.stars], dtype=np.int64)
+        self.hydrogen = np.array([b.hydrogen_content for b in self.stars], dtype=float)
+        self.helium = np.array([b.helium_content for b in self.stars], dtype=float)
+        for b in self.stars:
+            if getattr(b, 'initial_mass', None) is None:
+                b.initial_mass = b.mass
+        self.initial_mass = np.array([b.initial_mass for b in self.stars], dtype=float)
+        # The objects hold the current radius and temperature; work back to the zero-age values
+        radius_factor, temperature_factor = size_factors(self.age, main_sequence_lifetime(self.initial_mass), self.stage)
+        self.initial_radius = np.array([b.radius for b in self.stars], dtype=float) / radius_factor
+        self.initial_temperature = np.array([b.temperature for b in self.stars], dtype=float) / temperature_factor
+        self.color_index = color_index(self.initial_temperature * temperature_factor)
+
+    def advance(self, state, steps=1, elapsed=0.0, force=False):
+        """Count `steps` and `elapsed` simulated seconds and evolve if the cadence is due. Returns the number of stage changes."""
+        self._steps += steps
+        self._elapsed += elapsed
+        if not self.enabled:
+            self.stop_winds(state)
+            return 0
+        if not force and self._steps < self.cadence:
+            return 0
+        dt = self._elapsed * self.time_scale
+        self._steps = 0
+        self._elapsed = 0.0
+        self.track(state)
+        if not self.stars:
+            return 0
+        return self.update(state, dt)
+
+    def update(self, state, dt):
+        self.age += dt
+        # Hydrogen to helium on the main sequence
+        burned = np.where(self.stage == MAIN_SEQUENCE, np.minimum(self.hydrogen, HYDROGEN_BURN_RATE * dt), 0.0)
+        self.hydrogen -= burned
+        self.helium += burned
+
+        stage = next_stages(self.initial_mass, self.age, self.stage)
+        changed = np.flatnonzero(stage != self.stage)
+        self.stage = stage
+        radius_factor, temperature_factor = size_factors(self.age, main_sequence_lifetime(self.initial_mass), stage)
+        radius = self.initial_radius * radius_factor
+        temperature = self.initial_temperature * temperature_factor
+        colors = color_index(temperature)
+        recolored = np.flatnonzero(colors != self.color_index)
+        self.color_index = colors
+
+        state.radius[self.rows] = radius
+        state.color[self.rows[recolored]] = COLOR_TABLE[colors[recolored]]
+        rates = mass_rates(self.initial_mass, stage, self.time_scale)
+        state.set_mass_rates(self.rows, rates)
+        self.winds = bool(rates.any())
+        if len(changed):
+            mass = state.mass[self.rows[changed]]
+            remnant = remnant_masses(mass, stage[changed])
+            shed = np.flatnonzero(remnant < mass)
+            if len(shed):
+                state.set_masses(self.rows[changed[shed]], remnant[shed])
+        for b, age, r, t, h, he in zip(self.stars, self.age.tolist(), radius.tolist(), temperature.tolist(), self.hydrogen.tolist(), self.helium.tolist()):
+            b.age, b.radius, b.temperature, b.hydrogen_content, b.helium_content = age, r, t, h, he
+        for k in recolored:
+            self.stars[k].color = COLOR_LISTS[colors[k]]
+        self.events = []
+        for k in changed:
+            b = self.stars[k]
+            b.stage = STAGES[stage[k]]
+            b.has_changed_stage = True
+            if b.stage in b.has_evolved:
+                b.has_evolved[b.stage] = True
+            self.events.append((b.name, stage[k]))
+        self.updates += 1
+        self.report()
+        return len(changed)
+
+    def stop_winds(self, state):
+        """Clear the mass rates of the stars, so they stop losing mass while evolution is off."""
+        if self.winds:
+            self.track(state)
+            state.set_mass_rates(self.rows, 0.0)
+            self.winds = False
+
+    def report(self, limit=10):
+        for name, stage in self.events[:limit]:
+            print(f"{name} has become a {STAGE_TITLES[stage]}!")
+        if len(self.events) > limit:
+            print(f"... and {len(self.events) - limit} more stars changed stage")
+
+    def counts(self):
+        """Number of tracked stars in each stage."""
+        return {STAGES[code]: int(count) for code, count in enumerate(np.bincount(self.stage, minlength=len(STAGES))) if count} if self.stars else {}
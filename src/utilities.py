@@ -1,11 +1,10 @@
 import numpy as np
 import pygame
+import display
 from display import clear_body_trails
 
 def is_mouse_over_body(mouse_pos, body, focus_object, SCALE_DIST, screen):
-    focus_pos_pygame = np.array([screen.get_width() // 2, screen.get_height() // 2])
-    planet_pos_scaled = (body.pos[:2] - focus_object.pos[:2]) * SCALE_DIST
-    planet_pos_pygame = focus_pos_pygame + planet_pos_scaled
+    planet_pos_pygame = display.get_body_screen_position(body, focus_object, SCALE_DIST, screen)
     
     # Calculate the screen radius of the body
     body_radius_screen = body.radius * SCALE_DIST
@@ -25,6 +24,19 @@ def calculate_distance(pos1, pos2):
     return ((pos1[0] - pos2[0])**2 + (pos1[1] - pos2[1])**2)**0.5
 
 def find_closest_body(pos, bodies, SCALE_DIST, focus_object):
+    # Picking goes through the screen grid of the last frame when it matches the body list
+    grid = display.screen_grid
+    if grid is not None and bodies is display.state.bodies and len(grid.radii) == len(bodies):
+        index = grid.nearest(pos)
+        if index is not None:
+            return bodies[index]
+
+    # Nothing visible: fall back to the nearest projected body anywhere
+    camera = display.camera
+    if bodies is display.state.bodies and len(camera.screen_pos) >= len(bodies) > 0:
+        distance = np.sum((camera.screen_pos[:len(bodies)] - np.asarray(pos, dtype=float)) ** 2, axis=1)
+        return bodies[int(np.argmin(distance))]
+
     closest_body = None
     min_distance = float('inf')
     focus_pos_pygame = np.array([pygame.display.get_surface().get_width() // 2, pygame.display.get_surface().get_height() // 2])